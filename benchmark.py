@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark.py
+------------
+End-to-end benchmark of run_pipeline.py on synthetic scenarios
+(synthetic_scenario.py), tracked across commits. Runs offline.
+
+    python benchmark.py                                      # 1k and 10k vehicles
+    python benchmark.py --vehicles 1k,10k,100k,1M --to discharge
+    python benchmark.py --vehicles 100k --jobs 4 --set cohort_tolerance=0.5
+    python benchmark.py --history                            # results so far, per commit
+
+For every scale the scenario is generated once, into
+
+    benchmarks/scenarios/<vehicles>/     (reused while its ScenarioSpec is unchanged)
+
+and the pipeline runs as a separate process in benchmarks/runs/<vehicles>/,
+with its own config file (PIPELINE_CONFIG), every selected stage forced
+and metrics on (metrics.py). One row per stage, plus a "total" row, is
+appended to benchmarks/results.parquet:
+
+    run, commit, dirty, date, host, cpus, scale, vehicles, persons, events, jobs,
+    stages, stage, status, wall_s, cpu_s, peak_rss_mb, input_mb, metrics
+
+cpu_s is the CPU time of the process that ran the stage (worker pools the
+stage starts itself are in the phase records of the metrics file), and
+peak_rss_mb the peak of that process during the stage (on Linux; elsewhere
+the peak of the process up to the end of the stage, which with --jobs 1
+only grows, as every stage runs in the same process). After a
+run the stage times are printed next to the previous run of the same
+stages, scale and jobs, with the change in %.
+
+The largest scales take long to generate and to optimize: 1M vehicles is
+about 200M events (~2 GB gzipped) and an LP of 1M cohorts unless
+cohort_tolerance merges them; --to discharge stops before Step 5.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from dataclasses import asdict, replace
+import yaml
+import pandas as pd
+from synthetic_scenario import ScenarioSpec, generate_scenario, read_scenario
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+BENCH_DIR      = "benchmarks"
+RESULTS_FILE   = "results.parquet"
+SCALES         = [1_000, 10_000, 100_000, 1_000_000]   # vehicles
+DEFAULT_SCALES = [1_000, 10_000]                       # a few minutes on a laptop
+TYPICAL_DAYS   = 1                  # one typical day: Step 5 solves one LP per run
+PIPELINE       = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_pipeline.py")
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+def scenario_spec(vehicles: int, **overrides) -> ScenarioSpec:
+    """
+    Synthetic scenario with about `vehicles` cars: vehicles / car_share
+    persons, and a network that grows with them (10k – 1M links).
+    """
+    spec = replace(ScenarioSpec(typical_days=TYPICAL_DAYS), **overrides)
+    return replace(spec, agents=int(round(vehicles / spec.car_share)),
+                   links=overrides.get("links", min(max(vehicles, 10_000), 1_000_000)))
+
+
+def run_benchmark(vehicles: int, jobs=0, last=None, settings=None, folder=BENCH_DIR,
+                  spec: ScenarioSpec = None) -> pd.DataFrame:
+    """
+    Benchmark the pipeline on the scenario of about `vehicles` cars (see
+    module docstring): stages up to `last` (default: all), `jobs` worker
+    processes (0 = one per CPU core), settings added to the run's config.
+    Returns the rows appended to folder/results.parquet.
+    """
+    spec     = spec or scenario_spec(vehicles)
+    scenario = os.path.abspath(os.path.join(folder, "scenarios", str(vehicles)))
+    info     = read_scenario(scenario)
+    if info is None or info["spec"] != asdict(spec):
+        print(f"\n[Benchmark] Generating scenario with {spec.agents:,} persons...")
+        shutil.rmtree(scenario, ignore_errors=True)
+        generate_scenario(scenario, spec)
+        info = read_scenario(scenario)
+
+    run_dir = os.path.abspath(os.path.join(folder, "runs", str(vehicles)))
+    os.makedirs(run_dir, exist_ok=True)
+    config  = {"eqasim_output":   scenario,
+               "typical_days":    os.path.join(scenario, "TypicalDays.xlsx"),
+               "pipeline_output": "output",     # optimize.py / plot_results.py read ./output
+               "jobs":            jobs,
+               **(settings or {})}
+    config_path = os.path.join(run_dir, "config.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+
+    command = [sys.executable, PIPELINE, "--force", "--metrics", "--jobs", str(jobs)]
+    if last:
+        command += ["--to", last]
+    print(f"\n[Benchmark] {info['vehicles']:,} vehicles: {' '.join(command[1:])}")
+    start = time.perf_counter()
+    with open(os.path.join(run_dir, "pipeline.log"), "w") as log:
+        code = subprocess.run(command, cwd=run_dir, stdout=log, stderr=subprocess.STDOUT,
+                              env={**os.environ, "PIPELINE_CONFIG": config_path}).returncode
+    seconds = time.perf_counter() - start
+    if code != 0:
+        print(f"  ⚠ run_pipeline.py exited with {code}, see {os.path.join(run_dir, 'pipeline.log')}")
+
+    report_path = _latest_report(os.path.join(run_dir, "output", "metrics"), start_time=time.time() - seconds)
+    if report_path is None:
+        print("  ✗ No metrics file written, nothing recorded")
+        return pd.DataFrame()
+    with open(report_path) as f:
+        report = json.load(f)
+
+    rows = _stage_rows(report, seconds)
+    run  = {"run": time.strftime("%Y%m%d_%H%M%S"), **_git_state(), "date": pd.Timestamp.now(),
+            "host": platform.node(), "cpus": os.cpu_count(), "scale": vehicles,
+            "vehicles": info["vehicles"], "persons": info["persons"], "events": info["events"],
+            "jobs": report["info"]["jobs"], "stages": ",".join(report["info"]["selected"]),
+            "metrics": report_path}
+    rows = pd.DataFrame([{**run, **row} for row in rows])
+
+    results_path = os.path.join(folder, RESULTS_FILE)
+    previous     = read_results(folder)
+    pd.concat([previous, rows], ignore_index=True).to_parquet(results_path, index=False)
+    print_comparison(rows, previous)
+    return rows
+
+
+def read_results(folder=BENCH_DIR) -> pd.DataFrame:
+    path = os.path.join(folder, RESULTS_FILE)
+    return pd.read_parquet(path) if os.path.exists(path) else pd.DataFrame()
+
+
+def print_comparison(rows: pd.DataFrame, previous: pd.DataFrame) -> None:
+    """Stage times of a run next to the last earlier run of the same stages, scale and jobs."""
+    first  = rows.iloc[0]
+    before = pd.DataFrame()
+    if len(previous) and "stages" in previous:
+        same = previous[(previous["scale"] == first["scale"]) & (previous["jobs"] == first["jobs"])
+                        & (previous["stages"] == first["stages"])]
+        if len(same):
+            before = same[same["run"] == same["run"].max()].set_index("stage")
+    if len(before):
+        dirty = " + uncommitted changes" if before["dirty"].iloc[0] else ""
+        print(f"  → Compared with run {before['run'].iloc[0]} (commit {before['commit'].iloc[0]}{dirty})")
+    print(f"  {'stage':<10} {'status':<8} {'wall s':>9} {'prev s':>9} {'Δ':>8} {'cpu s':>9} {'peak MB':>9}")
+    for row in rows.itertuples():
+        prev = before["wall_s"].get(row.stage) if len(before) else None
+        change = (f"{(row.wall_s / prev - 1) * 100:+.1f}%"
+                  if prev is not None and pd.notna(prev) and prev > 0 and pd.notna(row.wall_s) else "")
+        print(f"  {row.stage:<10} {row.status:<8} {_num(row.wall_s, 2):>9} {_num(prev, 2):>9} {change:>8} "
+              f"{_num(row.cpu_s, 2):>9} {_num(row.peak_rss_mb, 0):>9}")
+
+
+def print_history(results: pd.DataFrame, stage="total") -> None:
+    """Wall time of one stage per run (rows) and scale (columns), oldest first."""
+    if not len(results):
+        print("No benchmark results yet")
+        return
+    rows  = results[results["stage"] == stage]
+    table = rows.pivot_table(index=["run", "commit", "dirty", "jobs"], columns="scale",
+                             values="wall_s", aggfunc="first")
+    print(f"Wall time of '{stage}' [s] per run and scale (vehicles):")
+    print(table.to_string(float_format=lambda v: f"{v:.1f}"))
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+def _stage_rows(report, seconds):
+    # One row per stage the run selected (from its "stage.<name>" phase),
+    # then the whole run
+    phases, records = report["phases"], report["records"]
+    selected = report["info"]["selected"]
+    rows = []
+    for name in selected:                 # in stage order; the others did not run
+        status = report["info"]["stages"][name]
+        p = phases.get(f"stage.{name}", {})
+        rows.append({"stage": name, "status": status, "wall_s": p.get("wall_s"), "cpu_s": p.get("cpu_s"),
+                     "peak_rss_mb": p.get("peak_rss_mb"),
+                     "input_mb": p["bytes"] / 1e6 if p.get("bytes") else None})
+    peaks = [r["peak_rss_mb"] for r in records if r["peak_rss_mb"] is not None]
+    rows.append({"stage": "total", "status": "failed" if any(r["status"] != "ran" for r in rows) else "ran",
+                 "wall_s": round(seconds, 3),
+                 "cpu_s": round(sum(r["cpu_s"] or 0.0 for r in rows), 3),
+                 "peak_rss_mb": max(peaks) if peaks else None,
+                 "input_mb": sum(r["input_mb"] or 0.0 for r in rows)})
+    return rows
+
+
+def _latest_report(metrics_dir, start_time):
+    # The metrics file of the run that just finished (written after start_time)
+    if not os.path.isdir(metrics_dir):
+        return None
+    reports = [os.path.join(metrics_dir, name) for name in os.listdir(metrics_dir) if name.endswith(".json")]
+    reports = [path for path in reports if os.path.getmtime(path) >= start_time]
+    return max(reports, key=os.path.getmtime) if reports else None
+
+
+def _git_state():
+    # Commit of the code being benchmarked and whether it has uncommitted changes
+    repo = os.path.dirname(PIPELINE)
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty  = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=repo,
+                                capture_output=True, text=True, check=True).stdout.strip() != ""
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": True}
+    return {"commit": commit, "dirty": dirty}
+
+
+def _parse_scale(text):
+    # "10000", "10k" or "1M"
+    text = text.strip().lower()
+    factor = {"k": 1_000, "m": 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip("km")) * factor)
+
+
+def _num(value, digits=1):
+    return "" if value is None or pd.isna(value) else f"{value:.{digits}f}"
+
+
+# ── Command line ──────────────────────────────────────────────────────────────
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark run_pipeline.py on synthetic scenarios.")
+    parser.add_argument("--vehicles", default=",".join(map(str, DEFAULT_SCALES)),
+                        help=f"comma-separated scales, e.g. 1k,10k,100k,1M (default: {DEFAULT_SCALES}; "
+                             f"tracked: {SCALES})")
+    parser.add_argument("--jobs", type=int, default=0, help="worker processes (0 = one per CPU core)")
+    parser.add_argument("--to", dest="last", help="last stage to run (e.g. discharge: no LP)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="config.yaml setting of the runs, e.g. solver=highs (repeatable)")
+    parser.add_argument("--days", type=int, default=TYPICAL_DAYS, help="typical days of the scenarios")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--folder", default=BENCH_DIR)
+    parser.add_argument("--history", action="store_true", help="print the results so far and exit")
+    args = parser.parse_args(argv)
+
+    if args.history:
+        print_history(read_results(args.folder))
+        return 0
+    settings = {}
+    for item in args.set:
+        key, _, value = item.partition("=")
+        settings[key.strip()] = yaml.safe_load(value)
+
+    failed = False
+    for vehicles in map(_parse_scale, args.vehicles.split(",")):
+        spec = scenario_spec(vehicles, typical_days=args.days, seed=args.seed)
+        rows = run_benchmark(vehicles, jobs=args.jobs, last=args.last, settings=settings,
+                             folder=args.folder, spec=spec)
+        failed |= not len(rows) or (rows["status"] != "ran").any()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -15,24 +15,42 @@ data structures consumed by the multi-node LP in optimize.py:
                                            slot_start, slot_end,
                                            activity_type
 
-Current node definition  : node_id = link_id where the vehicle is parked.
-Future spatial upgrade   : replace the single assignment line with a
-                           link_to_block mapping built by spatial clustering.
+Node definition:
+    default      node_id = link_id where the vehicle is parked
+                 (one electrical node per road segment)
+    cell_size    node_id = grid cell of the link midpoint — one node per
+                 occupied cell_size x cell_size square [m]
+    n_blocks     node_id = k-means cluster of the link midpoints — n_blocks
+                 nodes of nearby parking links
+
+Both clusterings (spatial_blocks) are vectorised: a grid cell is a floor
+division, a k-means step is one KD-tree query over the cluster centres. A
+few seconds for all 718k links of the network.
 """
 
 import os
+import numpy as np
 import pandas as pd
+from network_parser import arrays_from_dicts, link_rows
 
 # ── Constants ─────────────────────────────────────────────────────────────────
 SLOT_DURATION = 900   # seconds per time slot (15 min)
 N_SLOTS       = 96    # slots in one day
 
+KMEANS_MAX_ITER = 25        # Lloyd iterations of the n_blocks clustering
+KMEANS_TOL      = 1.0       # [m] stop once no cluster centre moves further
+KMEANS_SAMPLE   = 200_000   # centres are fitted on at most this many links, then every link is assigned
+KMEANS_SEED     = 0         # fixed, so a rerun gives the same blocks
+
 # ── Main function ─────────────────────────────────────────────────────────────
 def build_node_mapping(
     timetable  : pd.DataFrame,
     links      : dict,
     nodes      : dict,
     output_dir : str,
+    network    = None,
+    cell_size  : float = None,
+    n_blocks   : int   = None,
 ) -> tuple[pd.DataFrame, pd.DataFrame]:
     """
     Parameters
@@ -42,12 +60,23 @@ def build_node_mapping(
         parked episodes for every vehicle.
     links      : dict[str -> Link]
         Returned by network_parser.parse_network().
-        Used to look up from_node / to_node so we can derive link coordinates.
+        Used for from_node / to_node so we can derive link coordinates
+        (converted once with network_parser.arrays_from_dicts).
     nodes      : dict[str -> Node]
         Returned by network_parser.parse_network().
         Each Node carries .x and .y in the projected CRS.
     output_dir : str
         Folder where output files are written (matches OUTPUT_DIR in config).
+    network    : NetworkArrays or None
+        Columnar network from network_parser.parse_network_arrays() or
+        network_cache.load_network(). When given, links and nodes are not
+        used (pass None) and coordinates are gathered from its arrays.
+    cell_size  : float or None
+        Grid cell edge [m]: parking links whose midpoints share a cell
+        become one node (see spatial_blocks).
+    n_blocks   : int or None
+        Number of k-means blocks instead of a grid. Give at most one of
+        cell_size / n_blocks; with neither, every parking link is a node.
 
     Returns
     -------
@@ -72,17 +101,64 @@ def build_node_mapping(
         (timetable["link_id"].notna())].copy()                      # drop any row missing a link
     
 
-    # ── 2. Assign node_id ─────────────────────────────────────────────────────
+    # ── 2. Link coordinates ───────────────────────────────────────────────────
     #
-    # For now: node_id = link_id (one electrical node per road segment).
-    # This is the ONLY line to change when spatial aggregation is added later.
-    # At that point you will build a  link_to_block  dict  (link_id -> block_id)
-    # from a clustering step and replace the line below with:
-    #   parking["node_id"] = parking["link_id"].map(link_to_block)
-    
-    parking["node_id"] = parking["link_id"]
+    # We want the (x, y) coordinates of every link a vehicle parks on: they
+    # place the nodes, and the spatial clustering below groups links by them.
+    #
+    # The Link dataclass in network_parser.py does NOT carry x/y directly —
+    # only Node objects do. Each Link has a from_node and to_node attribute.
+    # We take the midpoint of the two endpoint nodes as the link's representative
+    # coordinate. This is good enough for visualisation and for clustering.
+    #
+    # Step A: get the unique link_ids from the parking table.
+    #   drop_duplicates() keeps only the first occurrence of each link, so
+    #   every coordinate is looked up once however often the link is used.
+    unique_nodes = (
+        parking[["link_id"]]
+        .drop_duplicates()
+        .copy()
+    )
+
+    # Step B: the midpoint of every network link is computed once, as one
+    # (L, 2) array (NetworkArrays.link_midpoints, one gather of both end nodes
+    # over all links). Without a NetworkArrays table the Link / Node dicts are
+    # first converted to one (arrays_from_dicts), so both inputs take the
+    # same path.
+    if network is None:
+        network = arrays_from_dicts(links, nodes)
 
-    # ── 3. Convert episode times to slot indices ──────────────────────────────
+    # Step C: gather the midpoint of each parking link by its row. The rows
+    # are found by binary search (integer link ids already are rows);
+    # unknown links get NaN.
+    rows  = link_rows(network, unique_nodes["link_id"])
+    known = rows >= 0
+    mid   = np.full((len(rows), 2), np.nan)
+    mid[known] = network.link_midpoints[rows[known]]
+    unique_nodes["x"] = mid[:, 0]
+    unique_nodes["y"] = mid[:, 1]
+
+    # ── 3. Assign node_id ─────────────────────────────────────────────────────
+    #
+    # Without clustering: node_id = link_id (one electrical node per road
+    # segment). With cell_size or n_blocks, spatial_blocks() maps every
+    # parking link to a block number and the link_to_block mapping replaces
+    # the link as the node:  tens of thousands of parking links become a few
+    # hundred or thousand nodes, which is what keeps a node-level LP small.
+    #
+    # Links without coordinates (not in the network) cannot be placed and
+    # share block -1.
+    if cell_size is None and n_blocks is None:
+        parking["node_id"] = parking["link_id"]
+        unique_nodes["node_id"] = unique_nodes["link_id"]
+    else:
+        unique_nodes["node_id"] = spatial_blocks(unique_nodes[["x", "y"]].to_numpy(dtype=np.float64),
+                                                 cell_size=cell_size, n_blocks=n_blocks)
+        link_to_block = pd.Series(unique_nodes["node_id"].to_numpy(),
+                                  index=unique_nodes["link_id"].to_numpy())
+        parking["node_id"] = parking["link_id"].map(link_to_block).to_numpy()
+
+    # ── 4. Convert episode times to slot indices ──────────────────────────────
     #
     # The LP works in 15-min slots numbered 0 … 95.
     # We need to know: for this parking episode, which slots does it span?
@@ -103,7 +179,7 @@ def build_node_mapping(
     parking["slot_start"] = (parking["t_start"] / SLOT_DURATION).apply(int).clip(0, N_SLOTS - 1)
     parking["slot_end"]   = (parking["t_end"]   / SLOT_DURATION).apply(int).clip(0, N_SLOTS)
 
-    # ── 4. Build parking assignment table ────────────────────────────────────
+    # ── 5. Build parking assignment table ────────────────────────────────────
     #
     # This table has ONE ROW PER PARKING EPISODE (not one row per slot).
     # The LP will later expand each episode into individual slots when building
@@ -126,60 +202,18 @@ def build_node_mapping(
     # discards the old index (which came from the filtered timetable and would
     # have gaps like 0, 3, 7, … making the file confusing to read).
 
-    # ── 5. Build node registry ────────────────────────────────────────────────
+    # ── 6. Build node registry ────────────────────────────────────────────────
     #
-    # We want one row per unique node_id with its (x, y) coordinates.
-    #
-    # The Link dataclass in network_parser.py does NOT carry x/y directly —
-    # only Node objects do. Each Link has a from_node and to_node attribute.
-    # We take the midpoint of the two endpoint nodes as the link's representative
-    # coordinate. This is good enough for visualisation and future clustering.
-    #
-    # Step A: get the unique (node_id, link_id) pairs from the parking table.
-    #   drop_duplicates("node_id") keeps only the first occurrence of each node,
-    #   which is all we need since node_id == link_id for now.
-    unique_nodes = (
-        parking[["node_id", "link_id"]]
-        .drop_duplicates("node_id")
-        .copy()
+    # One row per unique node_id with its (x, y) coordinates. A node that
+    # groups several links sits at the mean of their midpoints; for a
+    # one-link node that is just the link midpoint.
+    nodes_df = (
+        unique_nodes.groupby("node_id", sort=False)[["x", "y"]]
+        .mean()
+        .reset_index()
     )
 
-    # Step B: define two helper functions that look up x and y for a link_id.
-    #
-    # links.get(lid) returns the Link object if lid exists, or None if not.
-    # If the Link exists, we get its from_node and to_node IDs.
-    # We then look up those IDs in the nodes dict to get the Node objects,
-    # and return the average of their x (or y) coordinates.
-    # If anything is missing, we return None gracefully.
-    def _link_x(lid: str):
-        lk = links.get(lid)
-        if lk is None:
-            return None
-        n1 = nodes.get(lk.from_node)   # Node object at the start of the link
-        n2 = nodes.get(lk.to_node)     # Node object at the end of the link
-        if n1 is None or n2 is None:
-            return None
-        return (n1.x + n2.x) / 2       # midpoint x coordinate
-
-    def _link_y(lid: str):
-        lk = links.get(lid)
-        if lk is None:
-            return None
-        n1 = nodes.get(lk.from_node)
-        n2 = nodes.get(lk.to_node)
-        if n1 is None or n2 is None:
-            return None
-        return (n1.y + n2.y) / 2       # midpoint y coordinate
-
-    # Step C: apply the helper functions to each link_id in the unique_nodes table.
-    # .map(func) applies func to every value in the column and returns a new Series.
-    unique_nodes["x"] = unique_nodes["link_id"].map(_link_x)
-    unique_nodes["y"] = unique_nodes["link_id"].map(_link_y)
-
-    # Step D: keep only the three columns we actually need and reset the index.
-    nodes_df = unique_nodes[["node_id", "x", "y"]].reset_index(drop=True)
-
-    # ── 6. Write outputs to disk ──────────────────────────────────────────────
+    # ── 7. Write outputs to disk ──────────────────────────────────────────────
     #
     # os.makedirs(..., exist_ok=True) creates the output folder if it doesn't
     # exist yet; if it already exists, it does nothing (no error).
@@ -193,12 +227,83 @@ def build_node_mapping(
     # index=False prevents pandas from writing the row numbers (0,1,2,…) as
     # a separate column in the parquet file — we don't need them.
 
-    # ── 7. Print summary ──────────────────────────────────────────────────────
-    print(f"  → {len(nodes_df):,} unique nodes (one per parking link)")
+    # ── 8. Print summary ──────────────────────────────────────────────────────
+    if cell_size is None and n_blocks is None:
+        print(f"  → {len(nodes_df):,} unique nodes (one per parking link)")
+    else:
+        print(f"  → {len(nodes_df):,} unique nodes ({len(unique_nodes):,} parking links in spatial blocks)")
+        if (unique_nodes["node_id"] < 0).any():
+            print(f"  ⚠ {(unique_nodes['node_id'] < 0).sum():,} parking links without coordinates share node -1")
     print(f"  → {len(assignments_df):,} parking episodes assigned")
     print(f"  → {assignments_df['vehicle_id'].nunique():,} vehicles with ≥1 parked episode")
     print(f"  → Activity type breakdown:")
     for atype, cnt in assignments_df["activity_type"].value_counts(dropna=False).items():
         print(f"       {str(atype):20s}: {cnt:,}")
 
-    return nodes_df, assignments_df
\ No newline at end of file
+    return nodes_df, assignments_df
+
+# ── Spatial clustering ────────────────────────────────────────────────────────
+def spatial_blocks(xy, cell_size=None, n_blocks=None) -> np.ndarray:
+    """
+    Block number 0 … B-1 of every point of xy (n, 2), -1 where a coordinate
+    is NaN. Give exactly one of:
+
+        cell_size  grid hashing — one block per occupied cell_size x cell_size
+                   square [m]. The grid is anchored at (0, 0), so a link
+                   falls in the same cell whichever links are clustered.
+        n_blocks   k-means — n_blocks blocks of nearby points (fewer if
+                   there are fewer distinct points).
+
+    Blocks are numbered in sorted order of their cell / cluster, so the
+    numbering only depends on the points.
+    """
+    if (cell_size is None) == (n_blocks is None):
+        raise ValueError("spatial_blocks() needs either cell_size or n_blocks")
+
+    xy     = np.asarray(xy, dtype=np.float64)
+    known  = ~np.isnan(xy).any(axis=1)
+    blocks = np.full(len(xy), -1, dtype=np.int64)
+    if not known.any():
+        return blocks
+    pts = xy[known]
+
+    if cell_size is not None:
+        # Cell (i, j) of every point, flattened to one int64 key per cell
+        cell = np.floor(pts / cell_size).astype(np.int64)
+        cell -= cell.min(axis=0)
+        key   = cell[:, 0] * (cell[:, 1].max() + 1) + cell[:, 1]
+    else:
+        key = _kmeans(pts, n_blocks)
+
+    # Occupied cells / non-empty clusters renumbered 0 … B-1
+    _, blocks[known] = np.unique(key, return_inverse=True)
+    return blocks
+
+
+def _kmeans(pts, k, seed=KMEANS_SEED):
+    # Lloyd's algorithm: the nearest centre of every point is one KD-tree
+    # query (on all cores), the new centres are per-cluster means by bincount.
+    # The centres are fitted on a random sample, then every point is assigned.
+    from scipy.spatial import cKDTree     # only the k-means path needs scipy
+    rng    = np.random.default_rng(seed)
+    sample = pts
+    if len(pts) > KMEANS_SAMPLE:
+        sample = pts[rng.choice(len(pts), size=KMEANS_SAMPLE, replace=False)]
+    k       = min(int(k), len(sample))
+    centres = sample[rng.choice(len(sample), size=k, replace=False)]
+
+    for _ in range(KMEANS_MAX_ITER):
+        _, nearest = cKDTree(centres).query(sample, workers=-1)
+        count  = np.bincount(nearest, minlength=k)
+        filled = count > 0                   # an empty cluster keeps its centre
+        new    = centres.copy()
+        for axis in range(2):
+            new[filled, axis] = (np.bincount(nearest, weights=sample[:, axis], minlength=k)[filled]
+                                 / count[filled])
+        moved   = np.sqrt(((new - centres) ** 2).sum(axis=1)).max()
+        centres = new
+        if moved < KMEANS_TOL:
+            break
+
+    _, nearest = cKDTree(centres).query(pts, workers=-1)
+    return nearest
@@ -0,0 +1,397 @@
+# -*- coding: utf-8 -*-
+"""
+decomposition.py
+----------------
+Distributed solution of the fleet charging LP (optimize.py) by ADMM.
+
+The only constraint that couples vehicles is the per-slot power balance
+    PPV[t] + P_imp[t] - P_exp[t] = sum_v Pc[v, t]
+so the LP is a "sharing" problem: every vehicle (or cohort of identical
+vehicles, see optimize.build_cohorts) picks a feasible charging schedule,
+and the grid pays for the total. ADMM alternates between
+
+    x-update — each vehicle projects a target schedule onto its own
+               feasible set (parking, SOC limits, SOC dynamics, cyclic SOC).
+               Vehicles are independent: they are solved in chunks, each
+               chunk living in one worker process (a local process, or any
+               executor with submit() such as one on another machine). The
+               chunk state stays in its worker; an iteration only sends the
+               per-slot price shift and returns the chunk's per-slot total.
+    z-update — the grid picks the total charging per slot that balances
+               cost against the vehicles' proposal (closed form).
+    u-update — the running balance mismatch, i.e. the slot price signal.
+
+The penalty rho is rebalanced every RHO_EVERY iterations so that the
+relative primal (balance) and dual (agent movement) residuals stay of the
+same size (Boyd et al. section 3.4.1). Once the balance residual, converted
+to cost [€], is below TOL_REL * |cost| + TOL_ABS, every chunk solves its
+vehicles' LP at the current slot prices: together they give a lower bound
+on the optimum (Lagrangian dual), and the iterations stop when the cost is
+within the same tolerance of that bound. The dual residual is no stopping
+test on its own: the SOC level drifts slowly under self-discharge, which
+keeps it small far from the optimum.
+Each vehicle projection is a small QP; all
+vehicles share the same constraint matrix, so a chunk is solved by
+vectorized inner ADMM iterations around one shared, precomputed KKT solve
+(warm-started from the previous outer iteration).
+"""
+
+import os
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+import numpy as np
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from lp_solvers import LPSolution, solve_lp
+from optimize import (N_SLOTS, DT, P_MAX, CAP_EV, SOC_MIN, SOC_MAX, ETA_SQRT,
+                      SD_EV_PER_SLOT, C_SELL, build_fleet_lp)
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+CHUNK_SIZE      = 2000          # vehicles per worker task
+MAX_ITER        = 2000          # outer (price) iterations
+TOL_REL         = 1e-3          # cost gap, relative to the cost
+TOL_ABS         = 1e-3          # [€] cost gap, absolute
+RHO_SCALE       = 1.0           # initial rho = RHO_SCALE * mean buy price slope / P_MAX
+RHO_EVERY       = 25            # iterations between rho updates
+RHO_BALANCE     = 5.0           # rebalance when the relative residuals differ by more than this
+RHO_MAX_STEP    = 10.0          # largest rho change of one update
+CHECK_EVERY     = 25            # iterations between dual bound computations
+INNER_SIGMA     = 1.0           # step of the inner projection ADMM
+INNER_ALPHA     = 1.6           # over-relaxation of the inner projection ADMM
+INNER_TOL       = 1e-6          # [kW / kWh] inner convergence
+INNER_MAX_ITER  = 500
+
+N_VARS = 2 * N_SLOTS + 1        # per vehicle: Pc[0..95], SOC[0..96]
+
+
+# ── Result ────────────────────────────────────────────────────────────────────
+@dataclass
+class ADMMResult:
+    Pc:         np.ndarray      # (V, N_SLOTS) charging power of each row [kW]
+    SOC:        np.ndarray      # (V, N_SLOTS + 1) state of charge [kWh]
+    P_imp:      np.ndarray      # (N_SLOTS,) grid import [kW]
+    P_exp:      np.ndarray      # (N_SLOTS,) grid export [kW]
+    prices:     np.ndarray      # (N_SLOTS,) slot price signal [€/kWh]
+    objective:  float           # cost of the returned schedule [€]
+    gap:        float           # cost above the dual bound of the last check [€] (inf without one)
+    iterations: int
+    residual:   float           # final max |sum_v Pc - grid total| [kW]
+    converged:  bool
+    seconds:    float
+
+    def as_lp_solution(self) -> LPSolution:
+        """
+        Same schedule as an LPSolution over optimize.build_fleet_lp's variable
+        vector, so that optimize.split_solution() reads it. Status is
+        "converged", or "iteration_limit" without a solution (x is None): the
+        schedule of an unconverged run can be far from the optimum.
+        """
+        if not self.converged:
+            return LPSolution("iteration_limit", float("nan"), None, "admm", self.seconds)
+        x = np.concatenate([self.Pc.ravel(), self.SOC.ravel(), self.P_imp, self.P_exp])
+        return LPSolution("converged", self.objective, x, "admm", self.seconds)
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+def solve_admm(Parked, E_cons, PPV, C_buy, weights=None, executors=None, jobs=1,
+               chunk_size=CHUNK_SIZE, rho=None, max_iter=MAX_ITER,
+               tol_rel=TOL_REL, tol_abs=TOL_ABS, solver="auto", verbose=True) -> ADMMResult:
+    """
+    Solve the fleet charging LP by price-coordinated decomposition.
+
+    Parameters
+    ----------
+    Parked, E_cons : (V, N_SLOTS) arrays — as in optimize.build_fleet_lp
+    PPV, C_buy     : (N_SLOTS,) arrays   — PV power [kW], buy price [€/kWh]
+    weights        : (V,) or None        — vehicles represented by each row (cohorts)
+    executors      : list of objects with submit(fn, *args) -> future, each
+                     running its tasks in one persistent process (chunk k
+                     stays in executors[k % len(executors)]), or None to use
+                     `jobs` local worker processes (1 = in this process,
+                     0 or None = one per CPU core)
+    rho            : initial ADMM penalty [€ per kW² and slot], default from
+                     the buy price; rebalanced during the iterations
+    tol_rel, tol_abs : stop when cost - dual bound <= tol_rel * |cost| + tol_abs.
+                     The bound is computed (at most every CHECK_EVERY
+                     iterations) once the cost of the balance residual,
+                     |price·r| + sum_t slope_buy[t] |r[t]|, is below the same
+                     tolerance and every chunk projection has converged
+    solver         : LP solver of the dual bound (see lp_solvers.solve_lp)
+
+    Without convergence within max_iter iterations the result has
+    converged=False and as_lp_solution() carries no schedule.
+    """
+    start  = time.perf_counter()
+    Parked = np.asarray(Parked)
+    E_cons = np.asarray(E_cons, dtype=np.float64)
+    PPV    = np.asarray(PPV, dtype=np.float64)
+    C_buy  = np.asarray(C_buy, dtype=np.float64)
+    V      = len(Parked)
+    w      = np.ones(V) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    if np.any(C_buy < C_SELL):
+        # Buying below the sell price would make the LP unbounded (import + export)
+        raise ValueError("C_buy must be >= C_SELL in every slot")
+
+    slope_buy  = DT * C_buy                 # [€ per kW over one slot]
+    slope_sell = DT * C_SELL
+    if rho is None:
+        rho = RHO_SCALE * float(np.mean(slope_buy)) / P_MAX
+
+    chunks = [slice(i, min(i + chunk_size, V)) for i in range(0, V, chunk_size)]
+    ub     = P_MAX * Parked.astype(np.float64)
+
+    jobs     = jobs or os.cpu_count() or 1
+    own_pool = executors is None and jobs > 1
+    if own_pool:
+        # One single-process pool per worker, so that a chunk always returns
+        # to the process that holds its state
+        executors = [ProcessPoolExecutor(max_workers=1) for _ in range(min(jobs, len(chunks)))]
+    elif executors is None:
+        executors = [_InProcess()]
+    run_id = uuid.uuid4().hex
+    keys   = [(run_id, k) for k in range(len(chunks))]
+    owner  = [executors[k % len(executors)] for k in range(len(chunks))]
+    opened = []
+    next_check = 1
+
+    # Agent i proposes x_i = w_i * Pc_i [kW]; X, Z, U are the fleet totals of
+    # x, z and the scaled dual u (Boyd et al., "sharing" ADMM, section 7.3).
+    # The agents' x stays in the chunk workers, only X comes back.
+    X = np.zeros(N_SLOTS)
+    Z = np.zeros(N_SLOTS)
+    U = np.zeros(N_SLOTS)
+    n_agents = V
+
+    converged = False
+    gap = np.inf
+    try:
+        for f in [owner[k].submit(_open_chunk, keys[k], ub[c], E_cons[c], w[c])
+                  for k, c in enumerate(chunks)]:
+            f.result()
+        opened = list(range(len(chunks)))
+
+        for it in range(1, max_iter + 1):
+            # ── x-update: every agent projects x_i - shift onto its feasible set
+            shift = (X - Z + U) / n_agents
+            parts = [f.result() for f in [owner[k].submit(_step_chunk, keys[k], shift)
+                                          for k in range(len(chunks))]]
+            X_prev = X
+            X        = sum(p[0] for p in parts) if parts else np.zeros(N_SLOTS)
+            moved_sq = sum(p[1] for p in parts)         # sum_i ||x_i - x_i_prev||²
+            exact    = all(p[2] for p in parts)         # every projection converged
+
+            # ── z-update: grid total per slot, cost slope depends on import / export
+            a      = U + X
+            step   = n_agents / rho
+            Z_prev = Z
+            Z = np.where(a - step * slope_buy > PPV, a - step * slope_buy,
+                np.where(a - step * slope_sell < PPV, a - step * slope_sell, PPV))
+
+            # ── u-update: accumulated balance mismatch
+            U = U + X - Z
+
+            # ── Residuals: primal r = X - Z [kW]; dual s_i = rho (x_i - x_i_prev - d)
+            # with d the change of the shared mean, summed without gathering x
+            r      = X - Z
+            d      = (X - X_prev - Z + Z_prev) / n_agents
+            s_norm = rho * np.sqrt(max(moved_sq - 2 * d @ (X - X_prev) + n_agents * d @ d, 0.0))
+            price  = rho * U / n_agents                 # [€ per kW and slot]
+            cost   = _grid_cost(X, PPV, slope_buy, slope_sell)
+            tol    = tol_rel * abs(cost) + tol_abs
+            if verbose and (it == 1 or it % 50 == 0):
+                print(f"    iter {it:5d} | balance residual {np.linalg.norm(r):10.4f} kW | "
+                      f"dual residual {s_norm:.2e} | cost {cost:10.2f} € | rho {rho:.2e}")
+
+            # ── Stop on the dual bound, computed once the balance holds
+            balanced = abs(price @ r) + slope_buy @ np.abs(r) <= tol
+            if exact and balanced and it >= next_check:
+                gap = cost - _dual_bound(owner, keys, price, PPV, slope_buy, slope_sell, solver)
+                if verbose:
+                    print(f"    iter {it:5d} | cost {cost:10.2f} € | {gap:8.4f} € above the dual bound")
+                if gap <= tol:
+                    converged = True
+                    break
+                next_check = it + CHECK_EVERY
+
+            # ── Residual balancing: rescale rho (and the scaled dual with it)
+            # towards equal relative primal and dual residuals
+            if it % RHO_EVERY == 0:
+                r_rel = np.linalg.norm(r) / max(np.linalg.norm(X), np.linalg.norm(Z), 1e-12)
+                s_rel = s_norm / max(np.linalg.norm(price) * np.sqrt(n_agents), 1e-12)
+                ratio = np.sqrt(r_rel / max(s_rel, 1e-12))
+                if not 1 / RHO_BALANCE <= ratio ** 2 <= RHO_BALANCE:
+                    ratio = min(max(ratio, 1 / RHO_MAX_STEP), RHO_MAX_STEP)
+                    rho  *= ratio
+                    U    /= ratio
+
+        # ── Schedule: the vehicles' own (feasible) proposal, grid covers the rest
+        states = [f.result() for f in [owner[k].submit(_close_chunk, keys[k]) for k in opened]]
+        opened = []
+    finally:
+        if own_pool:
+            for executor in executors:
+                executor.shutdown(cancel_futures=True)
+        else:
+            for k in opened:                        # failed run: free the chunk state
+                owner[k].submit(_close_chunk, keys[k])
+
+    Pc  = np.vstack([s[:, :N_SLOTS] for s in states]) if chunks else np.zeros((0, N_SLOTS))
+    SOC = np.vstack([s[:, N_SLOTS:] for s in states]) if chunks else np.zeros((0, N_SLOTS + 1))
+    net   = w @ Pc - PPV
+    P_imp = np.maximum(net, 0.0)
+    P_exp = np.maximum(-net, 0.0)
+    objective = float(np.sum((P_imp * C_buy - P_exp * C_SELL) * DT))
+
+    return ADMMResult(
+        Pc=Pc, SOC=SOC, P_imp=P_imp, P_exp=P_exp,
+        prices=rho * U / n_agents / DT,
+        objective=objective, gap=float(gap), iterations=it, residual=float(np.max(np.abs(X - Z))),
+        converged=converged, seconds=time.perf_counter() - start,
+    )
+
+
+def _dual_bound(owner, keys, price, PPV, slope_buy, slope_sell, solver):
+    # Lagrangian lower bound on the optimum [€] at the slot prices: the
+    # vehicles' cheapest schedules at those prices, minus the value of the PV
+    # power (the grid term at prices between the sell and buy slopes)
+    price = np.clip(price, slope_sell, slope_buy)
+    parts = [f.result() for f in [owner[k].submit(_bound_chunk, keys[k], price, solver)
+                                  for k in range(len(keys))]]
+    return sum(parts) - price @ PPV
+
+
+def _grid_cost(X, PPV, slope_buy, slope_sell):
+    # Cost [€] of a total charging schedule X when the grid covers the rest
+    net = X - PPV
+    return float(slope_buy @ np.maximum(net, 0.0) - slope_sell * np.sum(np.maximum(-net, 0.0)))
+
+
+# ── Chunk workers ─────────────────────────────────────────────────────────────
+# State of the chunks owned by this process, by (run id, chunk index)
+_chunks = {}
+
+
+@dataclass
+class _Chunk:
+    ub:      np.ndarray         # (n, N_SLOTS) charging power limit [kW]
+    E_cons:  np.ndarray         # (n, N_SLOTS) consumption [kWh]
+    weights: np.ndarray         # (n,) vehicles per row
+    x:       np.ndarray         # (n, N_SLOTS) current proposal weights * Pc [kW]
+    state:   Optional[tuple] = None     # inner ADMM (w, y) of _project_chunk
+
+
+def _open_chunk(key, ub, E_cons, weights):
+    _chunks[key] = _Chunk(ub, E_cons, weights, np.zeros((len(ub), N_SLOTS)))
+
+
+def _step_chunk(key, shift):
+    # x-update of one chunk. Returns its per-slot total, the squared norm of
+    # its movement (for the dual residual) and whether every projection
+    # converged
+    chunk = _chunks[key]
+    target = (chunk.x - shift) / chunk.weights[:, None]
+    Pc, chunk.state, done = _project_chunk(chunk.ub, chunk.E_cons, target, chunk.state)
+    x = chunk.weights[:, None] * Pc
+    moved_sq = float(np.sum((x - chunk.x) ** 2))
+    chunk.x = x
+    return x.sum(axis=0), moved_sq, done
+
+
+def _bound_chunk(key, price, solver):
+    # Cheapest cost [€] of the chunk's schedules at the slot prices: the fleet
+    # LP without PV, buying at price / DT (never below C_SELL, so no export)
+    chunk = _chunks[key]
+    lp = build_fleet_lp(chunk.ub > 0, chunk.E_cons, np.zeros(N_SLOTS), price / DT, weights=chunk.weights)
+    solution = solve_lp(lp, solver=solver, verbose=False)
+    return solution.objective if solution.status == "optimal" else -np.inf
+
+
+def _close_chunk(key):
+    # Bound-feasible Pc / SOC of the chunk (n, N_VARS); frees its state
+    chunk = _chunks.pop(key)
+    if chunk.state is None:
+        return np.zeros((len(chunk.ub), N_VARS))
+    return chunk.state[0]
+
+
+class _InProcess:
+    """Executor that runs every task at once in this process (jobs=1)."""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+# ── Vehicle subproblem ────────────────────────────────────────────────────────
+def _project_chunk(ub, E_cons, target, state=None):
+    """
+    Euclidean projection of target (n, N_SLOTS) onto the feasible charging
+    schedules of n vehicles:
+
+        min ½ ||Pc - target||²
+        s.t. 0 <= Pc <= ub,  SOC_MIN * CAP_EV <= SOC <= SOC_MAX * CAP_EV,
+             SOC dynamics with E_cons, SOC[N_SLOTS] = SOC[0]
+
+    Solved for all n vehicles at once by ADMM between the equality
+    constraints (one shared KKT solve, _kkt_operator) and the bounds (clipping).
+    state = (w, y) of a previous call warm-starts the iterations.
+
+    Returns Pc (n, N_SLOTS), the new state and whether the iterations
+    converged within INNER_MAX_ITER; state[0][:, :N_SLOTS] / [:, N_SLOTS:]
+    are the bound-feasible Pc / SOC. Only Pc is unique (any SOC level within
+    the bounds is optimal), so convergence is tested on Pc and the bounds.
+    """
+    n  = len(ub)
+    lo = np.concatenate([np.zeros((n, N_SLOTS)), np.full((n, N_SLOTS + 1), CAP_EV * SOC_MIN)], axis=1)
+    hi = np.concatenate([ub, np.full((n, N_SLOTS + 1), CAP_EV * SOC_MAX)], axis=1)
+
+    if state is None:
+        # Cold start at the lowest SOC, usually the cheapest level (least self-discharge)
+        w = np.clip(np.concatenate([target, np.full((n, N_SLOTS + 1), CAP_EV * SOC_MIN)], axis=1), lo, hi)
+        y = np.zeros_like(w)
+    else:
+        w, y = state
+
+    solve, solve_rhs = _kkt_operator()
+    offset = -E_cons @ solve_rhs                             # dynamics right-hand side
+    lin    = np.zeros((n, N_VARS))
+    lin[:, :N_SLOTS] = target                                # gradient of ½||Pc - target||² is Pc - target
+
+    done = False
+    for _ in range(INNER_MAX_ITER):
+        z      = (lin + INNER_SIGMA * (w - y)) @ solve + offset     # equality-feasible point
+        z      = INNER_ALPHA * z + (1 - INNER_ALPHA) * w            # over-relaxation
+        w_prev = w
+        w      = np.clip(z + y, lo, hi)                      # bound-feasible point
+        y      = y + z - w
+        if max(np.max(np.abs(z - w)), np.max(np.abs(w[:, :N_SLOTS] - w_prev[:, :N_SLOTS]))) <= INNER_TOL:
+            done = True
+            break
+
+    return w[:, :N_SLOTS], (w, y), done
+
+
+@lru_cache(maxsize=1)
+def _kkt_operator():
+    # Same KKT matrix for every vehicle: [[Q + sigma I, M'], [M, 0]] with
+    # Q = I on Pc, 0 on SOC and M the SOC dynamics + cyclic rows. Only the
+    # primal part of its inverse is needed; it is small (193 x 290) and dense,
+    # so a chunk is solved by one matrix product instead of n sparse solves.
+    t = np.arange(N_SLOTS)
+    pc, soc = t, N_SLOTS + t
+    M = sp.csr_matrix(
+        (np.concatenate([np.ones(N_SLOTS), np.full(N_SLOTS, -(1 - SD_EV_PER_SLOT)), np.full(N_SLOTS, -ETA_SQRT * DT), [1.0, -1.0]]),
+         (np.concatenate([t, t, t, [N_SLOTS, N_SLOTS]]),
+          np.concatenate([soc + 1, soc, pc, [N_VARS - 1, N_SLOTS]]))),
+        shape=(N_SLOTS + 1, N_VARS))
+    Q = sp.diags(np.concatenate([np.ones(N_SLOTS), np.zeros(N_SLOTS + 1)]) + INNER_SIGMA)
+    K = sp.bmat([[Q, M.T], [M, None]], format="csc")
+    inverse = spla.splu(K).solve(np.eye(K.shape[0]))[:N_VARS]
+    # Row-vector form: z = grad @ solve + E_cons @ solve_rhs
+    return np.ascontiguousarray(inverse[:, :N_VARS].T), np.ascontiguousarray(inverse[:, N_VARS:N_VARS + N_SLOTS].T)
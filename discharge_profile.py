@@ -20,68 +20,86 @@ CAP_EV          = 60.0         # Battery capacity [kWh]
 
 # ── Build discharge profile ───────────────────────────────────────────────────
 def build_discharge_profile(timetable):
-    records = []
-
-    for vehicle_id, group in timetable.groupby("vehicle_id"):
-
-        # Initialize arrays for this vehicle (one entry per slot)
-        parked_time   = np.zeros(N_SLOTS)   # seconds spent parked in each slot
-        driving_time  = np.zeros(N_SLOTS)   # seconds spent driving in each slot
-        energy_kWh    = np.zeros(N_SLOTS)   # energy consumed in each slot [kWh]
-
-        for _, row in group.iterrows():
-            ep_start    = row["t_start"]
-            ep_end      = row["t_end"]
-            ep_type     = row["episode_type"]
-            ep_duration = row["duration_s"]
-
-            # Find which slots this episode overlaps (among the 96 for each day)
-            slot_first = int(ep_start // SLOT_DURATION)                         # Integer division gives the slot index where the episode begins
-            slot_last  = int(min(ep_end - 1, DAY_END - 1) // SLOT_DURATION)     # Subtract 1 to avoid counting the next slot when an episode ends exactly on a boundary
-                                                                                # min(): clips to the last valid second of the day
-            
-            for s in range(slot_first, slot_last + 1):
-                slot_start = s * SLOT_DURATION
-                slot_end   = slot_start + SLOT_DURATION
-
-                # Overlap between episode and this slot [seconds]
-                # Example: episode runs 13421→14741s, slot 14 runs 13500→14400s
-                # overlap = min(14741, 14400) - max(13421, 13500) = 14400 - 13500 = 900s (full slot is driving)
-                
-                overlap = min(ep_end, slot_end) - max(ep_start, slot_start)
-                overlap = max(overlap, 0)       # Ensures no negative numbers
-
-                if ep_type == "parked":
-                    parked_time[s] += overlap                               # Adds the overlap seconds to the correct array
-
-                elif ep_type == "driving":
-                    driving_time[s] += overlap
-
-                    # Proportional energy: fraction of trip in this slot
-                    if ep_duration > 0:
-                        fraction = overlap / ep_duration                    # What share of the total trip falls in this slot
-                    else:
-                        fraction = 0
-                    distance_km     = row["distance_m"] / 1000
-                    energy_kWh[s]  += fraction * distance_km * EFF_EV       # Energy attributed to this slot only
-
-        # Apply majority rule for parking flag
-        for s in range(N_SLOTS):
-            total_time = parked_time[s] + driving_time[s]
-            if total_time > 0:
-                parked_flag = 1 if parked_time[s] / total_time >= 0.5 else 0
-            else:
-                parked_flag = 1  # no episode recorded → assume parked
-
-            records.append({
-                "vehicle_id":        vehicle_id,
-                "slot":              s,
-                "t_start":           s * SLOT_DURATION,
-                "t_end":             (s + 1) * SLOT_DURATION,
-                "parked":            parked_flag,
-                "energy_consumed_kWh": round(energy_kWh[s], 6)
-            })
-
-    return pd.DataFrame(records)
-
-
+    """
+    Long-format discharge profile: one row per vehicle and slot with columns
+    vehicle_id, slot, t_start, t_end, parked, energy_consumed_kWh.
+    """
+    vehicle_ids, parked, energy = build_discharge_arrays(timetable)
+
+    n_vehicles = len(vehicle_ids)
+    slots      = np.tile(np.arange(N_SLOTS, dtype=np.int64), n_vehicles)
+
+    return pd.DataFrame({
+        "vehicle_id":          np.repeat(vehicle_ids, N_SLOTS),
+        "slot":                slots,
+        "t_start":             slots * SLOT_DURATION,
+        "t_end":               (slots + 1) * SLOT_DURATION,
+        "parked":              parked.ravel().astype(np.int64),
+        "energy_consumed_kWh": energy.ravel(),
+    })
+
+
+def build_discharge_arrays(timetable):
+    """
+    Per-slot parked flag and energy consumption of every vehicle, computed for
+    all episodes at once.
+
+    Returns
+    -------
+    vehicle_ids : np.ndarray (V,)          — sorted vehicle ids, row order of the matrices
+    parked      : np.ndarray (V, N_SLOTS)  — int8, 1 if the vehicle is parked in the slot
+    energy      : np.ndarray (V, N_SLOTS)  — float64, energy consumed in the slot [kWh]
+    """
+    codes, vehicle_ids = pd.factorize(timetable["vehicle_id"], sort=True)
+    vehicle_ids = np.asarray(vehicle_ids)
+    n_vehicles  = len(vehicle_ids)
+
+    ep_start    = timetable["t_start"].to_numpy(dtype=np.float64)
+    ep_end      = timetable["t_end"].to_numpy(dtype=np.float64)
+    ep_duration = timetable["duration_s"].to_numpy(dtype=np.float64)
+    distance_km = timetable["distance_m"].to_numpy(dtype=np.float64) / 1000
+    is_driving  = (timetable["episode_type"] == "driving").to_numpy()
+    is_parked   = (timetable["episode_type"] == "parked").to_numpy()
+
+    # Find which slots each episode overlaps (among the 96 for each day)
+    slot_first = (ep_start // SLOT_DURATION).astype(np.int64)                          # slot index where the episode begins
+    slot_last  = (np.minimum(ep_end - 1, DAY_END - 1) // SLOT_DURATION).astype(np.int64)  # -1: an episode ending exactly on a boundary does not touch the next slot
+                                                                                       # min(): clips to the last valid second of the day
+    n_overlap  = np.maximum(slot_last - slot_first + 1, 0)
+
+    # One entry per (episode, overlapped slot) pair, in episode order
+    episode = np.repeat(np.arange(len(timetable)), n_overlap)
+    slot    = slot_first[episode] + (np.arange(len(episode)) - np.repeat(np.cumsum(n_overlap) - n_overlap, n_overlap))
+
+    # Overlap between episode and slot [seconds]
+    # Example: episode runs 13421→14741s, slot 14 runs 13500→14400s
+    # overlap = min(14741, 14400) - max(13421, 13500) = 14400 - 13500 = 900s (full slot is driving)
+    slot_start = slot * SLOT_DURATION
+    overlap    = np.minimum(ep_end[episode], slot_start + SLOT_DURATION) - np.maximum(ep_start[episode], slot_start)
+    overlap    = np.maximum(overlap, 0)             # Ensures no negative numbers
+
+    # Proportional energy: fraction of trip in each slot (0 for zero-duration trips)
+    duration = ep_duration[episode]
+    fraction = np.divide(overlap, duration, out=np.zeros_like(overlap), where=duration > 0)
+    energy_pair = fraction * distance_km[episode] * EFF_EV
+
+    # Sum the pairs into (V, 96) cells. bincount adds the pairs of a cell in
+    # episode order, so the sums match the per-vehicle loop this replaced.
+    cell     = codes[episode] * N_SLOTS + slot
+    size     = n_vehicles * N_SLOTS
+    driving  = is_driving[episode]
+    parked_time  = np.bincount(cell[is_parked[episode]], overlap[is_parked[episode]], minlength=size)
+    driving_time = np.bincount(cell[driving],            overlap[driving],            minlength=size)
+    energy       = np.bincount(cell[driving],            energy_pair[driving],        minlength=size)
+
+    # Apply majority rule for parking flag: parked if at least half of the
+    # recorded time in the slot is parked; no episode recorded → assume parked
+    total_time = parked_time + driving_time
+    parked = np.ones(size, dtype=np.int8)
+    recorded = total_time > 0
+    parked[recorded] = parked_time[recorded] / total_time[recorded] >= 0.5
+
+    # Round to 6 decimals, as the nested-loop version did
+    np.round(energy, 6, out=energy)
+
+    return vehicle_ids, parked.reshape(n_vehicles, N_SLOTS), energy.reshape(n_vehicles, N_SLOTS)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+discharge_tensor.py
+-------------------
+Compact on-disk format of the Step 4a discharge profile, read by the
+optimizer (Step 5) and any analysis tool.
+
+The profile is two (V, 96) matrices — parked flag and energy consumed per
+vehicle and slot — plus the vehicle ids of their rows. Instead of one
+parquet row per vehicle-slot they are stored as a folder of .npy columns:
+
+    <folder>/
+        meta.json            — format version, n_vehicles, n_slots, slot_duration
+        vehicle_ids.npy      — (V,)   vehicle id of each row (int32 ids or strings)
+        parked_bits.npy      — (V, 12) uint8, parked mask packed 8 slots per byte
+        energy_indptr.npy    — (V+1,) int64  \
+        energy_slot.npy      — (nnz,) int16   > energy matrix in CSR form:
+        energy_kWh.npy       — (nnz,) float64 / only driving slots are non-zero
+
+Everything is opened with np.load(mmap_mode="r"), so loading costs a few
+milliseconds whatever the fleet size; parked_matrix() / energy_matrix()
+expand the dense matrices when they are needed.
+"""
+
+import json
+import os
+import shutil
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+TENSOR_VERSION = 1                # bump whenever the file layout changes
+SLOT_DURATION  = 900              # seconds
+N_SLOTS        = 96
+
+ARRAY_FIELDS = ["vehicle_ids", "parked_bits", "energy_indptr", "energy_slot", "energy_kWh"]
+
+
+# ── Tensor ────────────────────────────────────────────────────────────────────
+@dataclass
+class DischargeTensor:
+    vehicle_ids:   np.ndarray     # (V,)
+    parked_bits:   np.ndarray     # (V, ceil(n_slots / 8)) uint8
+    energy_indptr: np.ndarray     # (V+1,) int64
+    energy_slot:   np.ndarray     # (nnz,) int16
+    energy_kWh:    np.ndarray     # (nnz,) float64
+    n_slots:       int = N_SLOTS
+
+    def __len__(self):
+        return len(self.vehicle_ids)
+
+    def parked_matrix(self) -> np.ndarray:
+        """(V, n_slots) int8, 1 where the vehicle is parked."""
+        bits = np.unpackbits(self.parked_bits, axis=1, count=self.n_slots)
+        return bits.view(np.int8)
+
+    def energy_matrix(self) -> np.ndarray:
+        """(V, n_slots) float64, energy consumed [kWh]."""
+        energy = np.zeros((len(self), self.n_slots))
+        rows   = np.repeat(np.arange(len(self)), np.diff(self.energy_indptr))
+        energy[rows, self.energy_slot] = self.energy_kWh
+        return energy
+
+    def total_energy(self) -> float:
+        return float(np.sum(self.energy_kWh))
+
+
+def from_arrays(vehicle_ids, parked, energy) -> DischargeTensor:
+    """
+    Pack the output of discharge_profile.build_discharge_arrays().
+    """
+    parked = np.asarray(parked)
+    energy = np.asarray(energy, dtype=np.float64)
+    rows, slots = np.nonzero(energy)            # row-major: already grouped by vehicle
+
+    return DischargeTensor(
+        vehicle_ids   = _storable(vehicle_ids),
+        parked_bits   = np.packbits(parked.astype(bool), axis=1),
+        energy_indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(energy)))]).astype(np.int64),
+        energy_slot   = slots.astype(np.int16),
+        energy_kWh    = energy[rows, slots],
+        n_slots       = parked.shape[1],
+    )
+
+
+def to_dataframe(tensor: DischargeTensor) -> pd.DataFrame:
+    """
+    Long-format view (one row per vehicle and slot), same columns as
+    discharge_profile.build_discharge_profile().
+    """
+    slots = np.tile(np.arange(tensor.n_slots, dtype=np.int64), len(tensor))
+    return pd.DataFrame({
+        "vehicle_id":          np.repeat(np.asarray(tensor.vehicle_ids), tensor.n_slots),
+        "slot":                slots,
+        "t_start":             slots * SLOT_DURATION,
+        "t_end":               (slots + 1) * SLOT_DURATION,
+        "parked":              tensor.parked_matrix().ravel().astype(np.int64),
+        "energy_consumed_kWh": tensor.energy_matrix().ravel(),
+    })
+
+
+# ── Persistence ───────────────────────────────────────────────────────────────
+def save_discharge_tensor(tensor: DischargeTensor, folder: str) -> None:
+    """
+    Write tensor as .npy columns plus meta.json into folder.
+    The folder is built under a temporary name and swapped in at the end, so
+    an interrupted run never leaves a half-written tensor behind.
+    """
+    tmp = folder + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    for field in ARRAY_FIELDS:
+        np.save(os.path.join(tmp, f"{field}.npy"), getattr(tensor, field))
+
+    with open(os.path.join(tmp, "meta.json"), "w") as f:
+        json.dump({
+            "version":       TENSOR_VERSION,
+            "n_vehicles":    len(tensor),
+            "n_slots":       tensor.n_slots,
+            "slot_duration": SLOT_DURATION,
+        }, f, indent=2)
+
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(tmp, folder)
+
+
+def load_discharge_tensor(folder: str) -> DischargeTensor:
+    """
+    Open a tensor written by save_discharge_tensor() (memory-mapped, no copy).
+    """
+    with open(os.path.join(folder, "meta.json")) as f:
+        meta = json.load(f)
+    if meta["version"] != TENSOR_VERSION:
+        raise ValueError(f"{folder}: discharge tensor version {meta['version']}, "
+                         f"expected {TENSOR_VERSION} — re-run Step 4a")
+
+    columns = {
+        field: np.load(os.path.join(folder, f"{field}.npy"), mmap_mode="r")
+        for field in ARRAY_FIELDS
+    }
+    return DischargeTensor(n_slots=meta["n_slots"], **columns)
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+def _storable(vehicle_ids) -> np.ndarray:
+    # .npy can only memory-map fixed-width dtypes: strings become unicode arrays
+    vehicle_ids = np.asarray(vehicle_ids)
+    if vehicle_ids.dtype == object:
+        vehicle_ids = vehicle_ids.astype(str)
+    return vehicle_ids
@@ -14,17 +14,72 @@ Streams output_events.xml(.gz) and reconstructs, for each car vehicle:
   - A person -> vehicle mapping
 
 Requires: link_length dict from network_parser.build_length_lookup()
+(or nothing, in the deferred mode below)
+
+Parallel mode (jobs > 1)
+------------------------
+The decompressed stream is cut on "<event " boundaries into chunks that are
+parsed on a process pool. A chunk cannot know what happened before it, so
+each worker returns, besides the trips/activities it could complete alone:
+  - trip ends / activity ends whose start lies in an earlier chunk,
+  - the entered-link lengths of vehicles still on a trip from an earlier chunk,
+  - the state of every vehicle / person at the end of the chunk.
+The main process merges the chunks in file order and resolves these against
+the state carried over from the previous chunks. Distances are accumulated
+in the same order as a single pass, so the result is identical to jobs=1.
+
+Pre-filter (prefilter=True)
+---------------------------
+Most events (left link, PT, walk, departure/arrival, ...) are of no use to
+the parser. With prefilter=True a single regular expression scans the raw
+bytes and keeps only the <event> elements whose type="..." is one of the six
+handled below (and, for "entered link", only those of a ":car" vehicle);
+only these reach the XML parser. It relies on the MATSim writer's format
+(double-quoted attributes, one self-closing <event .../> per event) and
+never changes the result: every kept event is still fully checked below.
+
+Parquet output (parse_events_to_parquet)
+----------------------------------------
+Instead of returning list[Trip] / list[ActivityEvent], trips and activities
+are appended to typed column buffers and written as fixed-size Arrow
+RecordBatches through a ParquetWriter, so no more than one batch of output
+rows (plus the trips / activities still open) is ever held in memory.
+
+Deferred link lengths (parse_events_to_parquet(link_length=None))
+-----------------------------------------------------------------
+The events can be parsed before the network: instead of summing lengths,
+every trip records the int32 codes of the links it entered (a list<int32>
+row of links_path per trips row; the code -> link id dictionary is stored
+in the file's metadata), and distance_m is left NaN. Once the network is
+parsed, resolve_link_ids() moves the link columns onto the network rows
+(interning.rebase_links) and computes every distance with one gather from
+the network link lengths. The lengths of each trip are added in event
+order, as the parser does, so distance_m is bit-identical to a parse with
+link_length. Entered links that are not in the network count 0 m (the
+parser skips them).
 """
 
 import gzip
-import xml.etree.ElementTree as ET
-from dataclasses import dataclass
+import json
+import os
+import re
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, fields
 from typing import Optional
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from xml.parsers import expat       # the C XML parser behind ElementTree, used directly: no Element objects, no tree
+import metrics
+from interning import IdTables, Interner, rebase_links
 
 
 # ── Data containers ────────────────────────────────────────────────────────
 
-@dataclass
+@dataclass(slots=True)      # slots: no per-instance __dict__, roughly halves the size of each object
 class Trip:
     person_id:  str     # who was driving
     vehicle_id: str     # which car
@@ -35,7 +90,7 @@ class Trip:
     to_link:    str     # the link where the car left traffic
 
 
-@dataclass
+@dataclass(slots=True)
 class ActivityEvent:
     person_id: str
     act_type:  str      # "home", "work", "leisure", etc.
@@ -47,7 +102,7 @@ class ActivityEvent:
 # This is a temporary container for a trip that has started but not yet finished. 
 # It lives in open_trips until a VehicleLeavesTraffic event converts it into a proper Trip
 
-@dataclass
+@dataclass(slots=True)
 class _OpenTrip:        #The underscore _ at the start is a Python convention meaning "private — only used inside this file"
     person_id:  str
     vehicle_id: str
@@ -55,6 +110,163 @@ class _OpenTrip:        #The underscore _ at the start is a Python convention me
     from_link:  str
     distance_m: float = 0.0  # accumulated as LinkEnter events arrive
     current_link: str = ""
+    links: Optional[array] = None   # deferred mode: entered link codes instead of distance_m (chunk-local in a chunk, _LinkSink codes once merged)
+
+
+# Raw-bytes test for the pre-filter: an <event> of one of the handled types.
+# Group 1 is set for "entered link", which is further limited to car vehicles.
+_HANDLED_EVENT = re.compile(
+    rb'<event\s(?:[\w:]+="[^"]*"\s+)*?type="'
+    rb'(?:PersonEntersVehicle|vehicle enters traffic|vehicle leaves traffic|actstart|actend|(entered link))"'
+    rb'[^>]*>'
+)
+
+
+# ── Chunk bookkeeping ──────────────────────────────────────────────────────
+# A trip end / activity end seen in a chunk for a vehicle / person whose
+# start is not in that chunk. Resolved by _merge_chunk() against the state
+# carried over from the earlier chunks.
+
+@dataclass(slots=True)
+class _PendingTripEnd:
+    vehicle_id: str
+    t_end:      float
+    to_link:    str
+    lengths:    list        # entered-link lengths (deferred: link codes) seen before the trip end, to add to the carried trip
+
+
+@dataclass(slots=True)
+class _PendingActEnd:
+    person_id: str
+    t_end:     float
+
+
+@dataclass
+class _ChunkResult:
+    # vehicle -> person for the first PersonEntersVehicle of each car vehicle in the chunk
+    first_drivers:   dict = field(default_factory=dict)
+    # completed Trip objects and _PendingTripEnd, in event order
+    # (Trip.person_id is None when the driver was not known inside the chunk)
+    trips:           list = field(default_factory=list)
+    # completed ActivityEvent objects and _PendingActEnd, in event order
+    activities:      list = field(default_factory=list)
+    # state at the end of the chunk of every vehicle with a traffic event in it (None = not on a trip)
+    open_trips:      dict = field(default_factory=dict)
+    # vehicles without any traffic event in the chunk -> entered-link lengths for a carried trip
+    carried_lengths: dict = field(default_factory=dict)
+    # state at the end of the chunk of every person with an activity event in it (None = no open activity)
+    open_activities: dict = field(default_factory=dict)
+    # deferred mode: chunk-local codes of the entered links (lengths and links above hold these codes),
+    # and the links of the completed Trip objects in trips, concatenated in trip order
+    link_table:       Optional[Interner] = None
+    trip_links:       array = field(default_factory=lambda: array("i"))
+    trip_link_counts: array = field(default_factory=lambda: array("i"))
+
+
+@dataclass
+class _MergeState:
+    trips:             list = field(default_factory=list)   # list, or a _ParquetSink
+    activities:        list = field(default_factory=list)   # list, or a _ParquetSink
+    trip_vehicles:     set  = field(default_factory=set)    # vehicles with at least one completed trip (for the summary)
+    trip_links:        Optional["_LinkSink"] = None         # deferred mode: entered links of every trip, in trips order
+    open_trips:        dict = field(default_factory=dict)   # vehicle_id -> _OpenTrip
+    open_activities:   dict = field(default_factory=dict)   # person_id  -> (act_type, link_id, t_start)
+    person_to_vehicle: dict = field(default_factory=dict)
+    vehicle_to_person: dict = field(default_factory=dict)
+
+
+# ── Parquet output ─────────────────────────────────────────────────────────
+
+class _ParquetSink:
+    """
+    Drop-in for the trips / activities lists: append() stores each field of a
+    Trip / ActivityEvent in a typed column buffer, and every batch_rows rows
+    the buffers are turned into one pyarrow.RecordBatch, written to the
+    ParquetWriter and emptied.
+
+    Buffers: array('d') for floats, array('i') for identifier columns with an
+    Interner in interners (written as int32 ids), a list for other strings.
+    """
+    _ARROW_TYPES = {str: pa.string(), float: pa.float64()}
+
+    def __init__(self, path: str, record_type, batch_rows: int, interners: Optional[dict] = None):
+        interners       = interners or {}
+        self.names      = [f.name for f in fields(record_type)]
+        self.interners  = [interners.get(name) for name in self.names]
+        self.types      = [pa.int32() if interners.get(f.name) is not None else self._ARROW_TYPES[f.type]
+                           for f in fields(record_type)]
+        self.schema     = pa.schema(list(zip(self.names, self.types)))
+        self.writer     = pq.ParquetWriter(path, self.schema)
+        self.batch_rows = batch_rows
+        self.rows       = 0                 # rows appended so far (len() of the sink)
+        self._reset()
+
+    def _reset(self):
+        self.buffers = [
+            array("d") if t == pa.float64() else array("i") if t == pa.int32() else []
+            for t in self.types
+        ]
+
+    def append(self, record):
+        for buffer, name, interner in zip(self.buffers, self.names, self.interners):
+            value = getattr(record, name)
+            buffer.append(value if interner is None else interner.intern(value))
+        self.rows += 1
+        if len(self.buffers[0]) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if len(self.buffers[0]) == 0:
+            return
+        columns = [pa.array(buffer, type=t) for buffer, t in zip(self.buffers, self.types)]
+        self.writer.write_batch(pa.RecordBatch.from_arrays(columns, schema=self.schema))
+        self._reset()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __len__(self):
+        return self.rows
+
+
+class _LinkSink:
+    """
+    Deferred mode: the entered links of each trip, one list<int32> row per
+    row of the trips sink, written in record batches like _ParquetSink.
+
+    The links are codes of the sink's own dictionary (link_ids), not of
+    ids.links: links that are only ever entered must not take ids there, so
+    that the link ids come out as in a parse with link_length. The
+    dictionary is written to the file metadata on close (read_trip_links).
+    """
+    METADATA_KEY = b"link_ids"
+
+    def __init__(self, path: str, batch_rows: int):
+        self.schema     = pa.schema([("links", pa.list_(pa.int32()))])
+        self.writer     = pq.ParquetWriter(path, self.schema)
+        self.batch_rows = batch_rows
+        self.segments   = []
+        self.link_ids   = Interner()
+
+    def append(self, links):
+        self.segments.append(np.asarray(links, dtype=np.int32))
+        if len(self.segments) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.segments:
+            return
+        offsets = np.zeros(len(self.segments) + 1, dtype=np.int32)
+        np.cumsum([len(links) for links in self.segments], out=offsets[1:])
+        column  = pa.ListArray.from_arrays(pa.array(offsets), pa.array(np.concatenate(self.segments)))
+        self.writer.write_batch(pa.RecordBatch.from_arrays([column], schema=self.schema))
+        self.segments = []
+
+    def close(self):
+        self.flush()
+        self.writer.add_key_value_metadata({self.METADATA_KEY: json.dumps(self.link_ids.values)})
+        self.writer.close()
 
 
 # ── Main parser ────────────────────────────────────────────────────────────
@@ -63,6 +275,9 @@ def parse_events(
     events_path: str,
     link_length: dict[str, float],      # comes from Step 1 (network_parser.py)
     car_vehicles: Optional[set[str]] = None,  # car_vehicles is optional: if you pass a set of known car vehicle IDs, only those are processed. If you pass nothing (None), all vehicles are processed. This is useful if you want to pre-filter only EVs
+    jobs: int = 1,                      # number of worker processes; 1 = single pass in this process, 0 or None = one per CPU core
+    chunk_bytes: int = 32 << 20,        # size of the decompressed chunks the file is parsed in
+    prefilter: bool = False,            # drop unused event types on the raw bytes before XML parsing (see module docstring)
 ) -> tuple[list[Trip], list[ActivityEvent], dict[str, str]]:    # Returns three things: the trips list, the activities list, and the person→vehicle mapping
     
     """
@@ -75,169 +290,579 @@ def parse_events(
         events_path   : path to output_events.xml or output_events.xml.gz
         link_length   : dict from network_parser.build_length_lookup()
         car_vehicles  : optional set of vehicle IDs to keep (filters out PT/bikes)
+        jobs          : worker processes for the parallel mode (see module docstring)
+        chunk_bytes   : decompressed bytes per chunk (parsed one at a time, or by the workers)
+        prefilter     : byte-level event-type pre-filter (see module docstring)
 
     Returns:
         trips, activities, person_to_vehicle
     """
+    if link_length is None:
+        raise ValueError("parse_events needs link_length; parse_events_to_parquet(link_length=None, "
+                         "links_path=...) defers the distances (see module docstring)")
+    state = _MergeState()
+    _run(state, events_path, link_length, car_vehicles, jobs, chunk_bytes, prefilter)
+    _print_summary(state)
+    return state.trips, state.activities, state.person_to_vehicle
+
+
+def parse_events_to_parquet(
+    events_path: str,
+    link_length: Optional[dict[str, float]],    # None: deferred mode, distances resolved later (see module docstring)
+    trips_path: str,                    # where to write the trips table (same columns as pd.DataFrame(list[Trip]))
+    activities_path: str,               # where to write the activities table (same columns as pd.DataFrame(list[ActivityEvent]))
+    car_vehicles: Optional[set[str]] = None,
+    jobs: int = 1,
+    chunk_bytes: int = 32 << 20,
+    prefilter: bool = False,
+    batch_rows: int = 65536,            # rows per RecordBatch written to the parquet files
+    ids=None,                           # interning.IdTables: write person/vehicle/link columns as int32 ids
+    links_path: Optional[str] = None,   # deferred mode: where to write the entered link ids of every trip
+) -> dict[str, str]:
+    """
+    Same as parse_events(), but trips and activities are streamed to parquet
+    files in fixed-size record batches instead of being returned as lists.
+
+    With ids, person_id / vehicle_id / from_link / to_link / link_id are
+    interned in the given dictionaries (in this process, so the ids are the
+    same whatever jobs is) and written as int32 columns. The caller saves the
+    dictionaries (interning.save_ids).
+
+    With link_length=None (deferred mode, needs ids and links_path) the
+    links entered by each trip go to links_path, and the distances are
+    filled in by resolve_link_ids() once the network is known. ids then
+    comes from interning.new_ids() without a network.
+
+    Returns:
+        person_to_vehicle
+    """
+    if link_length is None and (ids is None or links_path is None):
+        raise ValueError("The deferred mode (link_length=None) needs ids and links_path")
+    trip_ids = act_ids = None
+    if ids is not None:
+        trip_ids = {"person_id": ids.persons, "vehicle_id": ids.vehicles,
+                    "from_link": ids.links,   "to_link":    ids.links}
+        act_ids  = {"person_id": ids.persons, "link_id":    ids.links}
+
+    state = _MergeState(
+        trips      = _ParquetSink(trips_path,      Trip,          batch_rows, trip_ids),
+        activities = _ParquetSink(activities_path, ActivityEvent, batch_rows, act_ids),
+    )
+    if link_length is None:
+        state.trip_links = _LinkSink(links_path, batch_rows)
+    try:
+        _run(state, events_path, link_length, car_vehicles, jobs, chunk_bytes, prefilter)
+    finally:
+        state.trips.close()
+        state.activities.close()
+        if state.trip_links is not None:
+            state.trip_links.close()
+    _print_summary(state)
+    return state.person_to_vehicle
+
+
+def _run(state, events_path, link_length, car_vehicles, jobs, chunk_bytes, prefilter):
+    """
+    Feeds every chunk of the events file through _parse_chunk() and merges
+    the results into state, in file order.
+    """
+    jobs = jobs or os.cpu_count() or 1
+
+    opener = gzip.open if events_path.endswith(".gz") else open
+
+    # Phases (metrics.py): events.read = decompressing and cutting the chunks,
+    # events.parse_chunk = the XML state machine (in the workers with jobs > 1),
+    # events.merge = merging the chunk results in file order and writing them
+    with metrics.phase("events.parse", nbytes=os.path.getsize(events_path)) as total, \
+         opener(events_path, "rb") as f:
+        chunks = metrics.iterate("events.read", _split_events(f, chunk_bytes))
+        if jobs == 1:
+            # Same chunks as the parallel mode, parsed in this process: the
+            # output of each chunk is merged (and flushed, for parquet) before
+            # the next one is read, so memory does not grow with the file.
+            for chunk in chunks:
+                _merge_timed(state, _parse_timed(chunk, link_length, car_vehicles, prefilter))
+        else:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                     initargs=(link_length, car_vehicles, prefilter)) as pool:
+                # Keep a bounded number of chunks in flight so that memory
+                # does not grow with the file size, and merge them in order.
+                in_flight = deque()
+                for chunk in chunks:
+                    in_flight.append(pool.submit(_parse_chunk_bytes, chunk))
+                    if len(in_flight) >= 2 * jobs:
+                        _merge_timed(state, in_flight.popleft().result())
+                while in_flight:
+                    _merge_timed(state, in_flight.popleft().result())
+        total.rows = len(state.trips) + len(state.activities)
+
+
+def _merge_timed(state, result):
+    with metrics.phase("events.merge", rows=len(result.trips) + len(result.activities)):
+        _merge_chunk(state, result)
+
+
+def _print_summary(state):
+    # ── Stuck agents warning ───────────────────────────────────────────────
+    if state.open_trips:
+        print(f"  ⚠ {len(state.open_trips)} vehicles had unclosed trips (stuck agents), discarded.")
+
+    # ── Summary ───────────────────────────────────────────────────────────
+    print(f"[Private] Parsed {len(state.trips):,} trips | "
+          f"Unique vehicles: {len(state.trip_vehicles):,} | "
+          f"Unique persons: {len(state.person_to_vehicle):,}")
+    print(f"[Both]    Parsed {len(state.activities):,} activities.")
+
+
+# ── Deferred link lengths ──────────────────────────────────────────────────
+
+def resolve_link_ids(
+    trips_in: str,                      # trips / activities / links_path of a deferred parse_events_to_parquet()
+    activities_in: str,
+    links_in: str,
+    ids: IdTables,                      # the ids of that parse
+    network,                            # network_parser.NetworkArrays
+    trips_path: str,                    # where to write the resolved tables
+    activities_path: str,
+    batch_rows: int = 65536,
+) -> IdTables:
+    """
+    Completes a deferred parse once the network is known: the link columns
+    are renumbered so that link id == network row (the same ids as a parse
+    with link_length), and distance_m is filled from the network link
+    lengths (trip_distances). Returns the rebased ids (to save with save_ids).
+    """
+    ids, remap = rebase_links(ids, network)
+
+    # Link lengths by link id, 0 m for the links outside the network (and,
+    # last, for entered links without an id: lookup() gives -1)
+    with metrics.phase("events.trip_distances") as p:
+        length = np.zeros(len(ids.links) + 1)
+        length[:len(network.length_m)] = network.length_m
+        link_ids, links = read_trip_links(links_in)
+        distance = trip_distances(links, length[ids.links.lookup(link_ids)])
+        p.rows   = len(distance)
+
+    done = 0
+    with metrics.phase("events.rewrite", nbytes=os.path.getsize(trips_in) + os.path.getsize(activities_in)) as p:
+        with pq.ParquetFile(trips_in) as source, pq.ParquetWriter(trips_path, source.schema_arrow) as sink:
+            for batch in source.iter_batches(batch_size=batch_rows):
+                sink.write_batch(_replace_columns(batch, {
+                    "distance_m": distance[done:done + batch.num_rows],
+                    "from_link":  remap[batch.column("from_link").to_numpy()],
+                    "to_link":    remap[batch.column("to_link").to_numpy()],
+                }))
+                done += batch.num_rows
+        if done != len(distance):
+            raise ValueError(f"{trips_in} has {done} trips but {links_in} {len(distance)}")
+
+        rows = done
+        with pq.ParquetFile(activities_in) as source, pq.ParquetWriter(activities_path, source.schema_arrow) as sink:
+            for batch in source.iter_batches(batch_size=batch_rows):
+                sink.write_batch(_replace_columns(batch, {"link_id": remap[batch.column("link_id").to_numpy()]}))
+                rows += batch.num_rows
+        p.rows = rows
+
+    print(f"  → {done:,} trip distances resolved from the network link lengths")
+    return ids
+
+
+def read_trip_links(links_path: str):
+    """
+    The links file of a deferred parse: (link_ids, links), link_ids the
+    MATSim link id of every code and links the list<int32> column of codes.
+    """
+    with pq.ParquetFile(links_path) as f:
+        link_ids = json.loads(f.metadata.metadata[_LinkSink.METADATA_KEY])
+        return link_ids, f.read(columns=["links"]).column("links")
+
+
+def trip_distances(links, link_length: np.ndarray) -> np.ndarray:
+    """
+    Distance of every trip of a deferred parse: the lengths of its entered
+    links (the list<int32> column of read_trip_links), gathered from
+    link_length (indexed by link code) in one go.
+
+    The lengths of a trip are added one at a time in event order, starting
+    from 0.0, exactly like _OpenTrip.distance_m in the parser, so the result
+    is bit-identical to it (np.add.reduceat sums in a different order). The
+    loop runs over the link position within the trip, for all trips at once:
+    trips sorted by link count, so those with more than j links are a prefix.
+    """
+    counts  = pc.list_value_length(links).to_numpy().astype(np.int64)
+    lengths = link_length[pc.list_flatten(links).to_numpy()]
+    starts  = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    order    = np.argsort(-counts, kind="stable")
+    starts   = starts[order]
+    n_trips  = np.searchsorted(-counts[order], -np.arange(counts.max(initial=0)), side="left")  # trips with > j links
+    totals   = np.zeros(len(counts))
+    for j, n in enumerate(n_trips):
+        totals[:n] += lengths[starts[:n] + j]
+
+    distance        = np.empty_like(totals)
+    distance[order] = totals
+    return distance
+
+
+def _replace_columns(batch, columns: dict):
+    arrays = [pa.array(columns[name], type=batch.schema.field(name).type) if name in columns
+              else batch.column(name) for name in batch.schema.names]
+    return pa.RecordBatch.from_arrays(arrays, schema=batch.schema)
+
+
+# ── Chunking ───────────────────────────────────────────────────────────────
+
+def _split_events(f, chunk_bytes: int):
+    """
+    Cuts a decompressed events stream into byte chunks made only of complete
+    <event .../> elements (the <events> root and XML header are dropped).
+    """
+    buffer = b""
+    started = False
+    while True:
+        block = f.read(chunk_bytes)
+        buffer += block
+
+        if not started:
+            first = buffer.find(b"<event ")
+            if first < 0:
+                if not block:
+                    return
+                continue
+            buffer, started = buffer[first:], True
+
+        if not block:                                   # end of file: last chunk up to </events>
+            end = buffer.rfind(b"</events>")
+            chunk = buffer[:end] if end >= 0 else buffer
+            if chunk.strip():
+                yield chunk
+            return
+
+        # Everything before the last "<event " is complete; the rest waits for the next block
+        cut = buffer.rfind(b"<event ")
+        if cut > 0:
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+
+
+# ── Worker side ────────────────────────────────────────────────────────────
+
+_worker_link_length  = None
+_worker_car_vehicles = None
+_worker_prefilter    = False
+
+
+def _init_worker(link_length, car_vehicles, prefilter):
+    # Runs once per worker process, so link_length is not sent with every chunk
+    global _worker_link_length, _worker_car_vehicles, _worker_prefilter
+    _worker_link_length  = link_length
+    _worker_car_vehicles = car_vehicles
+    _worker_prefilter    = prefilter
+
+
+def _parse_chunk_bytes(chunk: bytes) -> _ChunkResult:
+    return _parse_timed(chunk, _worker_link_length, _worker_car_vehicles, _worker_prefilter)
+
+
+def _parse_timed(chunk, link_length, car_vehicles, prefilter) -> _ChunkResult:
+    with metrics.phase("events.parse_chunk", nbytes=len(chunk)) as p:
+        result = _parse_chunk(chunk, link_length, car_vehicles, prefilter)
+        p.rows = len(result.trips) + len(result.activities)
+    return result
+
+
+def _prefilter(chunk: bytes) -> bytes:
+    """
+    Keeps only the <event> elements the state machine handles (see _HANDLED_EVENT).
+    """
+    return b"".join(
+        m.group(0) for m in _HANDLED_EVENT.finditer(chunk)
+        if m.group(1) is None or b':car"' in m.group(0)
+    )
+
+
+def _parse_chunk(chunk: bytes, link_length, car_vehicles, prefilter=False) -> _ChunkResult:
+    """
+    Runs the trip / activity state machine over one chunk of bare
+    <event .../> elements from _split_events().
+    Anything that depends on earlier chunks is left pending in the result.
+    """
+    result = _ChunkResult()
 
     # Running state: vehicles currently on a trip
     # Private cars
-    open_trips:    dict[str, _OpenTrip] = {}
+    open_trips = result.open_trips
     # key = vehicle_id
-    # A vehicle enters this dict on VehicleEntersTraffic and leaves it on VehicleLeavesTraffic
+    # A vehicle enters this dict on VehicleEntersTraffic. On VehicleLeavesTraffic
+    # its value becomes None: the key stays, recording that the vehicle's state
+    # is known inside this chunk and does not depend on earlier chunks.
 
     # Running state: persons currently doing an activity
-    open_activities: dict[str, tuple[str, str, float]] = {}
+    open_activities = result.open_activities
     # key   = person_id
-    # value = (act_type, link_id, t_start)
-    # A person enters this dict on actstart and leaves it on actend
+    # value = (act_type, link_id, t_start), or None once the activity has ended
 
     """
     These are the "memory" of the parser. 
     At any point during streaming, open_trips contains all vehicles currently on a trip.
     Similarly, open_activities contains all persons currently doing an activity.
     """
-    
 
-    # Results
-    trips:      list[Trip]          = []       # private car trips
-    activities: list[ActivityEvent] = []
+    # Entered-link lengths of vehicles with no traffic event yet in this chunk
+    # (they may be on a trip that started in an earlier chunk)
+    carried_lengths = result.carried_lengths
+
+    # Deferred mode: entered links are kept as chunk-local codes, not lengths
+    if link_length is None:
+        result.link_table = Interner()
+    link_table = result.link_table
 
     # Person <-> vehicle mapping (built from PersonEntersVehicle events)
-    person_to_vehicle: dict[str, str] = {}      # private car
-    vehicle_to_person: dict[str, str] = {}
+    vehicle_to_person = result.first_drivers      # private car
 
-    opener = gzip.open if events_path.endswith(".gz") else open
+    def _on_start(tag, attrib):
+        # Called by expat for every opening tag. We only care about <event> tags, skip everything else
+        if tag != "event":
+            return
 
-    with opener(events_path, "rb") as f:
-        for _, elem in ET.iterparse(f, events=("start",)):  
-            # Note the _ instead of event as the first variable — this is a Python convention meaning "I know this variable exists but I don't need it". 
-            # We always use events=("start",) so it would always be "start" anyway, so we discard it
+        event_type = attrib.get("type", "")
+        time       = float(attrib.get("time", 0)) #Converts the string into float
 
-            # We only care about <event> tags, skip everything else
-            if elem.tag != "event":
-                elem.clear()
-                continue
+        # ── 1. Person boards a vehicle ─────────────────────────────────
+        if event_type == "PersonEntersVehicle":
+            person_id  = attrib["person"]
+            vehicle_id = attrib["vehicle"]
 
-            event_type = elem.attrib.get("type", "")
-            time       = float(elem.attrib.get("time", 0)) #Converts the string into float
-
-            # ── 1. Person boards a vehicle ─────────────────────────────
-            if event_type == "PersonEntersVehicle":
-                person_id  = elem.attrib["person"]
-                vehicle_id = elem.attrib["vehicle"]
-
-                # Only process car vehicles (format: "personId:car")
-
-                if vehicle_id.endswith(":car"):
-                    # Only record the FIRST person (the driver), ignore passengers
-                    if vehicle_id not in vehicle_to_person:
-                        person_to_vehicle[person_id]  = vehicle_id  # These are needed to link the vehicle to the person
-                        vehicle_to_person[vehicle_id] = person_id   # So that later on we can link the activity of the person to the vehicle
-
-
-            # ── 2. Vehicle enters traffic (trip starts) ────────────────
-            elif event_type == "vehicle enters traffic":
-                vehicle_id = elem.attrib["vehicle"]
-                link_id = elem.attrib["link"]
-                
-                # Skip non-car vehicles entirely
-                if not vehicle_id.endswith(":car"):
-                    elem.clear()
-                    continue
-                
-                # Skip if not in the optional filter set
-                if car_vehicles and vehicle_id not in car_vehicles:
-                    elem.clear()
-                    continue
-                
-                person_id = vehicle_to_person.get(vehicle_id, vehicle_id)
-                
-                # vehicle_to_person.get(vehicle_id, vehicle_id):
-                # Try to find the driver's person_id from the mapping built in Block 1
-                # If not found (edge case: VehicleEntersTraffic fired before PersonEntersVehicle)
-                # fall back to using vehicle_id itself — better than crashing
-
-                open_trips[vehicle_id] = _OpenTrip(
-                    person_id=person_id,
-                    vehicle_id=vehicle_id,
-                    t_start=time,
-                    from_link=link_id,
-                    current_link=link_id,
-                )
-
-            # ── 3. Vehicle enters a link (accumulate distance) ─────────
-            elif event_type == "entered link":
-                vehicle_id = elem.attrib.get("vehicle")
-                link_id    = elem.attrib.get("link")
-                
-
-                # Guard against missing attributes (e.g. pedestrian events)
-                if vehicle_id is None or link_id is None:
-                    elem.clear()
-                    continue
-
-                if vehicle_id in open_trips and link_id in link_length:
-                    open_trips[vehicle_id].distance_m   += link_length[link_id]
-                    open_trips[vehicle_id].current_link  = link_id
-
-
-            # ── 4. Vehicle leaves traffic (trip ends) ──────────────────
-            elif event_type == "vehicle leaves traffic":
-                vehicle_id = elem.attrib["vehicle"]
-                link_id    = elem.attrib["link"]
-
-                if vehicle_id in open_trips:
-                    ot = open_trips.pop(vehicle_id)
-                    trips.append(Trip(
+            # Only process car vehicles (format: "personId:car")
+            # Only record the FIRST person (the driver), ignore passengers
+            if vehicle_id.endswith(":car") and vehicle_id not in vehicle_to_person:
+                vehicle_to_person[vehicle_id] = person_id   # So that later on we can link the activity of the person to the vehicle
+
+
+        # ── 2. Vehicle enters traffic (trip starts) ────────────────────
+        elif event_type == "vehicle enters traffic":
+            vehicle_id = attrib["vehicle"]
+            link_id = attrib["link"]
+            
+            # Skip non-car vehicles entirely
+            if not vehicle_id.endswith(":car"):
+                return
+            
+            # Skip if not in the optional filter set
+            if car_vehicles and vehicle_id not in car_vehicles:
+                return
+
+            # The driver is the first PersonEntersVehicle seen for this vehicle.
+            # If it is not in this chunk, person_id stays None and the merge
+            # looks it up in the earlier chunks (falling back to vehicle_id —
+            # edge case: VehicleEntersTraffic fired before PersonEntersVehicle —
+            # better than crashing).
+            open_trips[vehicle_id] = _OpenTrip(
+                person_id=vehicle_to_person.get(vehicle_id),
+                vehicle_id=vehicle_id,
+                t_start=time,
+                from_link=link_id,
+                current_link=link_id,
+                links=None if link_table is None else array("i"),
+            )
+            carried_lengths.pop(vehicle_id, None)   # a trip carried in from an earlier chunk is replaced
+
+        # ── 3. Vehicle enters a link (accumulate distance) ─────────────
+        elif event_type == "entered link":
+            vehicle_id = attrib.get("vehicle")
+            link_id    = attrib.get("link")
+            
+
+            # Guard against missing attributes (e.g. pedestrian events)
+            if vehicle_id is None or link_id is None or (link_table is None and link_id not in link_length):
+                return
+
+            if vehicle_id in open_trips:
+                ot = open_trips[vehicle_id]
+                if ot is not None:
+                    if link_table is None:
+                        ot.distance_m += link_length[link_id]
+                    else:
+                        ot.links.append(link_table.intern(link_id))
+                    ot.current_link  = link_id
+            elif vehicle_id.endswith(":car") and not (car_vehicles and vehicle_id not in car_vehicles):
+                carried_lengths.setdefault(vehicle_id, []).append(
+                    link_length[link_id] if link_table is None else link_table.intern(link_id))
+
+
+        # ── 4. Vehicle leaves traffic (trip ends) ──────────────────────
+        elif event_type == "vehicle leaves traffic":
+            vehicle_id = attrib["vehicle"]
+            link_id    = attrib["link"]
+
+            if vehicle_id in open_trips:
+                ot = open_trips[vehicle_id]
+                if ot is not None:
+                    open_trips[vehicle_id] = None
+                    result.trips.append(Trip(
                         person_id=ot.person_id,
                         vehicle_id=vehicle_id,
                         t_start=ot.t_start,
                         t_end=time,
-                        distance_m=ot.distance_m,
+                        distance_m=ot.distance_m if ot.links is None else float("nan"),
                         from_link=ot.from_link,
                         to_link=link_id,
                     ))
-
-
-            
-            # ── 5. Activity starts ─────────────────────────────────────       
-            # These activities are only the interactions with the cehicle. 
-            # The real activities have to be implemented
-            elif event_type == "actstart":
-                person_id = elem.attrib["person"]
-                act_type  = elem.attrib.get("actType", "unknown")
-                link_id   = elem.attrib.get("link", "unknown")
-                open_activities[person_id] = (act_type, link_id, time)
-
-            # ── 6. Activity ends ───────────────────────────────────────
-            # These activities are only the interactions with the cehicle. 
-            # The real activities have to be implemented
-            elif event_type == "actend":
-                person_id = elem.attrib["person"]
-                link_id   = elem.attrib.get("link", "unknown")
-                act_type  = elem.attrib.get("actType", "unknown")
-
-                if person_id in open_activities:
-                    prev_act_type, prev_link, t_act_start = open_activities.pop(person_id)
-                    activities.append(ActivityEvent(
+                    if ot.links is not None:
+                        result.trip_links.extend(ot.links)
+                        result.trip_link_counts.append(len(ot.links))
+            elif vehicle_id.endswith(":car") and not (car_vehicles and vehicle_id not in car_vehicles):
+                open_trips[vehicle_id] = None
+                result.trips.append(_PendingTripEnd(
+                    vehicle_id=vehicle_id,
+                    t_end=time,
+                    to_link=link_id,
+                    lengths=carried_lengths.pop(vehicle_id, []),
+                ))
+
+
+        
+        # ── 5. Activity starts ─────────────────────────────────────────       
+        # These activities are only the interactions with the cehicle. 
+        # The real activities have to be implemented
+        elif event_type == "actstart":
+            person_id = attrib["person"]
+            act_type  = attrib.get("actType", "unknown")
+            link_id   = attrib.get("link", "unknown")
+            open_activities[person_id] = (act_type, link_id, time)
+
+        # ── 6. Activity ends ───────────────────────────────────────────
+        # These activities are only the interactions with the cehicle. 
+        # The real activities have to be implemented
+        elif event_type == "actend":
+            person_id = attrib["person"]
+
+            if person_id in open_activities:
+                opened = open_activities[person_id]
+                if opened is not None:
+                    prev_act_type, prev_link, t_act_start = opened
+                    open_activities[person_id] = None
+                    result.activities.append(ActivityEvent(
                         person_id=person_id,
                         act_type=prev_act_type,
                         link_id=prev_link,
                         t_start=t_act_start,
                         t_end=time,
                     ))
+            else:
+                open_activities[person_id] = None
+                result.activities.append(_PendingActEnd(person_id=person_id, t_end=time))
 
-            elem.clear()
+    parser = expat.ParserCreate()
+    parser.buffer_size = 1 << 20            # feed expat 1 MiB at a time instead of the 8 KiB default
+    parser.StartElementHandler = _on_start
+    parser.Parse(b"<events>", False)
+    parser.Parse(_prefilter(chunk) if prefilter else chunk, False)
+    parser.Parse(b"</events>", True)
 
-    # ── Stuck agents warning ───────────────────────────────────────────────
-    if open_trips:
-        print(f"  ⚠ {len(open_trips)} vehicles had unclosed trips (stuck agents), discarded.")
+    return result
 
-    # ── Summary ───────────────────────────────────────────────────────────
-    print(f"[Private] Parsed {len(trips):,} trips | "
-          f"Unique vehicles: {len({t.vehicle_id for t in trips}):,} | "
-          f"Unique persons: {len(person_to_vehicle):,}")
-    print(f"[Both]    Parsed {len(activities):,} activities.")
 
-    return trips, activities, person_to_vehicle
+# ── Merge side ─────────────────────────────────────────────────────────────
+
+def _merge_chunk(state: _MergeState, result: _ChunkResult) -> None:
+    """
+    Appends one chunk's output to the running state. Chunks must be merged in
+    file order. The driver lookups below use the mapping as it was *before*
+    this chunk: a driver first seen in this chunk is already in the chunk's
+    own Trip.person_id whenever it boarded before the trip started.
+    """
+    drivers = state.vehicle_to_person
+
+    def _driver(vehicle_id, local_driver):
+        return drivers.get(vehicle_id, vehicle_id if local_driver is None else local_driver)
+
+    # ── Deferred mode: chunk-local link codes -> _LinkSink codes ───────────
+    deferred = result.link_table is not None
+    if deferred:
+        link_ids  = state.trip_links.link_ids
+        codes     = np.array([link_ids.intern(link) for link in result.link_table.values], dtype=np.int32)
+        own_links = codes[np.frombuffer(result.trip_links, dtype=np.int32)]      # links of the chunk's own Trip objects
+        bounds    = np.concatenate([[0], np.cumsum(np.frombuffer(result.trip_link_counts, dtype=np.int32))])
+        own_trip  = 0
+
+    def _global(local):
+        return array("i", codes[np.asarray(local, dtype=np.intp)].tobytes())
+
+    # ── Trips, in event order ──────────────────────────────────────────────
+    for item in result.trips:
+        if isinstance(item, _PendingTripEnd):
+            ot = state.open_trips.pop(item.vehicle_id, None)
+            if ot is None:
+                continue
+            if deferred:
+                ot.links.extend(_global(item.lengths))
+                state.trip_links.append(ot.links)
+            else:
+                for length in item.lengths:
+                    ot.distance_m += length
+            state.trips.append(Trip(
+                person_id=ot.person_id,
+                vehicle_id=item.vehicle_id,
+                t_start=ot.t_start,
+                t_end=item.t_end,
+                distance_m=ot.distance_m if not deferred else float("nan"),
+                from_link=ot.from_link,
+                to_link=item.to_link,
+            ))
+        else:
+            item.person_id = _driver(item.vehicle_id, item.person_id)
+            state.trips.append(item)
+            if deferred:
+                state.trip_links.append(own_links[bounds[own_trip]:bounds[own_trip + 1]])
+                own_trip += 1
+        state.trip_vehicles.add(item.vehicle_id)
+
+    # ── Trips still open across the chunk boundary ─────────────────────────
+    for vehicle_id, lengths in result.carried_lengths.items():
+        ot = state.open_trips.get(vehicle_id)
+        if ot is not None:
+            if deferred:
+                ot.links.extend(_global(lengths))
+                continue
+            for length in lengths:
+                ot.distance_m += length
+
+    for vehicle_id, ot in result.open_trips.items():
+        if ot is None:
+            state.open_trips.pop(vehicle_id, None)
+        else:
+            ot.person_id = _driver(vehicle_id, ot.person_id)
+            if deferred:
+                ot.links = _global(ot.links)
+            state.open_trips[vehicle_id] = ot
+
+    # ── Activities, in event order ─────────────────────────────────────────
+    for item in result.activities:
+        if isinstance(item, _PendingActEnd):
+            opened = state.open_activities.pop(item.person_id, None)
+            if opened is None:
+                continue
+            prev_act_type, prev_link, t_act_start = opened
+            state.activities.append(ActivityEvent(
+                person_id=item.person_id,
+                act_type=prev_act_type,
+                link_id=prev_link,
+                t_start=t_act_start,
+                t_end=item.t_end,
+            ))
+        else:
+            state.activities.append(item)
+
+    for person_id, opened in result.open_activities.items():
+        if opened is None:
+            state.open_activities.pop(person_id, None)
+        else:
+            state.open_activities[person_id] = opened
+
+    # ── Drivers: only the first person ever seen in a vehicle counts ───────
+    for vehicle_id, person_id in result.first_drivers.items():
+        if vehicle_id not in drivers:
+            drivers[vehicle_id]                 = person_id   # These are needed to link the vehicle to the person
+            state.person_to_vehicle[person_id]  = vehicle_id
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+interning.py
+------------
+Shared integer interning of link, person and vehicle identifiers.
+
+MATSim identifiers are strings ("1234", "5678:car", ...). Carried through
+the pipeline as Python strings they cost ~60 bytes each and every join /
+groupby hashes them again. Instead, each identifier is given a dense int32
+id once, at parse time, and the pipeline works on those integers.
+
+    links    — seeded with the network link ids in network order, so the
+               id of a link IS its row in network_parser.NetworkArrays
+               (link_length[link_id], node_xy[to_node[link_id]], ...).
+               Links that are not in the network get ids after them.
+    persons  — in order of first appearance.
+    vehicles — in order of first appearance.
+
+The three dictionaries are written next to the parquet outputs
+(ids_links.parquet, ids_persons.parquet, ids_vehicles.parquet: columns
+id, value) so that any integer column can be decoded back to the MATSim
+string with decode_ids().
+"""
+
+import os
+from dataclasses import dataclass
+import numpy as np
+import pandas as pd
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+ID_FILES = {
+    "links":    "ids_links.parquet",
+    "persons":  "ids_persons.parquet",
+    "vehicles": "ids_vehicles.parquet",
+}
+
+# Which dictionary each id column of the pipeline outputs refers to
+ID_COLUMNS = {
+    "person_id":  "persons",
+    "vehicle_id": "vehicles",
+    "link_id":    "links",
+    "from_link":  "links",
+    "to_link":    "links",
+}
+
+
+# ── Interner ──────────────────────────────────────────────────────────────────
+class Interner:
+    """
+    Assigns dense int32 ids (0, 1, 2, ...) to strings in order of first use.
+    """
+
+    def __init__(self, values=()):
+        self.values: list[str]      = list(values)
+        self.index:  dict[str, int] = dict(zip(self.values, range(len(self.values))))
+        if len(self.index) != len(self.values):
+            raise ValueError("Interner seed values must be unique")
+
+    def intern(self, value: str) -> int:
+        """Id of value, assigning the next free id if it is new."""
+        code = self.index.get(value)
+        if code is None:
+            code = self.index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, values) -> np.ndarray:
+        """Ids of an array of strings without adding new ones (-1 if unknown)."""
+        codes = pd.Series(values, dtype=object).map(self.index)
+        return codes.fillna(-1).to_numpy(dtype=np.int32)
+
+    def decode(self, codes) -> np.ndarray:
+        """Strings of an array of ids (None for -1 / missing)."""
+        table = np.array(self.values + [None], dtype=object)     # id -1 lands on the trailing None
+        codes = pd.Series(codes).fillna(-1).to_numpy(dtype=np.int64)
+        return table[codes]
+
+    def __len__(self):
+        return len(self.values)
+
+
+@dataclass
+class IdTables:
+    links:    Interner
+    persons:  Interner
+    vehicles: Interner
+
+
+def new_ids(network=None) -> IdTables:
+    """
+    Empty person / vehicle dictionaries and a link dictionary seeded with the
+    network links, so that link id == NetworkArrays row. Without a network
+    the links are numbered in order of first use too, until rebase_links().
+    """
+    return IdTables(
+        links    = Interner(network.link_ids.tolist() if network is not None else ()),
+        persons  = Interner(),
+        vehicles = Interner(),
+    )
+
+
+def rebase_links(ids: IdTables, network) -> tuple[IdTables, np.ndarray]:
+    """
+    ids with the link dictionary seeded with the network after all (for ids
+    made by new_ids() without one), and remap: old link id -> new link id,
+    so that remap[column] renumbers a link column. Links that are not in the
+    network keep their order, after the network links, which gives the same
+    ids as new_ids(network) would have.
+    """
+    links = Interner(network.link_ids.tolist())
+    remap = np.fromiter((links.intern(value) for value in ids.links.values),
+                        dtype=np.int32, count=len(ids.links))
+    return IdTables(links=links, persons=ids.persons, vehicles=ids.vehicles), remap
+
+
+# ── Persistence ───────────────────────────────────────────────────────────────
+def save_ids(ids: IdTables, output_dir: str) -> None:
+    for name, filename in ID_FILES.items():
+        interner = getattr(ids, name)
+        pd.DataFrame({
+            "id":    np.arange(len(interner), dtype=np.int32),
+            "value": pd.Series(interner.values, dtype=object),
+        }).to_parquet(os.path.join(output_dir, filename), index=False)
+
+
+def load_ids(output_dir: str) -> IdTables:
+    tables = {}
+    for name, filename in ID_FILES.items():
+        df = pd.read_parquet(os.path.join(output_dir, filename))
+        tables[name] = Interner(df.sort_values("id")["value"].tolist())
+    return IdTables(**tables)
+
+
+def decode_ids(df: pd.DataFrame, ids: IdTables) -> pd.DataFrame:
+    """
+    Copy of df with every integer id column (see ID_COLUMNS) turned back into
+    the MATSim string ids. Handy when inspecting the parquet outputs.
+    """
+    df = df.copy()
+    for column, name in ID_COLUMNS.items():
+        if column in df.columns and pd.api.types.is_integer_dtype(df[column]):
+            df[column] = getattr(ids, name).decode(df[column])
+    return df
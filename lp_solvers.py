@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+lp_solvers.py
+-------------
+Solver-agnostic linear programs.
+
+A model is assembled once as plain arrays and scipy.sparse matrices
+(LinearProgram, the scipy.optimize.linprog convention):
+
+    min  c @ x
+    s.t. A_eq @ x == b_eq
+         A_ub @ x <= b_ub          (optional)
+         lb <= x <= ub
+
+and handed to any installed solver with solve_lp():
+
+    gurobi   — gurobipy (needs a licence for large models)
+    highs    — HiGHS through highspy
+    linprog  — HiGHS through scipy.optimize.linprog (always available with scipy)
+
+solver="auto" tries them in that order and falls back to the next one when
+a solver is missing or fails (e.g. a size-limited Gurobi licence).
+"""
+
+import importlib.util
+import time
+from dataclasses import dataclass
+from typing import Optional
+import numpy as np
+import scipy.sparse as sp
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+SOLVERS = ["gurobi", "highs", "linprog"]       # order tried by solver="auto"
+
+_MODULES = {"gurobi": "gurobipy", "highs": "highspy", "linprog": "scipy"}
+
+
+# ── Model and solution ────────────────────────────────────────────────────────
+@dataclass
+class LinearProgram:
+    c:    np.ndarray                            # (n,) objective coefficients
+    A_eq: sp.csr_matrix                         # (m_eq, n)
+    b_eq: np.ndarray                            # (m_eq,)
+    lb:   np.ndarray                            # (n,) lower bounds (-inf allowed)
+    ub:   np.ndarray                            # (n,) upper bounds (+inf allowed)
+    A_ub: Optional[sp.csr_matrix] = None        # (m_ub, n)
+    b_ub: Optional[np.ndarray]    = None        # (m_ub,)
+
+    @property
+    def n_vars(self) -> int:
+        return len(self.c)
+
+    @property
+    def n_rows(self) -> int:
+        return self.A_eq.shape[0] + (0 if self.A_ub is None else self.A_ub.shape[0])
+
+
+@dataclass
+class LPSolution:
+    status:    str                    # "optimal", "time_limit", "infeasible", "unbounded" or "error"
+                                      # ("converged" or "iteration_limit" from decomposition.py)
+    objective: float                  # NaN without a solution
+    x:         Optional[np.ndarray]   # None without a solution
+    solver:    str
+    seconds:   float = 0.0            # wall time spent in the solver call
+
+    @property
+    def has_solution(self) -> bool:
+        return self.x is not None
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+def available_solvers() -> list[str]:
+    """Solvers of SOLVERS whose Python package is installed."""
+    return [name for name in SOLVERS if importlib.util.find_spec(_MODULES[name]) is not None]
+
+
+def solve_lp(lp: LinearProgram, solver: str = "auto", time_limit=None, verbose=True) -> LPSolution:
+    """
+    Solve lp with the named solver ("gurobi", "highs", "linprog"), or with
+    the first one that works if solver="auto".
+    """
+    if solver != "auto":
+        if solver not in _BACKENDS:
+            raise ValueError(f"Unknown LP solver {solver!r} (choose from {SOLVERS} or 'auto')")
+        return _timed(_BACKENDS[solver], lp, time_limit, verbose)
+
+    candidates = available_solvers()
+    for name in candidates:
+        try:
+            return _timed(_BACKENDS[name], lp, time_limit, verbose)
+        except Exception as e:                  # licence / size limits, broken installs, ...
+            if name == candidates[-1]:
+                raise
+            print(f"  ⚠ {name} failed ({e}), trying the next solver")
+    raise RuntimeError(f"No LP solver installed (tried {SOLVERS})")
+
+
+# ── Backends ──────────────────────────────────────────────────────────────────
+def _solve_gurobi(lp: LinearProgram, time_limit, verbose) -> LPSolution:
+    import gurobipy as gp
+    from gurobipy import GRB
+
+    m = gp.Model("lp")
+    m.Params.OutputFlag = int(verbose)
+    if time_limit is not None:
+        m.Params.TimeLimit = time_limit
+
+    x = m.addMVar(lp.n_vars, lb=lp.lb, ub=lp.ub, name="x")
+    m.addMConstr(lp.A_eq, x, GRB.EQUAL, lp.b_eq, name="eq")
+    if lp.A_ub is not None:
+        m.addMConstr(lp.A_ub, x, GRB.LESS_EQUAL, lp.b_ub, name="ub")
+    m.setMObjective(None, lp.c, 0.0, sense=GRB.MINIMIZE)
+    m.optimize()
+
+    status = {
+        GRB.OPTIMAL:     "optimal",
+        GRB.TIME_LIMIT:  "time_limit",
+        GRB.INFEASIBLE:  "infeasible",
+        GRB.INF_OR_UNBD: "infeasible",
+        GRB.UNBOUNDED:   "unbounded",
+    }.get(m.Status, "error")
+
+    if m.SolCount == 0:
+        return LPSolution(status, float("nan"), None, "gurobi")
+    return LPSolution(status, m.ObjVal, x.X, "gurobi")
+
+
+def _solve_highs(lp: LinearProgram, time_limit, verbose) -> LPSolution:
+    import highspy
+
+    # HiGHS keeps all rows in one matrix with lower / upper row bounds
+    A, row_lb, row_ub = _stack_rows(lp)
+
+    model = highspy.HighsLp()
+    model.num_col_    = lp.n_vars
+    model.num_row_    = A.shape[0]
+    model.col_cost_   = lp.c
+    model.col_lower_  = lp.lb
+    model.col_upper_  = lp.ub
+    model.row_lower_  = row_lb
+    model.row_upper_  = row_ub
+    model.a_matrix_.format_ = highspy.MatrixFormat.kRowwise
+    model.a_matrix_.start_  = A.indptr
+    model.a_matrix_.index_  = A.indices
+    model.a_matrix_.value_  = A.data
+
+    h = highspy.Highs()
+    h.setOptionValue("output_flag", bool(verbose))
+    if time_limit is not None:
+        h.setOptionValue("time_limit", float(time_limit))
+    h.passModel(model)
+    h.run()
+
+    model_status = h.getModelStatus()
+    status = {
+        highspy.HighsModelStatus.kOptimal:                "optimal",
+        highspy.HighsModelStatus.kTimeLimit:              "time_limit",
+        highspy.HighsModelStatus.kInfeasible:             "infeasible",
+        highspy.HighsModelStatus.kUnboundedOrInfeasible:  "infeasible",
+        highspy.HighsModelStatus.kUnbounded:              "unbounded",
+    }.get(model_status, "error")
+
+    solution = h.getSolution()
+    if status not in ("optimal", "time_limit") or not solution.value_valid:
+        return LPSolution(status, float("nan"), None, "highs")
+    return LPSolution(status, h.getInfo().objective_function_value,
+                      np.asarray(solution.col_value), "highs")
+
+
+def _solve_linprog(lp: LinearProgram, time_limit, verbose) -> LPSolution:
+    from scipy.optimize import linprog
+
+    options = {"disp": bool(verbose)}
+    if time_limit is not None:
+        options["time_limit"] = float(time_limit)
+
+    res = linprog(
+        lp.c, A_ub=lp.A_ub, b_ub=lp.b_ub, A_eq=lp.A_eq, b_eq=lp.b_eq,
+        bounds=np.column_stack([lp.lb, lp.ub]), method="highs", options=options,
+    )
+    # linprog status: 0 optimal, 1 iteration / time limit, 2 infeasible, 3 unbounded, 4 numerical trouble
+    status = {0: "optimal", 1: "time_limit", 2: "infeasible", 3: "unbounded"}.get(res.status, "error")
+
+    if res.x is None:
+        return LPSolution(status, float("nan"), None, "linprog")
+    return LPSolution(status, float(res.fun), np.asarray(res.x), "linprog")
+
+
+_BACKENDS = {
+    "gurobi":  _solve_gurobi,
+    "highs":   _solve_highs,
+    "linprog": _solve_linprog,
+}
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+def _timed(backend, lp, time_limit, verbose) -> LPSolution:
+    start    = time.perf_counter()
+    solution = backend(lp, time_limit, verbose)
+    solution.seconds = time.perf_counter() - start
+    return solution
+
+
+def _stack_rows(lp: LinearProgram):
+    # Equality rows get lower == upper, A_ub rows get (-inf, b_ub]
+    if lp.A_ub is None:
+        return lp.A_eq.tocsr(), lp.b_eq, lp.b_eq
+    A = sp.vstack([lp.A_eq, lp.A_ub], format="csr")
+    row_lb = np.concatenate([lp.b_eq, np.full(len(lp.b_ub), -np.inf)])
+    row_ub = np.concatenate([lp.b_eq, lp.b_ub])
+    return A, row_lb, row_ub
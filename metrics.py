@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+metrics.py
+----------
+Lightweight performance instrumentation of the pipeline steps.
+
+    with metrics.phase("events.merge") as p:
+        ...
+        p.rows = len(rows)               # throughput: rows per second
+
+A phase records its wall time, CPU time (of this process), its peak RSS,
+and optionally the rows and input bytes it processed. The peak is the
+phase's own on Linux, where the high-water mark of the process can be reset
+as a phase starts (/proc/self/clear_refs); elsewhere it is the peak of the
+process so far.
+Phase names are explicit and dotted ("events.parse_chunk", "optimize.solve"):
+the same name may be recorded many times (once per chunk, per day, ...)
+and by several processes, and the report adds those up.
+
+laps() times the consecutive sections of a function the same way.
+
+Disabled (the default), phase() and laps() return shared do-nothing
+objects, so an instrumented function pays one global lookup per phase. enable(folder)
+turns it on for this process and, through the environment variable
+PIPELINE_METRICS, for every worker process started afterwards (forked or
+spawned): each process appends its records to its own <pid>.jsonl file in
+folder as phases finish. write_report() gathers them into one JSON file. A
+main process ignores the variable: there it is left over from another run.
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+import sys
+import time
+import weakref
+
+try:
+    import resource                   # not on Windows, see _peak_rss_mb
+except ImportError:
+    resource = None
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+ENV_VAR = "PIPELINE_METRICS"          # spool folder of the current run, inherited by worker processes
+
+if multiprocessing.current_process().name == "MainProcess":
+    os.environ.pop(ENV_VAR, None)     # not a worker: no run of ours set it, nor for our workers
+_folder = os.environ.get(ENV_VAR) or None
+_open   = weakref.WeakSet()           # phases and laps being timed in this process (see _watch)
+_linux  = sys.platform.startswith("linux")   # per-phase peaks, until /proc/self/clear_refs is refused
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+def enable(folder: str) -> None:
+    """Record phases of this process and of the processes it starts into folder."""
+    global _folder
+    os.makedirs(folder, exist_ok=True)
+    _folder = os.environ[ENV_VAR] = os.path.abspath(folder)
+
+
+def disable() -> None:
+    global _folder
+    _folder = None
+    os.environ.pop(ENV_VAR, None)
+
+
+def enabled() -> bool:
+    return _folder is not None
+
+
+def phase(name: str, rows=None, nbytes=None):
+    """
+    Context manager timing the block as phase name. rows / nbytes (or the
+    attributes of the same name, set inside the block) give the throughput.
+    """
+    if _folder is None:
+        return _NULL
+    return _Phase(name, rows, nbytes)
+
+
+def laps(prefix: str):
+    """
+    Phases of a function that runs one section after the other, without
+    re-indenting it:
+
+        lap = metrics.laps("optimize")
+        ...                              # build
+        lap("build")
+        ...                              # solve
+        lap("solve", rows=n_vars)
+
+    Each call records the time since the previous one (or since laps()) as
+    phase prefix.name.
+    """
+    if _folder is None:
+        return _no_lap
+    return _Laps(prefix)
+
+
+def iterate(name: str, iterable, size=len):
+    """
+    iterable, with the time spent producing each item recorded as phase name
+    (e.g. reading and decompressing chunks); size(item) counts as its bytes.
+    """
+    if _folder is None:
+        return iterable
+    return _timed_items(name, iterable, size)
+
+
+def write_report(path: str, folder: str = None, **info) -> dict:
+    """
+    Gathers the records of every process from folder (default: the enabled
+    one) into the JSON file path and returns its content:
+
+        info     the keyword arguments (run settings, stage statuses, ...)
+        phases   one entry per phase name: calls, summed wall / CPU time,
+                 rows, bytes, rows / MB per second of wall time, the highest
+                 peak RSS and the number of processes it ran in
+        records  every single record, in order of start time
+
+    The wall times of phases that ran in parallel processes add up, so a
+    phase total can exceed the elapsed time of the run.
+    """
+    folder  = folder or _folder
+    records = []
+    for spool in sorted(glob.glob(os.path.join(folder, "*.jsonl"))):
+        with open(spool) as f:
+            records += [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda r: r["start"])
+
+    phases = {}
+    for r in records:
+        p = phases.setdefault(r["name"], {"calls": 0, "wall_s": 0.0, "cpu_s": 0.0, "rows": None,
+                                          "bytes": None, "peak_rss_mb": None, "processes": set()})
+        p["calls"]  += 1
+        p["wall_s"] += r["wall_s"]
+        p["cpu_s"]  += r["cpu_s"]
+        p["processes"].add(r["pid"])
+        for key in ("rows", "bytes"):
+            if r[key] is not None:
+                p[key] = (p[key] or 0) + r[key]
+        if r["peak_rss_mb"] is not None:
+            p["peak_rss_mb"] = max(p["peak_rss_mb"] or 0.0, r["peak_rss_mb"])
+    for p in phases.values():
+        p["processes"]      = len(p["processes"])
+        p["rows_per_s"]     = _rate(p["rows"], p["wall_s"])
+        p["MB_per_s"]       = _rate(p["bytes"] and p["bytes"] / 1e6, p["wall_s"])
+        p["wall_s"], p["cpu_s"] = round(p["wall_s"], 4), round(p["cpu_s"], 4)
+
+    report = {"info": info, "phases": phases, "records": records}
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    return report
+
+
+# ── Phases ────────────────────────────────────────────────────────────────────
+class _Phase:
+    __slots__ = ("name", "rows", "nbytes", "_start", "_wall", "_cpu", "peak", "__weakref__")
+
+    def __init__(self, name, rows, nbytes):
+        self.name, self.rows, self.nbytes = name, rows, nbytes
+
+    def __enter__(self):
+        _watch(self)
+        self._start = time.time()
+        self._wall  = time.perf_counter()
+        self._cpu   = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _record(self.name, self._start, time.perf_counter() - self._wall,
+                time.process_time() - self._cpu, _unwatch(self), self.rows, self.nbytes,
+                exc_type is None)
+        return False
+
+
+class _NullPhase:
+    # Stands in for _Phase while disabled: attribute writes (p.rows = ...) are dropped
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL = _NullPhase()
+
+
+class _Laps:
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._restart()
+
+    def _restart(self):
+        _watch(self)
+        self._start = time.time()
+        self._wall  = time.perf_counter()
+        self._cpu   = time.process_time()
+
+    def __call__(self, name, rows=None, nbytes=None):
+        _record(f"{self.prefix}.{name}", self._start, time.perf_counter() - self._wall,
+                time.process_time() - self._cpu, _unwatch(self), rows, nbytes, True)
+        self._restart()
+
+
+def _no_lap(name, rows=None, nbytes=None):
+    pass
+
+
+def _timed_items(name, iterable, size):
+    items = iter(iterable)
+    while True:
+        with phase(name) as p:
+            try:
+                item = next(items)
+            except StopIteration:
+                return
+            p.nbytes = size(item)
+        yield item
+
+
+def _record(name, start, wall, cpu, peak, rows, nbytes, ok):
+    if _folder is None:
+        return
+    record = {"name": name, "pid": os.getpid(), "start": round(start, 6),
+              "wall_s": round(wall, 6), "cpu_s": round(cpu, 6), "peak_rss_mb": peak,
+              "rows": rows, "bytes": nbytes, "ok": ok}
+    with open(os.path.join(_folder, f"{os.getpid()}.jsonl"), "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+# ── Peak RSS ──────────────────────────────────────────────────────────────────
+def _watch(item):
+    # Starts the peak RSS of a phase (or lap): the peak so far goes to the
+    # phases that are open, then the high-water mark restarts from the
+    # current RSS, so that the phase gets its own peak
+    peak = _peak_rss_mb()
+    for other in _open:
+        other.peak = _max(other.peak, peak)
+    item.peak = None if _reset_peak() else peak
+    _open.add(item)
+
+
+def _unwatch(item):
+    # Ends it: the peak RSS of the phase [MB], also counted in the phases
+    # around it. A laps() object left behind drops out with its function.
+    peak = _peak_rss_mb()
+    _open.discard(item)
+    for other in _open:
+        other.peak = _max(other.peak, peak)
+    return _max(item.peak, peak)
+
+
+def _reset_peak():
+    # Linux: restarts the high-water mark of this process (VmHWM) from its
+    # current RSS. False where it cannot be reset: the peak is the process's
+    global _linux
+    if not _linux:
+        return False
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        _linux = False
+        return False
+
+
+def _peak_rss_mb():
+    # Highest resident set size of this process since the last reset [MB]
+    # (None if unknown)
+    if _linux:
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        return round(int(line.split()[1]) / (1 << 10), 1)   # kB
+        except OSError:
+            pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)   # bytes on macOS, KiB elsewhere
+    if os.name == "nt":
+        import ctypes
+        from ctypes import wintypes
+
+        class _Counters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (field, ctypes.c_size_t) for field in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage", "QuotaNonPagedPoolUsage",
+                    "PagefileUsage", "PeakPagefileUsage")]
+
+        counters = _Counters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return round(counters.PeakWorkingSetSize / (1 << 20), 1)
+    return None
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+def _max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+def _rate(amount, seconds):
+    if amount is None or seconds <= 0:
+        return None
+    return round(amount / seconds, 3)
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+network_cache.py
+----------------
+Persistent on-disk cache of the columnar network (network_parser.NetworkArrays).
+
+The MATSim network does not change between runs, so the result of
+parse_network_arrays() is written once as a folder of .npy columns and
+re-opened with np.load(mmap_mode="r") on later runs: opening costs a few
+milliseconds and the columns are paged in by the OS only when they are used.
+
+    <cache_dir>/network_cache/
+        meta.json          — cache version, source fingerprint, mode names
+        link_ids.npy, link_order.npy, from_node.npy, to_node.npy,
+        length_m.npy, freespeed_ms.npy, capacity.npy, modes.npy,
+        node_ids.npy, node_order.npy, node_xy.npy
+
+The cache is keyed on the network file's size, mtime and SHA-256 digest.
+Size and mtime are checked first; the digest is only recomputed when they
+differ (e.g. the file was copied), so a valid cache is never re-hashed.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+from network_parser import NetworkArrays, parse_network_arrays
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+CACHE_VERSION = 1                 # bump whenever the NetworkArrays layout changes
+CACHE_FOLDER  = "network_cache"
+
+ARRAY_FIELDS = [
+    "link_ids", "link_order", "from_node", "to_node", "length_m",
+    "freespeed_ms", "capacity", "modes", "node_ids", "node_order", "node_xy",
+]
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+def load_network(network_path: str, cache_dir: str) -> NetworkArrays:
+    """
+    Return the NetworkArrays for network_path, from the cache in cache_dir if
+    it matches the file, otherwise by parsing it and (re)writing the cache.
+    """
+    folder = os.path.join(cache_dir, CACHE_FOLDER)
+    meta   = _read_meta(folder)
+    stat   = os.stat(network_path)
+
+    if meta is not None and meta["version"] == CACHE_VERSION:
+        fp = meta["fingerprint"]
+        if fp["size"] == stat.st_size and fp["mtime_ns"] == stat.st_mtime_ns:
+            print(f"  → Network loaded from cache ({folder})")
+            return _open(folder, meta)
+
+        if fp["size"] == stat.st_size and fp["sha256"] == _sha256(network_path):
+            # Same content, new mtime (copied / touched): refresh the key only
+            meta["fingerprint"]["mtime_ns"] = stat.st_mtime_ns
+            _write_meta(folder, meta)
+            print(f"  → Network loaded from cache ({folder}, file touched but unchanged)")
+            return _open(folder, meta)
+
+    network = parse_network_arrays(network_path)
+    save_network(network, folder, {
+        "size":     stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sha256":   _sha256(network_path),
+    })
+    print(f"  → Network cache written to {folder}")
+    return network
+
+
+def save_network(network: NetworkArrays, folder: str, fingerprint: dict) -> None:
+    """
+    Write network as .npy columns plus meta.json into folder.
+    The folder is built under a temporary name and swapped in at the end, so
+    an interrupted run never leaves a half-written cache behind.
+    """
+    tmp = folder + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    for field in ARRAY_FIELDS:
+        np.save(os.path.join(tmp, f"{field}.npy"), getattr(network, field))
+
+    _write_meta(tmp, {
+        "version":     CACHE_VERSION,
+        "fingerprint": fingerprint,
+        "mode_names":  network.mode_names,
+        "n_links":     int(len(network.link_ids)),
+        "n_nodes":     int(len(network.node_ids)),
+    })
+
+    shutil.rmtree(folder, ignore_errors=True)
+    os.replace(tmp, folder)
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+def _open(folder: str, meta: dict) -> NetworkArrays:
+    columns = {
+        field: np.load(os.path.join(folder, f"{field}.npy"), mmap_mode="r")
+        for field in ARRAY_FIELDS
+    }
+    return NetworkArrays(mode_names=meta["mode_names"], **columns)
+
+
+def _read_meta(folder: str):
+    path = os.path.join(folder, "meta.json")
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None                   # unreadable cache is treated as missing
+
+
+def _write_meta(folder: str, meta: dict) -> None:
+    with open(os.path.join(folder, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
@@ -7,7 +7,10 @@ Created on Fri Feb 20 10:47:44 2026
 
 import gzip                                # built-in tool called that knows how to open compressed files (.gz)
 import xml.etree.ElementTree as ET         # built-in XML reader
+from functools import cached_property        # computed once per object on first access, then stored on it
 from dataclasses import dataclass          # dataclass is a helper that lets you define a data container (a structured object to hold related variables) without writing a lot of repetitive code
+from xml.parsers import expat              # the C-level XML parser that ElementTree is built on, used directly to avoid creating Element objects
+import numpy as np
 import pandas as pd                        # Pandas library (nicknamed pd), which is used to create tables (DataFrames)
 
 @dataclass
@@ -79,10 +82,22 @@ def parse_network(network_path: str) -> tuple[dict[str, Link], dict[str, Node]]:
     return links, nodes
 
 
-def links_to_dataframe(links: dict[str, Link]) -> pd.DataFrame:
+def links_to_dataframe(links) -> pd.DataFrame:
     """
-    Converts the links dict to a flat DataFrame for easy lookups.
+    Converts the links dict (or a NetworkArrays table) to a flat DataFrame for easy lookups.
     """
+    if isinstance(links, NetworkArrays):
+        net = links
+        return pd.DataFrame({
+            "link_id":      net.link_ids,
+            "from_node":    net.node_ids[net.from_node],
+            "to_node":      net.node_ids[net.to_node],
+            "length_m":     net.length_m,
+            "freespeed_ms": net.freespeed_ms.astype(np.float64),   # same schema as the dict path
+            "capacity":     net.capacity.astype(np.float64),
+            "modes":        modes_to_strings(net),
+        }).set_index("link_id")
+
     records = [
         {
             "link_id":      lnk.link_id,
@@ -99,10 +114,218 @@ def links_to_dataframe(links: dict[str, Link]) -> pd.DataFrame:
 
 
 # ── Convenience: fast length lookup for event parsing ──────────────────────
-def build_length_lookup(links: dict[str, Link]) -> dict[str, float]:
+def build_length_lookup(links) -> dict[str, float]:
     """
     Returns a plain dict  link_id -> length_m
     This is what the events parser will call millions of times,
     so keeping it as a plain dict is faster than a DataFrame lookup.
+    Accepts either the links dict or a NetworkArrays table.
     """
+    if isinstance(links, NetworkArrays):
+        return dict(zip(links.link_ids.tolist(), links.length_m.tolist()))
     return {lid: lnk.length_m for lid, lnk in links.items()}
+
+
+# ── Columnar (struct-of-arrays) network ────────────────────────────────────
+#
+# parse_network() creates one Link and one Node object per element, which for
+# the 718k-link Île-de-France network costs minutes and several GB of RAM.
+# parse_network_arrays() reads the same file with expat and keeps every
+# attribute in a typed column instead: links and nodes are identified by their
+# row number, and from/to nodes are stored as row numbers into the node arrays.
+
+@dataclass
+class NetworkArrays:
+    link_ids:     np.ndarray    # (L,)  str      MATSim link id of each row
+    link_order:   np.ndarray    # (L,)  int32    argsort of link_ids, used by link_rows()
+    from_node:    np.ndarray    # (L,)  int32    row of the from node in the node arrays
+    to_node:      np.ndarray    # (L,)  int32    row of the to node in the node arrays
+    length_m:     np.ndarray    # (L,)  float64  kept in double precision: trip distances are sums of these
+    freespeed_ms: np.ndarray    # (L,)  float32
+    capacity:     np.ndarray    # (L,)  float32
+    modes:        np.ndarray    # (L,)  uint32   bit i set  <=>  mode_names[i] allowed on the link
+    mode_names:   list          # bit position -> mode string
+    node_ids:     np.ndarray    # (N,)  str      MATSim node id of each row
+    node_order:   np.ndarray    # (N,)  int32    argsort of node_ids, used by node_rows()
+    node_xy:      np.ndarray    # (N, 2) float64 projected coordinates in metres
+
+    @cached_property
+    def link_midpoints(self) -> np.ndarray:
+        """
+        (L, 2) float64 midpoint of every link (mean of its two end nodes),
+        NaN where a node has no coordinates. Computed once per table and
+        gathered by link row, e.g. link_midpoints[link_rows(network, ids)].
+        """
+        return (self.node_xy[self.from_node] + self.node_xy[self.to_node]) / 2
+
+
+def parse_network_arrays(network_path: str) -> NetworkArrays:
+    """
+    Streaming columnar parser for MATSim output_network.xml(.gz).
+    Same information as parse_network(), returned as a NetworkArrays table.
+    """
+    # While parsing, the expat callback only appends the raw attribute strings
+    # to lists; number conversion, node resolution and mode encoding are then
+    # done column-wise with NumPy, which is where most of the speed-up comes from.
+    node_ids: list[str] = []
+    node_x:   list[str] = []
+    node_y:   list[str] = []
+
+    link_ids:  list[str] = []
+    from_ids:  list[str] = []
+    to_ids:    list[str] = []
+    length:    list[str] = []
+    freespeed: list[str] = []
+    capacity:  list[str] = []
+    modes_raw: list[str] = []
+
+    def _start(tag, attrib):
+        if tag == "link":
+            link_ids.append(attrib["id"])
+            from_ids.append(attrib["from"])
+            to_ids.append(attrib["to"])
+            length.append(attrib["length"])
+            freespeed.append(attrib.get("freespeed", "0"))
+            capacity.append(attrib.get("capacity", "0"))
+            modes_raw.append(attrib.get("modes", ""))
+
+        elif tag == "node":
+            node_ids.append(attrib["id"])
+            node_x.append(attrib["x"])
+            node_y.append(attrib["y"])
+
+    parser = expat.ParserCreate()
+    parser.buffer_size = 1 << 20            # feed expat 1 MiB at a time instead of the 8 KiB default
+    parser.StartElementHandler = _start
+
+    opener = gzip.open if network_path.endswith(".gz") else open
+    with opener(network_path, "rb") as f:
+        parser.ParseFile(f)
+
+    network = _build_arrays(node_ids, node_x, node_y, link_ids, from_ids, to_ids,
+                            length, freespeed, capacity, modes_raw)
+    print(f"Parsed {len(network.node_ids):,} nodes and {len(network.link_ids):,} links.")
+    return network
+
+
+def arrays_from_dicts(links: dict, nodes: dict) -> NetworkArrays:
+    """
+    The Link / Node dicts of parse_network() as a NetworkArrays table, so the
+    dict path can use the same array code (link_rows, link_midpoints) as the
+    columnar network: one pass over the objects instead of dict lookups per
+    query. Rows follow the dict order, i.e. the order of the network file.
+    """
+    lks = list(links.values())
+    nds = list(nodes.values())
+    return _build_arrays(
+        [n.node_id for n in nds], [n.x for n in nds], [n.y for n in nds],
+        [lk.link_id for lk in lks], [lk.from_node for lk in lks], [lk.to_node for lk in lks],
+        [lk.length_m for lk in lks], [lk.freespeed_ms for lk in lks], [lk.capacity for lk in lks],
+        [",".join(sorted(lk.modes)) for lk in lks],
+    )
+
+
+def _build_arrays(node_ids, node_x, node_y, link_ids, from_ids, to_ids,
+                  length, freespeed, capacity, modes_raw) -> NetworkArrays:
+    # Column-wise conversion of the raw attribute lists (strings from the
+    # parser, or the values of Link / Node objects) into a NetworkArrays table
+
+    # ── Nodes ──────────────────────────────────────────────────────────────
+    # Links referencing an undeclared node get a placeholder row with NaN
+    # coordinates (parse_network() would simply not find them in nodes).
+    #
+    # One factorize over declared + referenced ids resolves every reference:
+    # codes follow first appearance, so the declared nodes keep codes 0 … N-1
+    # and undeclared ones come after (renumbered in sorted order).
+    node_xy = np.column_stack([np.array(node_x, dtype=np.float64),
+                               np.array(node_y, dtype=np.float64)]).reshape(-1, 2)
+    n_nodes = len(node_ids)
+    codes, distinct = pd.factorize(np.array(list(node_ids) + list(from_ids) + list(to_ids), dtype=object))
+    node_pos = codes[n_nodes:]
+    if len(distinct) > n_nodes:
+        missing = np.asarray(distinct[n_nodes:], dtype=object)
+        order   = np.argsort(missing.astype(str), kind="stable")
+        rank    = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        late    = node_pos >= n_nodes
+        node_pos[late] = n_nodes + rank[node_pos[late] - n_nodes]
+        node_ids = list(node_ids) + missing[order].tolist()
+        node_xy  = np.vstack([node_xy, np.full((len(missing), 2), np.nan)])
+    node_ids_arr = np.array(node_ids, dtype=str)
+    node_pos     = node_pos.astype(np.int32)
+
+    # ── Modes → bitmask ────────────────────────────────────────────────────
+    # Only a handful of distinct "modes" strings exist, so they are encoded
+    # once each and broadcast back with the factorize codes.
+    codes, distinct = pd.factorize(pd.Index(modes_raw, dtype=object))
+    mode_names: list[str] = []
+    masks = np.zeros(len(distinct), dtype=np.uint32)
+    for i, raw in enumerate(distinct):
+        for mode in raw.split(","):
+            if not mode:
+                continue
+            if mode not in mode_names:
+                if len(mode_names) == 32:
+                    raise ValueError("More than 32 distinct link modes, the uint32 bitmask cannot hold them")
+                mode_names.append(mode)
+            masks[i] |= np.uint32(1 << mode_names.index(mode))
+
+    link_ids_arr = np.array(link_ids, dtype=str)
+    n_links      = len(link_ids_arr)
+
+    return NetworkArrays(
+        link_ids     = link_ids_arr,
+        link_order   = np.argsort(link_ids_arr, kind="stable").astype(np.int32),
+        from_node    = node_pos[:n_links],
+        to_node      = node_pos[n_links:],
+        length_m     = np.array(length,    dtype=np.float64),
+        freespeed_ms = np.array(freespeed, dtype=np.float64).astype(np.float32),
+        capacity     = np.array(capacity,  dtype=np.float64).astype(np.float32),
+        modes        = masks[codes] if n_links else np.zeros(0, dtype=np.uint32),
+        mode_names   = mode_names,
+        node_ids     = node_ids_arr,
+        node_order   = np.argsort(node_ids_arr, kind="stable").astype(np.int32),
+        node_xy      = node_xy,
+    )
+
+
+def modes_to_strings(network: NetworkArrays) -> np.ndarray:
+    """
+    Decodes the mode bitmask back to the sorted "car,car_passenger" strings
+    written by links_to_dataframe(). Only the distinct masks are decoded.
+    """
+    masks, inverse = np.unique(network.modes, return_inverse=True)
+    labels = np.array([
+        ",".join(sorted(name for bit, name in enumerate(network.mode_names) if mask >> bit & 1))
+        for mask in masks.tolist()
+    ], dtype=object)
+    return labels[inverse]
+
+
+def link_rows(network: NetworkArrays, link_ids) -> np.ndarray:
+    """
+    Row number of each link id in the NetworkArrays table, -1 if unknown.
+    Vectorised binary search, so no link_id -> row dict has to be kept.
+    Integer link ids (interning.py) already are rows and are only range-checked.
+    """
+    ids = pd.Series(link_ids)
+    if pd.api.types.is_integer_dtype(ids):
+        rows = ids.fillna(-1).to_numpy(dtype=np.int64)
+        return np.where(rows < len(network.link_ids), rows, -1)
+    return _lookup_rows(network.link_ids, network.link_order, link_ids)
+
+
+def node_rows(network: NetworkArrays, node_ids) -> np.ndarray:
+    """
+    Row number of each node id in the NetworkArrays table, -1 if unknown.
+    """
+    return _lookup_rows(network.node_ids, network.node_order, node_ids)
+
+
+def _lookup_rows(ids: np.ndarray, order: np.ndarray, query) -> np.ndarray:
+    query = np.asarray(query, dtype=object).astype(str)
+    if len(ids) == 0:
+        return np.full(len(query), -1, dtype=np.int64)
+    pos  = np.minimum(np.searchsorted(ids, query, sorter=order), len(ids) - 1)
+    rows = order[pos].astype(np.int64)
+    return np.where(ids[rows] == query, rows, -1)
@@ -7,13 +7,20 @@ Created on Mon Feb 23 16:03:51 2026
 
 import numpy as np
 import pandas as pd
-import gurobipy as gp
-from gurobipy import GRB
+import scipy.sparse as sp
 import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Optional
+import metrics
+from discharge_tensor import load_discharge_tensor
+from lp_solvers import LinearProgram, LPSolution, solve_lp
 
 # ── Configuration ─────────────────────────────────────────────────────────────
-DISCHARGE_PATH  = "output/discharge_profile.parquet"
+DISCHARGE_PATH  = "output/discharge_tensor"         # folder written by Step 4a (discharge_tensor.py)
 PROFILES_PATH   = "output/input_profiles.parquet"
+NODES_PATH      = "output/nodes.parquet"                # written by build_nodes.build_node_mapping
+ASSIGNMENTS_PATH = "output/parking_assignments.parquet"
 OUTPUT_DIR      = "output"
 
 SLOT_DURATION   = 900           # seconds
@@ -30,127 +37,589 @@ SD_EV           = 0.0005 / 3600 # self-discharge [1/s] → divide by 3600 to get
                                  # actually kept as [1/h]: 0.05%/h = 0.0005 [1/h]
 SD_EV_PER_SLOT  = 0.0005 * DT   # dimensionless loss per slot = 0.000125
 C_SELL          = 0.008          # €/kWh — fixed sell price
-
-def run_optimization():
+TIME_LIMIT      = 3000           # seconds
+DAYS_PER_YEAR   = 365            # split over the typical days when no day weights are given
+NODE_IMPORT_LIMIT = np.inf       # kW grid import per node, unless nodes.parquet has import_limit_kW
+
+def run_optimization(solver="auto", aggregate=True, tolerance=0.0, method="lp", jobs=1):
+    """
+    Build the fleet charging LP and solve it with solver ("gurobi", "highs",
+    "linprog" or "auto", see lp_solvers.py).
+
+    method="admm" solves it instead by price-coordinated decomposition
+    (decomposition.py): the vehicles are solved separately in `jobs` worker
+    processes and the result is optimal to within the ADMM tolerances
+    (decomposition.TOL_REL of the cost). A run that stops at the iteration
+    limit has no solution.
+
+    With aggregate=True, vehicles with the same parked pattern and
+    consumption profile are solved as one weighted cohort (see
+    build_cohorts); with tolerance=0 the optimum is unchanged. tolerance > 0
+    also merges consumption profiles that agree to within tolerance [kWh]
+    per slot, which is an approximation.
+    """
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     # ── Load data ─────────────────────────────────────────────────────────────
-    discharge = pd.read_parquet(DISCHARGE_PATH)
-    profiles  = pd.read_parquet(PROFILES_PATH)
-    
-
+    fleet    = load_fleet(aggregate, tolerance)
+    profiles = pd.read_parquet(PROFILES_PATH)
+    PPV, C_buy = day_inputs(profiles)
 
-    vehicles  = discharge["vehicle_id"].unique()
-    V         = len(vehicles)
-    vid_map   = {v: i for i, v in enumerate(vehicles)}
-
-    # Parked[v, t] and E_consumed[v, t] in kWh
-    Parked = np.zeros((V, N_SLOTS), dtype=int)
-    E_cons = np.zeros((V, N_SLOTS))                 # [kWh] already from discharge_profile
-
-    for _, row in discharge.iterrows():
-        v = vid_map[row["vehicle_id"]]
-        t = int(row["slot"])
-        Parked[v, t] = int(row["parked"])
-        E_cons[v, t] = row["energy_consumed_kWh"]   # [kWh] consumed in that 15-min slot
+    # ── Solve ─────────────────────────────────────────────────────────────────
+    solution = solve_day(fleet, PPV, C_buy, solver=solver, method=method, jobs=jobs)
 
-    # Solar and price profiles
-    SolRad = profiles["SolRad_Wm2"].to_numpy()       # [W/m²]
-    C_buy  = profiles["Price_EURkWh"].to_numpy()     # [€/kWh]
+    # ── Extract results ───────────────────────────────────────────────────────
+    if solution.has_solution:       # optimal, ADMM converged, or best solution found within TIME_LIMIT
+        results = save_results(fleet, solution, PPV, C_buy, OUTPUT_DIR)
 
-    # PV power output [kW] — already a power, no DT needed here
-    PPV = CAP_PV * SolRad / 1000.0                   # [kW]
+        print(f"Total fleet consumption: {fleet.E_total:.1f} kWh")
+        print(f"Total PV available:      {PPV.sum() * DT:.1f} kWh")
+        print(f"Total chargeable slots:  {fleet.parked_total} vehicle-slots")
+        print(f"Avg daily consumption/vehicle: {fleet.E_total / fleet.V:.2f} kWh")
 
-    # ── Gurobi model ──────────────────────────────────────────────────────────
-    m = gp.Model("EV_PV_Grid")
-    m.Params.OutputFlag    = 1
-    m.Params.MIPGap        = 1e-4
-    m.Params.TimeLimit     = 3000   # seconds
 
-    # ── Decision variables ────────────────────────────────────────────────────
-    # Charging power [kW] per vehicle per slot
-    Pc  = m.addVars(V, N_SLOTS, lb=0.0, name="Pc")
+        label = "Optimal cost" if solution.status == "optimal" else "Cost"
+        print(f"\n  → {label}: {solution.objective:.2f} € "
+              f"({solution.solver}, {solution.status}, {solution.seconds:.1f} s)")
+        print(f"  → Total import: {results['P_imp_kW'].sum() * DT:.1f} kWh")
+        print(f"  → Total export: {results['P_exp_kW'].sum() * DT:.1f} kWh")
+        print(f"  → Total PV:     {results['PPV_kW'].sum() * DT:.1f} kWh")
 
-    # SOC [kWh] per vehicle per slot (state at START of slot t)
-    SOC = m.addVars(V, N_SLOTS + 1, lb=CAP_EV * SOC_MIN, ub=CAP_EV * SOC_MAX, name="SOC")
+        return results
 
-    # Grid import/export [kW] per slot (aggregated)
-    P_imp = m.addVars(N_SLOTS, lb=0.0, name="P_imp")
-    P_exp = m.addVars(N_SLOTS, lb=0.0, name="P_exp")
+    else:
+        print(f"  ✗ Solver status: {solution.status} ({solution.solver})")
+        return None
 
-    # ── Constraints ───────────────────────────────────────────────────────────
 
-    # 1. Charging only when parked
-    m.addConstrs(Pc[v, t] <= P_MAX * Parked[v, t] for v in range(V) for t in range(N_SLOTS))
+def run_batch_optimization(day_profiles, day_weights=None, solver="auto", aggregate=True,
+                           tolerance=0.0, method="lp", jobs=0):
+    """
+    Solve every typical day of day_profiles ({day: profiles DataFrame, see
+    prepare_profiles.build_day_profiles}) for the same fleet.
 
-    # 2. SOC dynamics — all terms in [kWh]
-    #    SOC[v, t+1] = SOC[v, t] * (1 - SD_EV_PER_SLOT)
-    #                + Pc[v, t] * ETA_SQRT * DT    ← [kW] * [h] = [kWh]
-    #                - E_cons[v, t]                ← already [kWh]
-    m.addConstrs(
-    (SOC[v, t + 1] == SOC[v, t] * (1 - SD_EV_PER_SLOT) + Pc[v, t] * ETA_SQRT * DT - E_cons[v, t]
-     for v in range(V) for t in range(N_SLOTS)), name="soc_dyn")
+    day_weights {day: days per year} (default: DAYS_PER_YEAR split evenly)
+    turns the daily costs into an annual cost.
 
+    The days are solved in `jobs` worker processes (0 = one per CPU core).
+    Each worker opens the memory-mapped discharge tensor and builds the
+    cohorts and the LP matrices once; a day only changes the PV and price
+    vectors (see with_day_inputs).
 
-    # 3. Cyclic condition — SOC at end of day = SOC at start
-    m.addConstrs((SOC[v, N_SLOTS] == SOC[v, 0] for v in range(V)), name="cyclic")
+    Writes <OUTPUT_DIR>/days/<day>/optimization_results.parquet and
+    soc_results.parquet per day, and typical_day_costs.parquet (one row per
+    day). Returns that cost table. A day without a solution keeps its row
+    with its solver status and NaN costs; the printed annual cost leaves it
+    out and names it.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    days = list(day_profiles)
+    if day_weights is None:
+        day_weights = {day: DAYS_PER_YEAR / len(days) for day in days}
+    missing = [day for day in days if day not in day_weights]
+    if missing:
+        raise ValueError(f"No day weight for typical days {missing}")
+
+    tasks = [(day, *day_inputs(day_profiles[day]), solver, method, os.path.join(OUTPUT_DIR, "days", str(day)))
+             for day in days]
+    jobs  = min(jobs or os.cpu_count() or 1, len(tasks))
+
+    if jobs == 1:
+        _init_worker(DISCHARGE_PATH, aggregate, tolerance)
+        rows = [_solve_day_task(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(DISCHARGE_PATH, aggregate, tolerance)) as pool:
+            rows = list(pool.map(_solve_day_task, *zip(*tasks)))
+
+    costs = pd.DataFrame(rows)
+    costs["weight_days"] = costs["day"].map(day_weights).astype(float)
+    costs["annual_cost_EUR"] = costs["cost_EUR"] * costs["weight_days"]
+    costs.to_parquet(os.path.join(OUTPUT_DIR, "typical_day_costs.parquet"), index=False)
+
+    for row in costs.itertuples():
+        if pd.isna(row.cost_EUR):
+            print(f"  ✗ {row.day!s:<16} no solution  × {row.weight_days:6.1f} days "
+                  f"({row.solver}, {row.status}, {row.seconds:.1f} s)")
+        else:
+            print(f"  → {row.day!s:<16} {row.cost_EUR:10.2f} € × {row.weight_days:6.1f} days "
+                  f"({row.solver}, {row.status}, {row.seconds:.1f} s)")
+
+    # The annual cost covers the solved days only; the others are listed with it
+    solved = costs[costs["cost_EUR"].notna()]
+    failed = costs[costs["cost_EUR"].isna()]
+    print(f"  → Annual cost: {solved['annual_cost_EUR'].sum():.2f} € "
+          f"({len(solved)} typical days, {solved['weight_days'].sum():.0f} days)")
+    if len(failed):
+        print(f"  ⚠ Not in the annual cost (no solution): {', '.join(map(str, failed['day']))} "
+              f"— {failed['weight_days'].sum():.0f} days")
+    return costs
+
+
+def run_node_optimization(solver="auto", aggregate=True, tolerance=0.0):
+    """
+    Multi-node version of run_optimization: every electrical node of
+    build_nodes.build_node_mapping has its own power balance, grid import
+    limit and local PV (see build_node_lp). A vehicle can charge in a slot
+    when it is parked (discharge tensor) at a node (parking_assignments).
+
+    nodes.parquet may carry import_limit_kW and cap_pv_kW columns; without
+    them every node gets NODE_IMPORT_LIMIT and an equal share of CAP_PV.
+
+    Writes node_results.parquet (one row per active node and slot) and the
+    fleet totals per slot to optimization_results.parquet.
+    """
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    lap = metrics.laps("optimize")              # phase timings, when metrics are enabled
 
-    # 4. Power balance per slot [kW] — DT cancels on both sides
-    #    PPV[t] + P_imp[t] - P_exp[t] = sum_v Pc[v, t]
-    m.addConstrs((PPV[t] + P_imp[t] - P_exp[t] == gp.quicksum(Pc[v, t] 
-    for v in range(V))for t in range(N_SLOTS)), name="balance")
-    
-    
-    # 5. Maximum exported electricity
-    
+    # ── Load data ─────────────────────────────────────────────────────────────
+    discharge   = load_discharge_tensor(DISCHARGE_PATH)
+    nodes       = pd.read_parquet(NODES_PATH)
+    assignments = pd.read_parquet(ASSIGNMENTS_PATH)
+    profiles    = pd.read_parquet(PROFILES_PATH)
+    V, N        = len(discharge), len(nodes)
+
+    # Chargeable = parked in the tensor AND at a node in the assignments
+    node_slot = node_slot_matrix(assignments, discharge.vehicle_ids, nodes["node_id"])
+    Parked    = discharge.parked_matrix().astype(int) * (node_slot >= 0)
+    node_slot = np.where(Parked > 0, node_slot, -1)
+    E_cons    = discharge.energy_matrix()
+    lap("load", rows=V)
+
+    if aggregate:
+        cohorts = build_cohorts(Parked, E_cons, tolerance, node_slot=node_slot)
+    else:
+        cohorts = Cohorts(members=np.arange(V), weights=np.ones(V), Parked=Parked, E_cons=E_cons,
+                          node_slot=node_slot)
+    C = len(cohorts.weights)
+    print(f"  → {V:,} vehicles at {N:,} nodes in {C:,} cohorts")
+    lap("cohorts", rows=V)
 
-    # ── Objective — cost in [€] ───────────────────────────────────────────────
-    # [kW] * [€/kWh] * [h] = [€]
-    obj = gp.quicksum((P_imp[t] * C_buy[t] - P_exp[t] * C_SELL) * DT for t in range(N_SLOTS))
-    
-    m.setObjective(obj, GRB.MINIMIZE)
+    SolRad = profiles["SolRad_Wm2"].to_numpy()       # [W/m²]
+    C_buy  = profiles["Price_EURkWh"].to_numpy()     # [€/kWh]
+    cap_pv = (nodes["cap_pv_kW"].to_numpy(dtype=np.float64) if "cap_pv_kW" in nodes
+              else np.full(N, CAP_PV / max(N, 1)))
+    limit  = (nodes["import_limit_kW"].to_numpy(dtype=np.float64) if "import_limit_kW" in nodes
+              else np.full(N, NODE_IMPORT_LIMIT))
+    PPV_nodes = cap_pv[:, None] * SolRad[None, :] / 1000.0      # (N, N_SLOTS) [kW]
 
     # ── Solve ─────────────────────────────────────────────────────────────────
-    m.optimize()
+    lp, pair_node, pair_slot = build_node_lp(cohorts.Parked, cohorts.E_cons, cohorts.node_slot,
+                                             PPV_nodes, C_buy, limit, weights=cohorts.weights)
+    print(f"  → {len(pair_node):,} active node-slots ({lp.n_vars:,} variables, {lp.n_rows:,} rows)")
+    lap("build", rows=lp.n_rows)
+    solution = solve_lp(lp, solver=solver, time_limit=TIME_LIMIT)
+    lap("solve", rows=lp.n_rows)
+
+    if not solution.has_solution:
+        print(f"  ✗ Solver status: {solution.status} ({solution.solver})")
+        return None
 
     # ── Extract results ───────────────────────────────────────────────────────
-    if m.Status in [GRB.OPTIMAL, GRB.TIME_LIMIT]:
-        slots = np.arange(N_SLOTS)
-
-        results = pd.DataFrame({
-            "slot":        slots,
-            "t_start":     slots * SLOT_DURATION,
-            "P_imp_kW":    [P_imp[t].X for t in slots],
-            "P_exp_kW":    [P_exp[t].X for t in slots],
-            "PPV_kW":      PPV,
-            "total_Pc_kW": [sum(Pc[v, t].X for v in range(V)) for t in slots],
-            "C_buy":       C_buy,
-        })
-
-        soc_results = pd.DataFrame({
-            f"v{v}": [SOC[v, t].X for t in range(N_SLOTS + 1)]
-            for v in range(min(V, 20))  # save first 20 vehicles to keep file small
-        })
-
-        results.to_parquet(os.path.join(OUTPUT_DIR, "optimization_results.parquet"), index=False)
-        soc_results.to_parquet(os.path.join(OUTPUT_DIR, "soc_results.parquet"), index=False)
-        
-        print(f"Total fleet consumption: {E_cons.sum():.1f} kWh")
-        print(f"Total PV available:      {PPV.sum() * DT:.1f} kWh")
-        print(f"Total chargeable slots:  {Parked.sum()} vehicle-slots")
-        print(f"Avg daily consumption/vehicle: {E_cons.sum() / V:.2f} kWh")
+    Pc_X, SOC_X, P_imp_X, P_exp_X = split_solution(solution.x, C, n_grid=len(pair_node))
+    PPV_pair = PPV_nodes[pair_node, pair_slot]
+    node_results = pd.DataFrame({
+        "node_id":     nodes["node_id"].to_numpy()[pair_node],
+        "slot":        pair_slot,
+        "P_imp_kW":    P_imp_X,
+        "P_exp_kW":    P_exp_X,
+        "PPV_kW":      PPV_pair,
+        "total_Pc_kW": PPV_pair + P_imp_X - P_exp_X,        # node balance
+    })
+
+    # Node-slots without chargeable vehicles export all of their PV
+    PPV_slot    = PPV_nodes.sum(axis=0)
+    idle_export = PPV_slot - np.bincount(pair_slot, weights=PPV_pair, minlength=N_SLOTS)
+    slots   = np.arange(N_SLOTS)
+    results = pd.DataFrame({
+        "slot":        slots,
+        "t_start":     slots * SLOT_DURATION,
+        "P_imp_kW":    np.bincount(pair_slot, weights=P_imp_X, minlength=N_SLOTS),
+        "P_exp_kW":    np.bincount(pair_slot, weights=P_exp_X, minlength=N_SLOTS) + idle_export,
+        "PPV_kW":      PPV_slot,
+        "total_Pc_kW": cohorts.weights @ Pc_X,
+        "C_buy":       C_buy,
+    })
+    cost = solution.objective - float(np.sum(idle_export)) * C_SELL * DT
+
+    node_results.to_parquet(os.path.join(OUTPUT_DIR, "node_results.parquet"), index=False)
+    results.to_parquet(os.path.join(OUTPUT_DIR, "optimization_results.parquet"), index=False)
+    lap("extract", rows=len(node_results))
+
+    print(f"\n  → Optimal cost: {cost:.2f} € "
+          f"({solution.solver}, {solution.status}, {solution.seconds:.1f} s)")
+    print(f"  → Total import: {results['P_imp_kW'].sum() * DT:.1f} kWh")
+    print(f"  → Total export: {results['P_exp_kW'].sum() * DT:.1f} kWh")
+    limited = np.isfinite(limit[pair_node]) & (P_imp_X >= limit[pair_node] - 1e-6)
+    print(f"  → Node-slots at their import limit: {limited.sum():,}")
+    return results
+
+
+# ── Shared steps ──────────────────────────────────────────────────────────────
+@dataclass
+class Fleet:
+    V:            int           # vehicles
+    cohorts:      "Cohorts"
+    E_total:      float         # [kWh] consumed by the whole fleet
+    parked_total: int           # parked vehicle-slots
+    lp:           Optional[LinearProgram] = None    # LP matrices, built on first use
+
+
+def load_fleet(aggregate=True, tolerance=0.0, discharge_path=None) -> Fleet:
+    """Discharge tensor of Step 4a, merged into cohorts (see build_cohorts)."""
+    lap       = metrics.laps("optimize")
+    discharge = load_discharge_tensor(discharge_path or DISCHARGE_PATH)     # memory-mapped, row v = discharge.vehicle_ids[v]
+    V         = len(discharge)
 
+    # Parked[v, t] and E_consumed[v, t] in kWh
+    Parked = discharge.parked_matrix().astype(int)
+    E_cons = discharge.energy_matrix()              # [kWh] consumed in each 15-min slot, already from discharge_profile
+    lap("load", rows=V)
 
-        print(f"\n  → Optimal cost: {m.ObjVal:.2f} €")
-        print(f"  → Total import: {results['P_imp_kW'].sum() * DT:.1f} kWh")
-        print(f"  → Total export: {results['P_exp_kW'].sum() * DT:.1f} kWh")
-        print(f"  → Total PV:     {results['PPV_kW'].sum() * DT:.1f} kWh")
+    # ── Cohort aggregation ────────────────────────────────────────────────────
+    if aggregate:
+        cohorts = build_cohorts(Parked, E_cons, tolerance)
+    else:
+        cohorts = Cohorts(members=np.arange(V), weights=np.ones(V), Parked=Parked, E_cons=E_cons)
+    C = len(cohorts.weights)
+    print(f"  → {V:,} vehicles in {C:,} cohorts (LP {V / C:.1f}× smaller)")
+    lap("cohorts", rows=V)
 
-        return results
+    return Fleet(V=V, cohorts=cohorts, E_total=float(E_cons.sum()), parked_total=int(Parked.sum()))
+
+
+def day_inputs(profiles):
+    """PV power [kW] and buy price [€/kWh] per slot of a Step 4b profile."""
+    # Solar and price profiles
+    SolRad = profiles["SolRad_Wm2"].to_numpy()       # [W/m²]
+    C_buy  = profiles["Price_EURkWh"].to_numpy()     # [€/kWh]
 
+    # PV power output [kW] — already a power, no DT needed here
+    PPV = CAP_PV * SolRad / 1000.0                   # [kW]
+    return PPV, C_buy
+
+
+def solve_day(fleet, PPV, C_buy, solver="auto", method="lp", jobs=1, verbose=True) -> LPSolution:
+    cohorts = fleet.cohorts
+    if method == "admm":
+        from decomposition import solve_admm        # imports from this module
+        with metrics.phase("optimize.solve_admm", rows=len(cohorts.weights)):
+            return solve_admm(cohorts.Parked, cohorts.E_cons, PPV, C_buy,
+                              weights=cohorts.weights, jobs=jobs, solver=solver, verbose=verbose).as_lp_solution()
+    if method != "lp":
+        raise ValueError(f"Unknown optimization method {method!r} (choose 'lp' or 'admm')")
+
+    if fleet.lp is None:
+        with metrics.phase("optimize.build") as p:
+            fleet.lp = build_fleet_lp(cohorts.Parked, cohorts.E_cons, PPV, C_buy, weights=cohorts.weights)
+            p.rows   = fleet.lp.n_rows
+    with metrics.phase("optimize.solve", rows=fleet.lp.n_rows):
+        return solve_lp(with_day_inputs(fleet.lp, PPV, C_buy), solver=solver, time_limit=TIME_LIMIT,
+                        verbose=verbose)
+
+
+def save_results(fleet, solution, PPV, C_buy, output_dir) -> pd.DataFrame:
+    """Write optimization_results.parquet and soc_results.parquet of a solved day."""
+    lap = metrics.laps("optimize")
+    os.makedirs(output_dir, exist_ok=True)
+    cohorts = fleet.cohorts
+    slots = np.arange(N_SLOTS)
+    Pc_X, SOC_X, P_imp_X, P_exp_X = split_solution(solution.x, len(cohorts.weights))
+
+    results = pd.DataFrame({
+        "slot":        slots,
+        "t_start":     slots * SLOT_DURATION,
+        "P_imp_kW":    P_imp_X,
+        "P_exp_kW":    P_exp_X,
+        "PPV_kW":      PPV,
+        "total_Pc_kW": cohorts.weights @ Pc_X,     # each cohort schedule counts once per member
+        "C_buy":       C_buy,
+    })
+
+    soc_results = pd.DataFrame({
+        f"v{v}": SOC_X[cohorts.members[v]]   # every vehicle follows its cohort's schedule
+        for v in range(min(fleet.V, 20))  # save first 20 vehicles to keep file small
+    })
+
+    results.to_parquet(os.path.join(output_dir, "optimization_results.parquet"), index=False)
+    soc_results.to_parquet(os.path.join(output_dir, "soc_results.parquet"), index=False)
+    lap("extract", rows=N_SLOTS)
+    return results
+
+
+# ── Batch workers ─────────────────────────────────────────────────────────────
+_worker_fleet = None
+
+
+def _init_worker(discharge_path, aggregate, tolerance):
+    # Runs once per worker process: the fleet is loaded and aggregated once
+    # and reused for every day the worker solves
+    global _worker_fleet
+    _worker_fleet = load_fleet(aggregate, tolerance, discharge_path)
+
+
+def _solve_day_task(day, PPV, C_buy, solver, method, output_dir):
+    # Solver logs of parallel days would interleave: only the summary is printed
+    solution = solve_day(_worker_fleet, PPV, C_buy, solver=solver, method=method, verbose=False)
+    if solution.has_solution:
+        save_results(_worker_fleet, solution, PPV, C_buy, output_dir)
+    return {"day": day, "cost_EUR": solution.objective, "status": solution.status,
+            "solver": solution.solver, "seconds": solution.seconds}
+
+
+# ── Cohort aggregation ────────────────────────────────────────────────────────
+@dataclass
+class Cohorts:
+    members: np.ndarray     # (V,)  cohort of each vehicle
+    weights: np.ndarray     # (C,)  number of vehicles in each cohort
+    Parked:  np.ndarray     # (C, N_SLOTS) parked pattern of each cohort
+    E_cons:  np.ndarray     # (C, N_SLOTS) consumption of each cohort [kWh]
+    node_slot: Optional[np.ndarray] = None   # (C, N_SLOTS) node of each cohort per slot (multi-node LP)
+
+
+def build_cohorts(Parked, E_cons, tolerance=0.0, node_slot=None) -> Cohorts:
+    """
+    Group vehicles by their (Parked[v], E_cons[v]) signature — and by the
+    node they are parked at in each slot, node_slot[v], for the multi-node LP.
+
+    Vehicles of one signature have the same constraints and only enter the
+    objective through the sum of their charging power, so one representative
+    with weight = cohort size has the same optimum as the whole cohort, and
+    each member can follow the representative's schedule (members[v]).
+
+    tolerance > 0 puts consumption values in bins of that width [kWh] before
+    grouping; the cohort then uses the mean profile of its members, which
+    keeps the total fleet consumption.
+    """
+    Parked = np.asarray(Parked)
+    E_cons = np.asarray(E_cons, dtype=np.float64)
+
+    energy_key = E_cons if tolerance <= 0 else np.floor(E_cons / tolerance + 0.5)
+    signature  = np.hstack([Parked.astype(np.float64), energy_key]
+                           + ([] if node_slot is None else [node_slot.astype(np.float64)]))
+    _, first, members, counts = np.unique(
+        signature, axis=0, return_index=True, return_inverse=True, return_counts=True)
+    members = members.ravel()
+
+    if tolerance <= 0:
+        cohort_E = E_cons[first]
     else:
-        print(f"  ✗ Solver status: {m.Status}")
-        return None
+        cohort_E = np.zeros((len(counts), N_SLOTS))
+        np.add.at(cohort_E, members, E_cons)
+        cohort_E /= counts[:, None]
+
+    return Cohorts(members=members, weights=counts.astype(np.float64),
+                   Parked=Parked[first], E_cons=cohort_E,
+                   node_slot=None if node_slot is None else node_slot[first])
+
+
+# ── LP assembly ───────────────────────────────────────────────────────────────
+# Variable vector x = [ Pc | SOC | P_imp | P_exp ]
+#   Pc[v, t]    charging power [kW]        at  v * N_SLOTS + t
+#   SOC[v, t]   state of charge [kWh]      at  n_pc + v * (N_SLOTS + 1) + t   (state at START of slot t)
+#   P_imp[t]    grid import [kW]           at  n_pc + n_soc + t
+#   P_exp[t]    grid export [kW]           at  n_pc + n_soc + N_SLOTS + t
+def build_fleet_lp(Parked, E_cons, PPV, C_buy, weights=None) -> LinearProgram:
+    """
+    Fleet charging LP as sparse matrices, ready for any lp_solvers backend.
+    weights[v] (default 1) is the number of identical vehicles row v stands
+    for: its Pc counts weights[v] times in the power balance.
+    """
+    V     = len(Parked)
+    n_pc  = V * N_SLOTS
+    n_soc = V * (N_SLOTS + 1)
+
+    # ── Bounds ────────────────────────────────────────────────────────────────
+    # 1. Charging only when parked — expressed as the upper bound of Pc:
+    #    Pc[v, t] <= P_MAX * Parked[v, t]
+    lb = np.concatenate([
+        np.zeros(n_pc),
+        np.full(n_soc, CAP_EV * SOC_MIN),
+        np.zeros(2 * N_SLOTS),
+    ])
+    ub = np.concatenate([
+        P_MAX * np.asarray(Parked, dtype=np.float64).ravel(),
+        np.full(n_soc, CAP_EV * SOC_MAX),
+        np.full(2 * N_SLOTS, np.inf),
+    ])
+
+    # ── Constraints ───────────────────────────────────────────────────────────
+    A_soc, A_pc, A_cyc, A_bal = _constraint_matrices(V, weights)
+    I = sp.identity(N_SLOTS, format="csr")
+
+    A_eq = sp.bmat([
+        # 2. SOC dynamics — all terms in [kWh]
+        #    SOC[v, t+1] = SOC[v, t] * (1 - SD_EV_PER_SLOT)
+        #                + Pc[v, t] * ETA_SQRT * DT    ← [kW] * [h] = [kWh]
+        #                - E_cons[v, t]                ← already [kWh]
+        [A_pc,   A_soc, None, None],
+        # 3. Cyclic condition — SOC at end of day = SOC at start
+        [None,   A_cyc, None, None],
+        # 4. Power balance per slot [kW] — DT cancels on both sides
+        #    PPV[t] + P_imp[t] - P_exp[t] = sum_v weights[v] * Pc[v, t]
+        [-A_bal, None,  I,    -I],
+    ], format="csr")
+    b_eq = np.concatenate([-np.asarray(E_cons, dtype=np.float64).ravel(), np.zeros(V), -PPV])
+
+    # 5. Maximum exported electricity
+
+
+    # ── Objective — cost in [€] ───────────────────────────────────────────────
+    # [kW] * [€/kWh] * [h] = [€]
+    c = np.concatenate([np.zeros(n_pc + n_soc), C_buy * DT, np.full(N_SLOTS, -C_SELL * DT)])
+
+    return LinearProgram(c=c, A_eq=A_eq, b_eq=b_eq, lb=lb, ub=ub)
+
+
+def with_day_inputs(lp, PPV, C_buy) -> LinearProgram:
+    """
+    lp (from build_fleet_lp) with the PV power and buy prices of another
+    day. Only the objective and the balance right-hand side change; the
+    constraint matrix and bounds are shared, not copied.
+    """
+    c    = lp.c.copy()
+    b_eq = lp.b_eq.copy()
+    c[-2 * N_SLOTS:-N_SLOTS] = C_buy * DT          # P_imp cost
+    b_eq[-N_SLOTS:]          = -PPV                # balance rows come last
+    return replace(lp, c=c, b_eq=b_eq)
+
+
+def split_solution(x, V, n_grid=N_SLOTS):
+    """
+    Pc (V, N_SLOTS), SOC (V, N_SLOTS + 1), P_imp (n_grid,), P_exp (n_grid,) views of x.
+    n_grid is N_SLOTS for build_fleet_lp, the number of node-slot pairs for build_node_lp.
+    """
+    n_pc  = V * N_SLOTS
+    n_soc = V * (N_SLOTS + 1)
+    return (
+        x[:n_pc].reshape(V, N_SLOTS),
+        x[n_pc:n_pc + n_soc].reshape(V, N_SLOTS + 1),
+        x[n_pc + n_soc:n_pc + n_soc + n_grid],
+        x[n_pc + n_soc + n_grid:],
+    )
+
+
+# ── Multi-node LP ─────────────────────────────────────────────────────────────
+def node_slot_matrix(assignments, vehicle_ids, node_ids) -> np.ndarray:
+    """
+    (V, N_SLOTS) int32: row in node_ids of the node where vehicle row v
+    (vehicle_ids[v]) is parked in slot t, -1 where it is at no node.
+    The membership sets are V_n(t) = {v : node_slot[v, t] == n}.
+
+    Built by interval expansion of the parking episodes (build_nodes.py,
+    [slot_start, slot_end)): every episode is repeated once per slot it
+    covers, so the work is proportional to the parked vehicle-slots and no
+    node × vehicle × slot array is ever formed.
+    """
+    v  = pd.Index(vehicle_ids).get_indexer(assignments["vehicle_id"])
+    n  = pd.Index(node_ids).get_indexer(assignments["node_id"])
+    s0 = assignments["slot_start"].to_numpy(dtype=np.int64)
+    s1 = assignments["slot_end"].to_numpy(dtype=np.int64)
+
+    keep = (v >= 0) & (n >= 0) & (s1 > s0)            # unknown vehicles / nodes, empty episodes
+    v, n, s0, s1 = v[keep], n[keep], s0[keep], s1[keep]
+
+    lengths = s1 - s0
+    episode = np.repeat(np.arange(len(lengths)), lengths)
+    offset  = np.arange(len(episode)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    node_slot = np.full((len(vehicle_ids), N_SLOTS), -1, dtype=np.int32)
+    node_slot[v[episode], s0[episode] + offset] = n[episode]
+    return node_slot
+
+
+# Variable vector x = [ Pc | SOC | P_imp | P_exp ] as in build_fleet_lp, but
+# with one P_imp / P_exp per active (node, slot) pair instead of per slot
+def build_node_lp(Parked, E_cons, node_slot, PPV_nodes, C_buy, import_limit, weights=None):
+    """
+    Multi-node fleet LP. Each node n has its own balance per slot
+
+        PPV_nodes[n, t] + P_imp[n, t] - P_exp[n, t] = sum_{v in V_n(t)} weights[v] * Pc[v, t]
+        P_imp[n, t] <= import_limit[n]
+
+    Only active node-slot pairs — some vehicle may charge there — get
+    variables and rows; elsewhere all local PV is simply exported.
+    Parked must be 0 wherever node_slot is -1.
+
+    Returns the LinearProgram and pair_node, pair_slot (K,): node row and
+    slot of each P_imp / P_exp variable.
+    """
+    V     = len(Parked)
+    n_pc  = V * N_SLOTS
+    n_soc = V * (N_SLOTS + 1)
+    w     = np.ones(V) if weights is None else np.asarray(weights, dtype=np.float64)
+
+    # ── Membership: one entry per chargeable (vehicle, slot) ──────────────────
+    v, t  = np.nonzero(node_slot >= 0)
+    pairs, pair = np.unique(node_slot[v, t].astype(np.int64) * N_SLOTS + t, return_inverse=True)
+    pair_node, pair_slot = np.divmod(pairs, N_SLOTS)
+    K     = len(pairs)
+    A_node = sp.csr_matrix((w[v], (pair, v * N_SLOTS + t)), shape=(K, n_pc))
+
+    # ── Bounds ────────────────────────────────────────────────────────────────
+    lb = np.concatenate([
+        np.zeros(n_pc),
+        np.full(n_soc, CAP_EV * SOC_MIN),
+        np.zeros(2 * K),
+    ])
+    ub = np.concatenate([
+        P_MAX * np.asarray(Parked, dtype=np.float64).ravel(),
+        np.full(n_soc, CAP_EV * SOC_MAX),
+        np.asarray(import_limit, dtype=np.float64)[pair_node],     # per-node grid capacity
+        np.full(K, np.inf),
+    ])
+
+    # ── Constraints — SOC dynamics and cyclic rows as in build_fleet_lp ───────
+    A_soc, A_pc, A_cyc, _ = _constraint_matrices(V)
+    I = sp.identity(K, format="csr")
+    A_eq = sp.bmat([
+        [A_pc,    A_soc, None, None],
+        [None,    A_cyc, None, None],
+        [-A_node, None,  I,    -I],
+    ], format="csr")
+    b_eq = np.concatenate([-np.asarray(E_cons, dtype=np.float64).ravel(), np.zeros(V),
+                           -PPV_nodes[pair_node, pair_slot]])
+
+    # ── Objective — cost in [€] ───────────────────────────────────────────────
+    c = np.concatenate([np.zeros(n_pc + n_soc), C_buy[pair_slot] * DT, np.full(K, -C_SELL * DT)])
+
+    return LinearProgram(c=c, A_eq=A_eq, b_eq=b_eq, lb=lb, ub=ub), pair_node, pair_slot
+
+
+# ── Sparse coefficient matrices ───────────────────────────────────────────────
+def _constraint_matrices(V, weights=None):
+    """
+    Coefficients of the SOC dynamics, cyclic and balance constraints on the
+    Pc / SOC parts of x (see build_fleet_lp), as scipy.sparse CSR.
+
+    Returns A_soc (V*N_SLOTS × V*(N_SLOTS+1)), A_pc (V*N_SLOTS × V*N_SLOTS),
+            A_cyc (V × V*(N_SLOTS+1)), A_bal (N_SLOTS × V*N_SLOTS)
+    """
+    n_pc   = V * N_SLOTS
+    n_soc  = V * (N_SLOTS + 1)
+    rows   = np.arange(n_pc)                              # one row per (v, t): rows = v * N_SLOTS + t
+    v, t   = np.divmod(rows, N_SLOTS)
+    soc_t  = v * (N_SLOTS + 1) + t                        # column of SOC[v, t]
+
+    # SOC[v, t+1] - (1 - SD_EV_PER_SLOT) * SOC[v, t] - ETA_SQRT * DT * Pc[v, t] = -E_cons[v, t]
+    A_soc = sp.csr_matrix(
+        (np.concatenate([np.ones(n_pc), np.full(n_pc, -(1 - SD_EV_PER_SLOT))]),
+         (np.concatenate([rows, rows]), np.concatenate([soc_t + 1, soc_t]))),
+        shape=(n_pc, n_soc))
+    A_pc  = sp.csr_matrix((np.full(n_pc, -ETA_SQRT * DT), (rows, rows)), shape=(n_pc, n_pc))
+
+    # SOC[v, N_SLOTS] - SOC[v, 0] = 0
+    first = np.arange(V) * (N_SLOTS + 1)
+    A_cyc = sp.csr_matrix(
+        (np.concatenate([np.ones(V), -np.ones(V)]),
+         (np.concatenate([np.arange(V), np.arange(V)]), np.concatenate([first + N_SLOTS, first]))),
+        shape=(V, n_soc))
+
+    # sum_v weights[v] * Pc[v, t]
+    coef  = np.ones(n_pc) if weights is None else np.repeat(np.asarray(weights, dtype=np.float64), N_SLOTS)
+    A_bal = sp.csr_matrix((coef, (t, rows)), shape=(N_SLOTS, n_pc))
+
+    return A_soc, A_pc, A_cyc, A_bal
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+parameter_sweep.py
+------------------
+Planning studies over the module constants of optimize.py.
+
+    scenarios = scenario_grid(CAP_PV=[600, 1200, 2400], P_MAX=[7.4, 11, 22])
+    results   = run_sweep(scenarios, jobs=8)
+
+Every scenario is the same fleet LP with different numbers: the variables,
+the constraint pattern and the cohorts do not depend on the parameters. So
+each worker process loads the fleet and builds the LP once
+(optimize.build_fleet_lp), and a scenario only rewrites the entries that
+depend on its parameters:
+
+    CAP_PV                    — right-hand side of the power balance rows
+    P_MAX                     — upper bounds of Pc
+    CAP_EV, SOC_MIN, SOC_MAX  — bounds of SOC
+    ETA_C                     — Pc coefficients of the SOC dynamics rows
+    C_SELL                    — objective coefficients of P_exp
+
+Parameters a scenario does not set (or sets to NaN) keep their value from
+optimize.py. Scenarios run concurrently on a process pool; the results
+come back as one tidy table (one row per scenario: its parameters, solver
+status, cost and energy totals), saved as output/sweep_results.parquet.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import optimize
+from optimize import N_SLOTS, DT, build_fleet_lp, load_fleet, split_solution
+from lp_solvers import LinearProgram, solve_lp
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+SWEEP_PARAMETERS = ["CAP_PV", "P_MAX", "C_SELL", "ETA_C", "SOC_MIN", "SOC_MAX", "CAP_EV"]
+RESULTS_FILE     = "sweep_results.parquet"
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+def scenario_grid(**values) -> pd.DataFrame:
+    """
+    Every combination of the given parameter values, one scenario per row:
+    scenario_grid(P_MAX=[7.4, 11, 22], C_SELL=[0.0, 0.008]) has 6 rows.
+    """
+    _check_parameters(values)
+    grid = pd.MultiIndex.from_product([list(v) for v in values.values()], names=list(values))
+    return grid.to_frame(index=False)
+
+
+def run_sweep(scenarios, profiles=None, solver="auto", aggregate=True, tolerance=0.0,
+              jobs=0) -> pd.DataFrame:
+    """
+    Solve the fleet LP for every scenario (rows of a DataFrame, or dicts,
+    with SWEEP_PARAMETERS columns) in `jobs` worker processes (0 = one per
+    CPU core).
+
+    profiles is a Step 4b profile (default: optimize.PROFILES_PATH); the
+    fleet is the Step 4a discharge tensor, aggregated into cohorts as in
+    optimize.run_optimization.
+    """
+    start     = time.perf_counter()
+    scenarios = pd.DataFrame(scenarios).reset_index(drop=True)
+    _check_parameters(scenarios.columns)
+    # Unset parameters (missing or NaN) take the optimize.py value, so the
+    # table shows the numbers every scenario was actually solved with
+    scenarios = scenarios.fillna({name: getattr(optimize, name) for name in scenarios.columns})
+    if profiles is None:
+        profiles = pd.read_parquet(optimize.PROFILES_PATH)
+
+    # PV per kW of installed capacity: CAP_PV only scales it
+    pv_per_kW = profiles["SolRad_Wm2"].to_numpy() / 1000.0
+    C_buy     = profiles["Price_EURkWh"].to_numpy()
+
+    tasks    = scenarios.to_dict("records")
+    jobs     = min(jobs or os.cpu_count() or 1, max(len(tasks), 1))
+    initargs = (optimize.DISCHARGE_PATH, aggregate, tolerance, pv_per_kW, C_buy, solver)
+
+    if jobs == 1:
+        _init_worker(*initargs)
+        rows = [_solve_scenario(params) for params in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=initargs) as pool:
+            rows = list(pool.map(_solve_scenario, tasks))
+
+    results = pd.concat([scenarios, pd.DataFrame(rows, index=scenarios.index)], axis=1)
+    os.makedirs(optimize.OUTPUT_DIR, exist_ok=True)
+    results.to_parquet(os.path.join(optimize.OUTPUT_DIR, RESULTS_FILE), index=False)
+
+    solved = results["cost_EUR"].notna().sum() if len(results) else 0
+    print(f"  → {len(results)} scenarios, {solved} solved, "
+          f"{time.perf_counter() - start:.1f} s with {jobs} worker(s)")
+    return results
+
+
+# ── Scenario model ────────────────────────────────────────────────────────────
+@dataclass
+class SweepModel:
+    fleet:       optimize.Fleet
+    lp:          LinearProgram     # fleet LP with the optimize.py constants
+    parked:      np.ndarray        # (C * N_SLOTS,) 1.0 where Pc may be non-zero
+    eta_entries: np.ndarray        # positions of the Pc coefficients of the dynamics rows in lp.A_eq.data
+    pv_per_kW:   np.ndarray        # (N_SLOTS,) PV output per kW installed
+    C_buy:       np.ndarray        # (N_SLOTS,) [€/kWh]
+    solver:      str
+
+
+def build_sweep_model(fleet, pv_per_kW, C_buy, solver="auto") -> SweepModel:
+    cohorts = fleet.cohorts
+    lp      = build_fleet_lp(cohorts.Parked, cohorts.E_cons, optimize.CAP_PV * pv_per_kW, C_buy,
+                             weights=cohorts.weights)
+    n_pc    = len(cohorts.weights) * N_SLOTS
+
+    # Dynamics rows come first in A_eq and Pc columns first in x, so the
+    # ETA coefficients are the entries in both the first n_pc rows and columns
+    A    = lp.A_eq
+    rows = np.repeat(np.arange(A.shape[0]), np.diff(A.indptr))
+    eta_entries = np.flatnonzero((rows < n_pc) & (A.indices < n_pc))
+
+    return SweepModel(fleet=fleet, lp=lp,
+                      parked=np.asarray(cohorts.Parked, dtype=np.float64).ravel(),
+                      eta_entries=eta_entries, pv_per_kW=pv_per_kW, C_buy=C_buy, solver=solver)
+
+
+def scenario_lp(model: SweepModel, params: dict) -> LinearProgram:
+    """
+    model.lp with the numbers of one scenario; unset parameters take the
+    optimize.py value. The sparsity pattern of A_eq is shared, not copied.
+    """
+    p     = {name: getattr(optimize, name) for name in SWEEP_PARAMETERS}
+    p.update({name: value for name, value in params.items() if pd.notna(value)})
+    lp    = model.lp
+    n_pc  = len(model.parked)
+    n_soc = n_pc + n_pc // N_SLOTS               # one more SOC than Pc per cohort
+
+    lb, ub = lp.lb.copy(), lp.ub.copy()
+    ub[:n_pc]              = p["P_MAX"] * model.parked
+    lb[n_pc:n_pc + n_soc]  = p["CAP_EV"] * p["SOC_MIN"]
+    ub[n_pc:n_pc + n_soc]  = p["CAP_EV"] * p["SOC_MAX"]
+
+    c = lp.c.copy()
+    c[-N_SLOTS:] = -p["C_SELL"] * DT                # P_exp comes last
+
+    b_eq = lp.b_eq.copy()
+    b_eq[-N_SLOTS:] = -p["CAP_PV"] * model.pv_per_kW   # balance rows come last
+
+    data = lp.A_eq.data.copy()
+    data[model.eta_entries] = -(p["ETA_C"] ** 0.5) * DT     # ETA_SQRT
+    A_eq = sp.csr_matrix((data, lp.A_eq.indices, lp.A_eq.indptr), shape=lp.A_eq.shape)
+
+    return replace(lp, c=c, A_eq=A_eq, b_eq=b_eq, lb=lb, ub=ub)
+
+
+# ── Workers ───────────────────────────────────────────────────────────────────
+_worker_model = None
+
+
+def _init_worker(discharge_path, aggregate, tolerance, pv_per_kW, C_buy, solver):
+    # Runs once per worker process: fleet and LP structure are reused for
+    # every scenario the worker solves
+    global _worker_model
+    fleet = load_fleet(aggregate, tolerance, discharge_path)
+    _worker_model = build_sweep_model(fleet, pv_per_kW, C_buy, solver)
+
+
+def _solve_scenario(params):
+    model    = _worker_model
+    solution = solve_lp(scenario_lp(model, params), solver=model.solver,
+                        time_limit=optimize.TIME_LIMIT, verbose=False)
+    row = {"status": solution.status, "solver": solution.solver, "seconds": solution.seconds,
+           "cost_EUR": np.nan, "import_kWh": np.nan, "export_kWh": np.nan, "charged_kWh": np.nan}
+    if solution.has_solution:
+        Pc, _, P_imp, P_exp = split_solution(solution.x, len(model.fleet.cohorts.weights))
+        row.update(cost_EUR=solution.objective,
+                   import_kWh=float(P_imp.sum() * DT),
+                   export_kWh=float(P_exp.sum() * DT),
+                   charged_kWh=float(model.fleet.cohorts.weights @ Pc.sum(axis=1) * DT))
+    return row
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+def _check_parameters(names):
+    unknown = sorted(set(names) - set(SWEEP_PARAMETERS))
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters {unknown} (choose from {SWEEP_PARAMETERS})")
@@ -16,10 +16,11 @@ OUTPUT_DIR    = "output"
 DT            = 900 / 3600
 N_SLOTS       = 96
 
-def plot_results():
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+def plot_results(results_path=RESULTS_PATH, output_dir=OUTPUT_DIR, show=True):
+    # show=False saves the figure without opening a window (one per typical day)
+    os.makedirs(output_dir, exist_ok=True)
 
-    res   = pd.read_parquet(RESULTS_PATH)
+    res   = pd.read_parquet(results_path)
     hours = np.arange(N_SLOTS) * 0.25
 
     fig, ax = plt.subplots(figsize=(14, 6))
@@ -51,8 +52,10 @@ def plot_results():
     ax.grid(True, alpha=0.4)
 
     plt.tight_layout()
-    plt.savefig(os.path.join(OUTPUT_DIR, "results_charging_pv.png"), dpi=150)
-    plt.show()
+    plt.savefig(os.path.join(output_dir, "results_charging_pv.png"), dpi=150)
+    if show:
+        plt.show()
+    plt.close(fig)
     print("  → Saved results_charging_pv.png")
 
 
@@ -13,10 +13,35 @@ import pandas as pd
 SLOT_DURATION     = 900
 N_SLOTS           = 96
 
-def build_profiles(typical_days_path):
-    ts       = pd.read_excel(typical_days_path, sheet_name="TimeSeries", index_col=[0, 1])
-    SolRad_h = ts["SolarRad_glob[W/m2]"].to_numpy()
-    Price_h  = ts["ElectricityPrice[€/MWh]"].to_numpy()
+def build_profiles(typical_days_path, day=None):
+    """
+    96-slot solar / price profile of one typical day of the TimeSeries sheet
+    (default: the first one).
+    """
+    ts = read_time_series(typical_days_path)
+    if day is None:
+        day = ts.index.get_level_values(0)[0]
+    return _day_profile(ts.loc[day])
+
+
+def build_day_profiles(typical_days_path) -> dict:
+    """
+    Profiles of every typical day (season / weekday) of the TimeSeries sheet,
+    {day: profiles DataFrame} in sheet order. The sheet is indexed by
+    (day, hour), 24 hourly rows per day.
+    """
+    ts = read_time_series(typical_days_path)
+    return {day: _day_profile(ts.loc[day]) for day in ts.index.get_level_values(0).unique()}
+
+
+def read_time_series(typical_days_path) -> pd.DataFrame:
+    return pd.read_excel(typical_days_path, sheet_name="TimeSeries", index_col=[0, 1])
+
+
+def _day_profile(day_ts):
+    # Slot averages of the hourly values: mean of 4 interpolated sub-samples per slot
+    SolRad_h = day_ts["SolarRad_glob[W/m2]"].to_numpy()
+    Price_h  = day_ts["ElectricityPrice[€/MWh]"].to_numpy()
     hours_24 = np.arange(24, dtype=float)
 
     SolRad_avg = np.zeros(N_SLOTS)
@@ -2,95 +2,386 @@
 """
 Created on Fri Feb 20 11:00:42 2026
 @author: Admin
+
+    python run_pipeline.py                          # every stage, unchanged ones skipped
+    python run_pipeline.py --from profiles          # Steps 4b–6 only
+    python run_pipeline.py --stages events,plans --jobs 4 --force
+    python run_pipeline.py --metrics                # + output/metrics/<run>.json (metrics.py)
+
+Stages: network, events, distances, plans, timetable, discharge, profiles,
+nodes (multi_node only), optimize, plots. With jobs > 1, independent stages
+(the network, the events, the plans and the typical days) run concurrently
+and share the jobs between them; a stage that runs alone gets all of them.
 """
 
+import argparse
 import os
+import shutil
+import sys
+import time
 import yaml
 import pandas as pd
-from network_parser import parse_network, build_length_lookup, links_to_dataframe
-from events_parser import parse_events
-from timetable_builder import build_timetable
-from discharge_profile import build_discharge_profile
-from prepare_profiles import build_profiles
-from optimize import run_optimization
-from plot_results import plot_results
+import metrics
+from stage_cache import Stage, StageFailed, run_stages, stage_order
+
+# The step modules are imported inside the stages that use them, so an
+# invocation only pays for what it runs (matplotlib, scipy, gurobipy, ...)
 
 
 # ── Load config ───────────────────────────────────────────────────────────────
-with open(os.path.join(os.path.dirname(__file__), "config.yaml")) as f:
+# config.yaml next to this file, or the file named by PIPELINE_CONFIG
+# (e.g. one per benchmark scenario, see benchmark.py)
+CONFIG_PATH = os.environ.get("PIPELINE_CONFIG") or os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(CONFIG_PATH) as f:
     cfg = yaml.safe_load(f)
 
 SIM_OUTPUT        = cfg["eqasim_output"]
 OUTPUT_DIR        = cfg["pipeline_output"]
 TYPICAL_DAYS_PATH = cfg["typical_days"]
+JOBS              = cfg.get("jobs", 0)       # worker processes for concurrent stages and parallel steps (0 = one per CPU core)
+SOLVER            = cfg.get("solver", "auto")  # LP solver for Step 5 (see lp_solvers.py)
+COHORT_TOLERANCE  = cfg.get("cohort_tolerance", 0.0)   # [kWh] 0 = merge only identical vehicles in Step 5
+METHOD            = cfg.get("method", "lp")  # Step 5: "lp" (one LP) or "admm" (decomposition.py)
+DAY_WEIGHTS       = cfg.get("day_weights")   # {typical day: days per year}, default: 365 days split evenly
+MULTI_NODE        = cfg.get("multi_node", False)   # Step 5 with one power balance per parking node
+NODE_CELL_SIZE    = cfg.get("node_cell_size")   # [m] Step 4c: one node per grid cell of parking links
+NODE_BLOCKS       = cfg.get("node_blocks")      # Step 4c: k-means blocks of parking links instead of a grid
+METRICS           = cfg.get("metrics", False)   # write per-stage / per-phase timings and memory to output/metrics/
 
 NETWORK_PATH  = os.path.join(SIM_OUTPUT, "output_network.xml.gz")
 EVENTS_PATH   = os.path.join(SIM_OUTPUT, "output_events.xml.gz")
 PLANS_PATH    = os.path.join(SIM_OUTPUT, "output_plans.xml.gz")
 VEHICLES_PATH = os.path.join(SIM_OUTPUT, "output_allVehicles.xml")
+PLAN_MODES    = {"car"}      # plans kept for Step 3: persons with a car leg (every possible driver)
+EVENTS_DIR    = os.path.join(OUTPUT_DIR, "events_deferred")   # Step 2 trips / activities, before Step 2b
 
 
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-print("Saving outputs to:", OUTPUT_DIR)
-
 # ── Step 1: Network ───────────────────────────────────────────────────────
-print("[Step 1] Parsing network...")
-links, nodes = parse_network(NETWORK_PATH)
-link_length  = build_length_lookup(links)
-df_links     = links_to_dataframe(links)
-df_links.to_parquet(os.path.join(OUTPUT_DIR, "network_links.parquet"))
-print(f"  → {len(links):,} links loaded")
-
-# ── Step 2: Events ────────────────────────────────────────────────────────
-print("\n[Step 2] Parsing events...")
-trips, activities, person_to_vehicle = parse_events(EVENTS_PATH, link_length)
-pd.DataFrame(trips).to_parquet(os.path.join(OUTPUT_DIR, "trips_raw.parquet"))
-pd.DataFrame(activities).to_parquet(os.path.join(OUTPUT_DIR, "activities_raw.parquet"))
+def network_stage(values):
+    from network_cache import load_network
+    from network_parser import links_to_dataframe
+    network  = load_network(NETWORK_PATH, OUTPUT_DIR)   # columnar arrays, memory-mapped from OUTPUT_DIR/network_cache after the first run
+    df_links = links_to_dataframe(network)
+    df_links.to_parquet(os.path.join(OUTPUT_DIR, "network_links.parquet"))
+    print(f"  → {len(network.link_ids):,} links loaded")
+    return network
+
+
+def reload_network(values):
+    from network_cache import load_network
+    return load_network(NETWORK_PATH, OUTPUT_DIR)
+
+
+# ── Step 2: Events (independent of the network) ──────────────────────────
+def events_stage(values):
+    from events_parser import parse_events_to_parquet
+    from interning import new_ids, save_ids
+    os.makedirs(EVENTS_DIR, exist_ok=True)
+    ids = new_ids()                  # int32 link / person / vehicle ids, links moved onto the network rows in Step 2b
+    parse_events_to_parquet(         # trips/activities are streamed to parquet in record batches
+        EVENTS_PATH, None,           # no link lengths: the entered links of every trip are kept instead
+        trips_path      = os.path.join(EVENTS_DIR, "trips.parquet"),
+        activities_path = os.path.join(EVENTS_DIR, "activities.parquet"),
+        links_path      = os.path.join(EVENTS_DIR, "trip_links.parquet"),
+        jobs            = JOBS,
+        prefilter       = True,
+        ids             = ids,            # id columns written as int32, dictionaries saved below
+    )
+    save_ids(ids, EVENTS_DIR)
+    return ids
+
+
+def reload_events_ids(values):
+    from interning import load_ids
+    return load_ids(EVENTS_DIR)
+
+
+# ── Step 2b: Trip distances (network + events) ───────────────────────────
+def distances_stage(values):
+    from events_parser import resolve_link_ids
+    from interning import save_ids
+    ids = resolve_link_ids(
+        os.path.join(EVENTS_DIR, "trips.parquet"),
+        os.path.join(EVENTS_DIR, "activities.parquet"),
+        os.path.join(EVENTS_DIR, "trip_links.parquet"),
+        values["events"], values["network"],
+        trips_path      = os.path.join(OUTPUT_DIR, "trips_raw.parquet"),
+        activities_path = os.path.join(OUTPUT_DIR, "activities_raw.parquet"),
+    )
+    save_ids(ids, OUTPUT_DIR)        # link id == network row from here on
+    return ids
+
+
+def reload_ids(values):
+    from interning import load_ids
+    return load_ids(OUTPUT_DIR)
+
+
+# ── Step 3a: Plans (independent of the events) ────────────────────────────
+def plans_stage(values):
+    from timetable_builder import parse_plans
+    return parse_plans(PLANS_PATH, modes=PLAN_MODES,
+                       output_path=os.path.join(OUTPUT_DIR, "plans_activities.parquet"))
+
+
+def reload_plans(values):
+    return pd.read_parquet(os.path.join(OUTPUT_DIR, "plans_activities.parquet"))
+
 
 # ── Step 3: Build vehicle timetable ──────────────────────────────────────
-print("\n[Step 3] Building vehicle timetable...")
-trips_df  = pd.read_parquet(os.path.join(OUTPUT_DIR, "trips_raw.parquet"))
-timetable = build_timetable(
-    trips_df,
-    plans_path = PLANS_PATH,   # already defined at top of run_pipeline.py
-    nodes      = nodes,        # returned by parse_network() in Step 1
-    links      = links         # returned by parse_network() in Step 1
-)
-timetable.to_parquet(os.path.join(OUTPUT_DIR, "vehicle_timetable.parquet"))
-print(f"  → {len(timetable):,} episodes for {timetable['vehicle_id'].nunique():,} vehicles")
+def timetable_stage(values):
+    from timetable_builder import build_timetable
+    trips_df  = pd.read_parquet(os.path.join(OUTPUT_DIR, "trips_raw.parquet"))
+    timetable = build_timetable(
+        trips_df,
+        plans_df   = values["plans"],     # activities of the selected plans, Step 3a
+        network    = values["network"],   # returned by load_network() in Step 1
+        ids        = values["distances"]  # id dictionaries filled in Step 2, links rebased in Step 2b
+    )
+    timetable.to_parquet(os.path.join(OUTPUT_DIR, "vehicle_timetable.parquet"))
+    print(f"  → {len(timetable):,} episodes for {timetable['vehicle_id'].nunique():,} vehicles")
+    return timetable
+
+
+def reload_timetable(values):
+    return pd.read_parquet(os.path.join(OUTPUT_DIR, "vehicle_timetable.parquet"))
+
 
 # ── Step 4a: Discharge profile ─────────────────────────────────────────────
-print("\n[Step 4] Building discharge profile...")
-timetable_df = pd.read_parquet(os.path.join(OUTPUT_DIR, "vehicle_timetable.parquet"))
-discharge_df = build_discharge_profile(timetable_df)
-discharge_df.to_parquet(os.path.join(OUTPUT_DIR, "discharge_profile.parquet"))
-print(f"  → {discharge_df['vehicle_id'].nunique():,} vehicles | "
-      f"{discharge_df['energy_consumed_kWh'].sum():.1f} kWh total consumed")
+def discharge_stage(values):
+    from discharge_profile import build_discharge_arrays
+    from discharge_tensor import from_arrays, save_discharge_tensor
+    discharge = from_arrays(*build_discharge_arrays(values["timetable"]))   # (V, 96) parked mask + energy, see discharge_tensor.py
+    save_discharge_tensor(discharge, os.path.join(OUTPUT_DIR, "discharge_tensor"))
+    print(f"  → {len(discharge):,} vehicles | "
+          f"{discharge.total_energy():.1f} kWh total consumed")
+
 
 # ── Step 4b: Input profiles (solar + price) ───────────────────────────────
-print("\n[Step 4b] Building input profiles...")
-profiles_df = build_profiles(TYPICAL_DAYS_PATH)
-profiles_df.to_parquet(os.path.join(OUTPUT_DIR, "input_profiles.parquet"))
-print(f"  → {len(profiles_df)} slots | "
-      f"Peak solar: {profiles_df['SolRad_Wm2'].max():.1f} W/m² | "
-      f"Price range: {profiles_df['Price_EURkWh'].min()*1000:.1f}–"
-      f"{profiles_df['Price_EURkWh'].max()*1000:.1f} €/MWh")
-
-# ── Step 5: Gurobi optimization ───────────────────────────────────────────
-print("\n[Step 5] Running optimization...")
-opt_results = run_optimization()
-
-if opt_results is not None:
-    print("Results saved to output/optimization_results.parquet")
-    print("SOC profiles saved to output/soc_results.parquet")
-else:
-    print("  ✗ Optimization failed — check Gurobi log above")
-    
-    
+def profiles_stage(values):
+    from prepare_profiles import build_day_profiles
+    day_profiles = build_day_profiles(TYPICAL_DAYS_PATH)
+    profiles_df  = next(iter(day_profiles.values()))    # first typical day: the single-day Step 5 input
+    profiles_df.to_parquet(os.path.join(OUTPUT_DIR, "input_profiles.parquet"))
+    if len(day_profiles) > 1:
+        (pd.concat(day_profiles, names=["day"]).reset_index(level=0)
+           .to_parquet(os.path.join(OUTPUT_DIR, "input_profiles_days.parquet"), index=False))
+        print(f"  → {len(day_profiles)} typical days: {', '.join(map(str, day_profiles))}")
+    print(f"  → {len(profiles_df)} slots | "
+          f"Peak solar: {profiles_df['SolRad_Wm2'].max():.1f} W/m² | "
+          f"Price range: {profiles_df['Price_EURkWh'].min()*1000:.1f}–"
+          f"{profiles_df['Price_EURkWh'].max()*1000:.1f} €/MWh")
+    return day_profiles
+
+
+def reload_profiles(values):
+    from prepare_profiles import build_day_profiles
+    return build_day_profiles(TYPICAL_DAYS_PATH)
+
+
+# ── Step 4c: Electrical nodes (multi-node LP only) ──────────────────────────
+def nodes_stage(values):
+    from build_nodes import build_node_mapping
+    build_node_mapping(values["timetable"], None, None, OUTPUT_DIR, network=values["network"],
+                       cell_size=NODE_CELL_SIZE, n_blocks=NODE_BLOCKS)
+
+
+# ── Step 5: LP optimization ───────────────────────────────────────────────
+def optimize_stage(values):
+    from optimize import run_optimization, run_batch_optimization, run_node_optimization
+    day_profiles = values["profiles"]
+    if MULTI_NODE:
+        # One power balance and import limit per node, first typical day — see build_node_lp
+        opt_results = run_node_optimization(solver=SOLVER, tolerance=COHORT_TOLERANCE)
+        if opt_results is None:
+            raise StageFailed("Optimization failed — check solver log above")
+        print("Results saved to output/node_results.parquet and output/optimization_results.parquet")
+    elif len(day_profiles) > 1:
+        # One solve per typical day, days in parallel — see run_batch_optimization
+        day_costs = run_batch_optimization(day_profiles, DAY_WEIGHTS, solver=SOLVER,
+                                           tolerance=COHORT_TOLERANCE, method=METHOD, jobs=JOBS)
+        print("Results saved to output/days/<day>/ and output/typical_day_costs.parquet")
+        return day_costs
+    else:
+        opt_results = run_optimization(solver=SOLVER, tolerance=COHORT_TOLERANCE, method=METHOD, jobs=JOBS)
+        if opt_results is None:
+            raise StageFailed("Optimization failed — check solver log above")
+        print("Results saved to output/optimization_results.parquet")
+        print("SOC profiles saved to output/soc_results.parquet")
+
+
+def optimize_outputs(values):
+    from optimize import OUTPUT_DIR as out
+    if MULTI_NODE:
+        return [os.path.join(out, "node_results.parquet"), os.path.join(out, "optimization_results.parquet")]
+    if len(values["profiles"]) > 1:
+        return [os.path.join(out, "typical_day_costs.parquet"), os.path.join(out, "days")]
+    return [os.path.join(out, "optimization_results.parquet"), os.path.join(out, "soc_results.parquet")]
+
+
+def reload_day_costs(values):
+    from optimize import OUTPUT_DIR as out
+    if MULTI_NODE or len(values["profiles"]) == 1:
+        return None
+    return pd.read_parquet(os.path.join(out, "typical_day_costs.parquet"))
+
+
 # ── Step 6: Result visualization ─────────────────────────────────────────
-print("\n[Step 6] Plotting results...")
-plot_results()
+def plots_stage(values):
+    from optimize import OUTPUT_DIR as out      # where Step 5 wrote the day folders
+    from plot_results import plot_results
+    day_costs = values["optimize"]
+    if day_costs is not None:
+        for day in solved_days(day_costs):
+            day_dir = os.path.join(out, "days", str(day))
+            plot_results(os.path.join(day_dir, "optimization_results.parquet"), day_dir,
+                         show=False)
+    else:
+        plot_results()
+
+
+def plots_outputs(values):
+    from optimize import OUTPUT_DIR as out
+    from plot_results import OUTPUT_DIR as plot_dir
+    day_costs = values["optimize"]
+    if day_costs is not None:
+        return [os.path.join(out, "days", str(day), "results_charging_pv.png")
+                for day in solved_days(day_costs)]
+    return [os.path.join(plot_dir, "results_charging_pv.png")]
+
+
+def solved_days(day_costs):
+    return day_costs.loc[day_costs["cost_EUR"].notna(), "day"]
+
+
+# ── Stage graph ───────────────────────────────────────────────────────────
+# Each stage lists the files, config values and modules its outputs depend
+# on; stage_cache fingerprints them and skips the stages that are unchanged
+# since the last run (e.g. a new TypicalDays.xlsx only re-runs Steps 4b–6).
+# The processing settings that do not change any result (jobs) are left out.
+# The deps are the only ordering: network → events and plans and profiles
+# have no common input, so with jobs > 1 they run side by side.
+STAGES = [
+    Stage("network", "[Step 1] Parsing network...", network_stage,
+          outputs = [os.path.join(OUTPUT_DIR, "network_links.parquet")],
+          inputs  = [NETWORK_PATH],
+          code    = ["network_parser", "network_cache"],
+          load    = reload_network),
+    Stage("events", "[Step 2] Parsing events...", events_stage,
+          outputs = [EVENTS_DIR],
+          inputs  = [EVENTS_PATH],
+          params  = {"prefilter": True},
+          code    = ["events_parser", "interning"],
+          load    = reload_events_ids),
+    Stage("distances", "[Step 2b] Resolving trip distances...", distances_stage,
+          outputs = [os.path.join(OUTPUT_DIR, f) for f in
+                     ("trips_raw.parquet", "activities_raw.parquet",
+                      "ids_links.parquet", "ids_persons.parquet", "ids_vehicles.parquet")],
+          deps    = ["network", "events"],
+          code    = ["events_parser", "interning"],
+          load    = reload_ids),
+    Stage("plans", "[Step 3a] Parsing plans...", plans_stage,
+          outputs = [os.path.join(OUTPUT_DIR, "plans_activities.parquet")],
+          inputs  = [PLANS_PATH],
+          params  = {"modes": sorted(PLAN_MODES)},
+          code    = ["timetable_builder"],
+          load    = reload_plans),
+    Stage("timetable", "[Step 3] Building vehicle timetable...", timetable_stage,
+          outputs = [os.path.join(OUTPUT_DIR, "vehicle_timetable.parquet")],
+          deps    = ["network", "distances", "plans"],
+          code    = ["timetable_builder", "network_parser"],
+          load    = reload_timetable),
+    Stage("discharge", "[Step 4] Building discharge profile...", discharge_stage,
+          outputs = [os.path.join(OUTPUT_DIR, "discharge_tensor")],
+          deps    = ["timetable"],
+          code    = ["discharge_profile", "discharge_tensor"]),
+    Stage("profiles", "[Step 4b] Building input profiles...", profiles_stage,
+          outputs = [os.path.join(OUTPUT_DIR, "input_profiles.parquet")],
+          inputs  = [TYPICAL_DAYS_PATH],
+          code    = ["prepare_profiles"],
+          load    = reload_profiles),
+]
+if MULTI_NODE:
+    STAGES.append(
+        Stage("nodes", "[Step 4c] Assigning parking episodes to nodes...", nodes_stage,
+              outputs = [os.path.join(OUTPUT_DIR, f) for f in ("nodes.parquet", "parking_assignments.parquet")],
+              deps    = ["network", "timetable"],
+              params  = {"cell_size": NODE_CELL_SIZE, "n_blocks": NODE_BLOCKS},
+              code    = ["build_nodes"]))
+STAGES += [
+    Stage("optimize", "[Step 5] Running optimization...", optimize_stage,
+          outputs = optimize_outputs,
+          deps    = ["discharge", "profiles"] + (["nodes"] if MULTI_NODE else []),
+          params  = {"solver": SOLVER, "cohort_tolerance": COHORT_TOLERANCE, "method": METHOD,
+                     "day_weights": DAY_WEIGHTS, "multi_node": MULTI_NODE},
+          code    = ["optimize", "lp_solvers", "decomposition", "discharge_tensor"],
+          load    = reload_day_costs),
+    Stage("plots", "[Step 6] Plotting results...", plots_stage,
+          outputs = plots_outputs,
+          deps    = ["optimize"],
+          code    = ["plot_results"]),
+]
+
+
+# ── Command line ──────────────────────────────────────────────────────────
+def main(argv=None):
+    names  = stage_order(STAGES)
+    parser = argparse.ArgumentParser(
+        description="EV fleet charging pipeline. Stages whose inputs, settings and code "
+                    "are unchanged since the last run are skipped (stage_cache.py).")
+    parser.add_argument("--stages", help=f"comma-separated stages to run, of: {', '.join(names)} "
+                                         "(default: all; the others are used from their cached outputs)")
+    parser.add_argument("--from", dest="first", choices=names, help="first stage to run")
+    parser.add_argument("--to",   dest="last",  choices=names, help="last stage to run")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="worker processes for concurrent stages and parallel steps "
+                             "(0 = one per CPU core, 1 = sequential; default: jobs in config.yaml)")
+    parser.add_argument("--force", action="store_true", help="run the selected stages even if unchanged")
+    parser.add_argument("--metrics", action="store_true",
+                        help="record wall / CPU time, peak memory and throughput of every stage and phase "
+                             "to output/metrics/<run>.json (default: metrics in config.yaml)")
+    args = parser.parse_args(argv)
+
+    select = args.stages.split(",") if args.stages else names
+    unknown = sorted(set(select) - set(names))
+    if unknown:
+        parser.error(f"unknown stages {unknown} (choose from {', '.join(names)})")
+    first = names.index(args.first) if args.first else 0
+    last  = names.index(args.last)  if args.last  else len(names) - 1
+    select = [name for name in names[first:last + 1] if name in select]
+
+    global JOBS
+    if args.jobs is not None:
+        JOBS = args.jobs
+    jobs = JOBS or os.cpu_count() or 1
+
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    print("Saving outputs to:", OUTPUT_DIR)
+    run_id = time.strftime("%Y%m%d_%H%M%S")
+    spool  = os.path.join(OUTPUT_DIR, "metrics", run_id)     # per-process records, merged below
+    if args.metrics or METRICS:
+        metrics.enable(spool)
+    started = time.perf_counter()
+    status  = run_stages(STAGES, OUTPUT_DIR, force=select if args.force else (), select=select,
+                         jobs=jobs, set_jobs=_set_jobs)
+
+    if metrics.enabled():
+        metrics.write_report(spool + ".json", run=run_id, argv=sys.argv[1:], jobs=jobs,
+                             seconds=round(time.perf_counter() - started, 3), stages=status,
+                             selected=select)
+        metrics.disable()
+        shutil.rmtree(spool)
+        print(f"\nMetrics saved to {spool}.json")
+    return 1 if any(s in ("failed", "blocked") for name, s in status.items() if name in select) else 0
 
 
+def _set_jobs(jobs):
+    # Called before each stage, in the process that runs it: the stage's share
+    # of the jobs for its parallel steps, so that stages running side by side
+    # with pools of their own do not start jobs² processes between them
+    global JOBS
+    JOBS = jobs
 
 
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,393 @@
+# -*- coding: utf-8 -*-
+"""
+stage_cache.py
+--------------
+Content-addressed cache of the pipeline stages (run_pipeline.py).
+
+Every stage declares what its result depends on and what it writes:
+
+    inputs   external files (network, events, plans, TypicalDays.xlsx)
+    deps     upstream stages, whose values it receives
+    params   config values that change its output
+    code     modules whose source it runs
+    outputs  files / folders it writes (or a function of the stage values
+             giving them after the run, when they depend on e.g. the number
+             of typical days)
+
+The fingerprint of a stage is the SHA-256 of all of these: the digests of
+its input files, the fingerprints of its upstream stages, its params as
+JSON, the source of its code modules and of its own run function. After a
+successful run the fingerprint is written to
+
+    <output_dir>/stage_cache/<stage>.json
+
+and a later run skips the stage while the fingerprint still matches and
+its outputs all exist. Every run of a stage is also a metrics.py phase,
+"stage.<name>", with its input files as bytes. Since upstream fingerprints
+are part of the key, a change invalidates exactly the stages downstream of
+it: a new TypicalDays.xlsx re-runs the profile stage and everything after
+it, an edited optimize.py constant only the optimization and the plots.
+
+A skipped stage is not loaded either: its value (e.g. the timetable) is
+read back from its outputs only when a stage that does run needs it.
+
+run_stages(..., jobs=N) runs the stages on a pool of worker processes:
+a stage starts as soon as its upstream stages are done, so stages without a
+path between them (the network, the events, the plans, the typical days) run
+concurrently and split the N cores between them, in proportion to how long
+each took last time (the events parse gets most of them, the network one).
+A stage that runs alone (e.g. the optimization) runs in the calling process
+with all N cores for its own parallel steps. select restricts a run to some
+stages and uses the cached outputs of the others (run_pipeline.py --stages /
+--from / --to).
+
+Input files are hashed once: their digest is kept in stage_cache/files.json
+together with size and mtime, and only recomputed when those change (the
+same rule as network_cache.py).
+"""
+
+import collections
+import hashlib
+import inspect
+import json
+import marshal
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from importlib.util import find_spec
+from typing import Callable, Optional
+import metrics
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+CACHE_VERSION = 1                 # bump whenever the fingerprint recipe changes
+CACHE_FOLDER  = "stage_cache"
+FILES_INDEX   = "files.json"
+
+
+# ── Stage definition ──────────────────────────────────────────────────────────
+@dataclass
+class Stage:
+    name:    str
+    title:   str                        # printed when the stage starts, e.g. "[Step 3] Building vehicle timetable..."
+    run:     Callable                   # run(values) -> value; values[dep] is the value of each upstream stage
+    outputs: object = field(default_factory=list) # paths written by run, or outputs(values) -> paths
+    deps:    list = field(default_factory=list)   # names of upstream stages
+    inputs:  list = field(default_factory=list)   # external files read by run
+    params:  dict = field(default_factory=dict)   # JSON-serialisable settings that change the output
+    code:    list = field(default_factory=list)   # module names whose source run executes
+    load:    Optional[Callable] = None  # load(values) -> value from the outputs, for a skipped stage (None: no value)
+
+
+class StageFailed(Exception):
+    """Raised by a stage's run function when it finished without a usable result."""
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+def run_stages(stages, output_dir: str, force=(), select=None, jobs=1,
+               set_jobs=None) -> dict:
+    """
+    Run the stages in dependency order, skipping every stage whose
+    fingerprint matches its cache record. Stages named in force always run.
+
+    select limits the run to these stage names (default: all). The others
+    are not run: their cached outputs stand in for them, and the stages
+    downstream are fingerprinted with the fingerprint those outputs were
+    made with, so a partial run never caches results of stale inputs.
+
+    With jobs > 1 every stage whose upstream stages are done is started at
+    once in a pool of worker processes (as many as the widest level of the
+    dependency graph), so independent steps overlap and the wall time
+    approaches the critical path. Stage values go to and from the workers by
+    pickling. A stage that is the only one to run at that point runs in this
+    process instead. With jobs == 1 the stages run one after the other in
+    this process.
+
+    Each stage gets a share of the jobs for its own parallel steps, so that
+    nested pools stay within `jobs` processes: all of them when it runs
+    alone, otherwise the jobs not held by running stages, split between the
+    stages started together in proportion to their last run time (from
+    their cache records; equal shares without one). set_jobs(share) is
+    called in the process that runs the stage, just before it.
+
+    A stage that raises StageFailed is not recorded and the stages that
+    depend on it are not run. Returns {name: "ran" | "skipped" | "cached" |
+    "failed" | "blocked"}; "cached" is a stage outside select whose outputs
+    were used.
+    """
+    by_name  = {stage.name: stage for stage in stages}
+    order    = stage_order(stages)
+    selected = set(order) if select is None else set(select)
+    unknown  = sorted(selected - set(order))
+    if unknown:
+        raise ValueError(f"Unknown stages {unknown} (choose from {order})")
+
+    folder = os.path.join(output_dir, CACHE_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    digests = _FileDigests(os.path.join(folder, FILES_INDEX))
+    values  = _Values(by_name)
+    fingerprints, status, running = {}, {}, {}      # running: future -> (name, start time)
+    last_seconds, shares = {}, {}                    # run time in the old record, jobs of running stages
+
+    def _prepare(name):
+        # Decides in this process whether the stage runs: True if it has to,
+        # otherwise its status is set
+        stage = by_name[name]
+        record_path = os.path.join(folder, f"{name}.json")
+        record      = _read_json(record_path)
+        cached      = (record is not None and record.get("version") == CACHE_VERSION
+                       and all(os.path.exists(p) for p in record["outputs"]))
+        blocked     = [dep for dep in stage.deps if status[dep] in ("failed", "blocked")]
+
+        if name not in selected:
+            if blocked or not cached:
+                status[name] = "blocked"
+                return False
+            fingerprints[name] = record["fingerprint"]   # what the outputs were made with
+            status[name] = "cached"
+            return False
+
+        print(f"\n{stage.title}")
+        if blocked:
+            print(f"  ✗ Not run: {', '.join(blocked)} failed or not available")
+            status[name] = "blocked"
+            return False
+
+        fingerprints[name] = fingerprint(stage, fingerprints, digests)
+        digests.save()
+        if name not in force and cached and record["fingerprint"] == fingerprints[name]:
+            print(f"  → Unchanged since {record['finished']}, skipped (cached outputs)")
+            status[name] = "skipped"
+            return False
+
+        # The old record goes first: an interrupted run must not leave a
+        # record that matches half-written outputs
+        if record is not None and record.get("seconds") is not None:
+            last_seconds[name] = record["seconds"]
+        if os.path.exists(record_path):
+            os.remove(record_path)
+        return True
+
+    def _start(name, here, share):
+        # Runs the stage in this process, or submits it to the pool
+        stage  = by_name[name]
+        nbytes = sum(os.path.getsize(p) for p in stage.inputs) if stage.inputs else None
+        if here:
+            start = time.perf_counter()
+            try:
+                value = _run_stage(name, stage.run, values, nbytes, set_jobs, share)
+            except StageFailed as e:
+                value = e
+            _finish(name, value, start)
+        else:
+            inputs = {dep: values[dep] for dep in stage.deps}
+            future = pool.submit(_run_stage, name, stage.run, inputs, nbytes, set_jobs, share)
+            running[future] = (name, time.perf_counter())
+            shares[name]    = share
+
+    def _finish(name, value, start):
+        if isinstance(value, StageFailed):
+            print(f"  ✗ {value}")
+            status[name] = "failed"
+            return
+        values.set(name, value)
+        stage   = by_name[name]
+        seconds = time.perf_counter() - start
+        outputs = stage.outputs(values) if callable(stage.outputs) else stage.outputs
+        _write_json(os.path.join(folder, f"{name}.json"), {
+            "version":     CACHE_VERSION,
+            "fingerprint": fingerprints[name],
+            "outputs":     list(outputs),
+            "seconds":     round(seconds, 3),
+            "finished":    time.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        if pool is not None:
+            print(f"  → {name} finished ({seconds:.1f} s)")
+        status[name] = "ran"
+
+    pool = None
+    if jobs > 1:
+        pool = ProcessPoolExecutor(max_workers=min(jobs, _widest_level(by_name, order)))
+    try:
+        while len(status) < len(order):
+            started = {name for name, _ in running.values()}
+            ready   = [name for name in order
+                       if name not in status and name not in started
+                       and all(dep in status for dep in by_name[name].deps)]
+            to_run  = [name for name in ready if _prepare(name)]
+            if pool is None or (not running and len(to_run) == 1):
+                # A stage with nothing beside it keeps all the jobs in this process
+                for name in to_run:
+                    _start(name, here=True, share=jobs)
+            elif to_run:
+                free = jobs - sum(shares.values())
+                for name, share in _split_jobs(free, to_run, last_seconds).items():
+                    _start(name, here=False, share=share)
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, start = running.pop(future)
+                    shares.pop(name)
+                    try:
+                        value = future.result()
+                    except StageFailed as e:
+                        value = e
+                    _finish(name, value, start)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return status
+
+
+def stage_order(stages) -> list:
+    """
+    Stage names in dependency order. Stages keep their listed order unless
+    a dependency comes later in the list.
+    """
+    names   = {stage.name for stage in stages}
+    unknown = sorted({dep for stage in stages for dep in stage.deps} - names)
+    if unknown:
+        raise ValueError(f"Stages depend on undefined stages {unknown}")
+
+    order, pending = [], list(stages)
+    while pending:
+        ready = next((s for s in pending if set(s.deps) <= set(order)), None)
+        if ready is None:
+            raise ValueError(f"Stage dependencies form a cycle: {[s.name for s in pending]}")
+        order.append(ready.name)
+        pending.remove(ready)
+    return order
+
+
+def fingerprint(stage: Stage, upstream: dict, digests=None) -> str:
+    """
+    SHA-256 over everything the stage's output depends on (see module
+    docstring). upstream maps the names of its deps to their fingerprints.
+    """
+    digests = digests or _FileDigests(None)
+    h = hashlib.sha256()
+    _update(h, "version", CACHE_VERSION)
+    _update(h, "stage",   stage.name)
+    _update(h, "deps",    {dep: upstream[dep] for dep in sorted(stage.deps)})
+    _update(h, "params",  stage.params)
+    _update(h, "inputs",  {os.path.abspath(p): digests.sha256(p) for p in stage.inputs})
+    _update(h, "code",    {module: _source_digest(module) for module in sorted(stage.code)})
+    _update(h, "run",     _function_digest(stage.run))
+    return h.hexdigest()
+
+
+# ── Helpers ───────────────────────────────────────────────────────────────────
+def _run_stage(name, run, values, nbytes, set_jobs, jobs):
+    # In this process, or a pool worker (values: the upstream stage values,
+    # pickled in). Timed as phase "stage.<name>" when metrics are enabled.
+    if set_jobs is not None:
+        set_jobs(jobs)
+    with metrics.phase(f"stage.{name}", nbytes=nbytes):
+        return run(values)
+
+
+def _widest_level(by_name, order):
+    # Most stages at the same depth of the dependency graph: the most that
+    # can be ready at once, so the size of the stage pool
+    depth = {}
+    for name in order:
+        depth[name] = 1 + max((depth[dep] for dep in by_name[name].deps), default=-1)
+    return max(collections.Counter(depth.values()).values())
+
+
+def _split_jobs(jobs, names, last_seconds):
+    # Shares of jobs for stages started together, at least one each: in
+    # proportion to their last run time, equal where it is not known
+    known   = [last_seconds[name] for name in names if name in last_seconds]
+    default = sum(known) / len(known) if known else 1.0
+    weights = {name: max(last_seconds.get(name, default), 1e-3) for name in names}
+    total   = sum(weights.values())
+    extra   = max(jobs - len(names), 0)                  # beyond the one each
+    shares  = {name: 1 + int(extra * w / total) for name, w in weights.items()}
+    # What the rounding left goes to the longest stages
+    left = len(names) + extra - sum(shares.values())
+    for name in sorted(names, key=weights.get, reverse=True)[:left]:
+        shares[name] += 1
+    return shares
+
+
+class _Values:
+    # Values of the stages that ran, plus lazy loading from the outputs of
+    # skipped stages: values[name] calls stage.load(values) on first access only
+    def __init__(self, stages):
+        self._stages = stages
+        self._values = {}
+
+    def set(self, name, value):
+        self._values[name] = value
+
+    def __getitem__(self, name):
+        if name not in self._values:
+            load = self._stages[name].load
+            self._values[name] = load(self) if load is not None else None
+        return self._values[name]
+
+
+class _FileDigests:
+    # path -> {size, mtime_ns, sha256}; the digest is reused while size and
+    # mtime are unchanged, so a large events file is only hashed when it changes
+    def __init__(self, path):
+        self.path  = path
+        self.index = (_read_json(path) if path else None) or {}
+
+    def sha256(self, path):
+        key   = os.path.abspath(path)
+        stat  = os.stat(path)
+        entry = self.index.get(key)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": _sha256(path)}
+            self.index[key] = entry
+        return entry["sha256"]
+
+    def save(self):
+        if self.path:
+            _write_json(self.path, self.index)
+
+
+def _function_digest(func) -> str:
+    try:
+        code = inspect.getsource(func).encode()
+    except (OSError, TypeError):
+        code = marshal.dumps(func.__code__)     # defined without a source file (e.g. typed into a console)
+    return hashlib.sha256(code).hexdigest()
+
+
+def _source_digest(module: str) -> str:
+    spec = find_spec(module)
+    if spec is None or spec.origin is None:
+        raise ValueError(f"Cannot find the source of module {module!r}")
+    return _sha256(spec.origin)
+
+
+def _update(h, key, value):
+    h.update(json.dumps([key, value], sort_keys=True, default=str).encode())
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_json(path: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None                   # unreadable record is treated as missing
+
+
+def _write_json(path: str, data) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
@@ -0,0 +1,708 @@
+# -*- coding: utf-8 -*-
+"""
+synthetic_scenario.py
+---------------------
+Synthetic EQASim / MATSim outputs, for benchmarks and tests without the
+private simulation data:
+
+    spec  = ScenarioSpec(agents=10_000)
+    info  = generate_scenario("benchmarks/scenarios/10k", spec)
+
+    python synthetic_scenario.py benchmarks/scenarios/10k --agents 10000
+
+writes the four inputs of run_pipeline.py into the folder, in the formats
+and with the event mix of a real run:
+
+    output_network.xml.gz    grid road network around Paris (Lambert-93), plus rail links
+    output_events.xml.gz     one simulated day, sorted by time
+    output_plans.xml.gz      every person with the selected plan (and rejected ones)
+    TypicalDays.xlsx         hourly solar radiation and prices, sheet "TimeSeries"
+    scenario.json            the spec and the resulting counts
+
+Car users walk to their car and back through "car interaction" activities
+and drive shortest (Manhattan) routes, one "left link" / "entered link"
+pair per road link. The other persons walk or ride a bus (teleported), and
+buses drive around the grid all day: those are the events Step 2 discards.
+
+Scale knobs (ScenarioSpec):
+
+    agents               persons; the cars of Steps 2–5 are about car_share of them
+    links                road links (a square grid of about links / 4 nodes)
+    trips_per_agent      mean trips per person and day (at least 2: out and home again)
+    links_per_trip       mean road links of a trip away from home
+    bus_links_per_agent  links driven by buses per person: "entered link" events of non-car vehicles
+
+The same spec gives the same files. Memory stays bounded at any scale:
+persons are generated BATCH_AGENTS at a time, their events spooled to one
+temporary file per simulated hour, and each hour is sorted and written on
+its own.
+"""
+
+import argparse
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+import numpy as np
+import pandas as pd
+
+# ── Configuration ─────────────────────────────────────────────────────────────
+BATCH_AGENTS = 50_000             # persons generated (and held in memory) at a time
+FORMAT_ROWS  = 1_000_000          # events formatted into text at a time
+GZIP_LEVEL   = 1                  # the parsers pay the same to decompress any level; 1 writes fastest
+
+ORIGIN     = (640_000.0, 6_850_000.0)   # [m] Lambert-93 (EPSG:2154), west of Paris
+SPACING    = 150.0                # [m] distance between grid nodes
+ARTERIAL   = 5                    # every 5th grid row / column is a faster 2-lane road
+WALK_SPEED = 1.2                  # [m/s] teleported walk legs (incl. detours)
+BUS_SPEED  = 6.0                  # [m/s] teleported pt legs
+WALK_MAX   = 1_500.0              # [m] longer trips of persons without a car go by pt
+BUSES_PER_AGENT = 0.01            # bus vehicles per person
+
+ACT_TYPES = ["home", "work", "education", "shop", "leisure", "other", "car interaction", "pt interaction"]
+HOME, WORK, EDUCATION, SHOP, LEISURE, OTHER, CAR_INTERACTION, PT_INTERACTION = range(len(ACT_TYPES))
+MODES = ["car", "walk", "pt"]
+CAR, WALK, PT = range(len(MODES))
+
+# Activity type of the first trip of the day and of the later ones, and
+# the duration of each type: (mean, standard deviation) [h]
+FIRST_ACTIVITY = {WORK: 0.45, EDUCATION: 0.15, SHOP: 0.15, LEISURE: 0.15, OTHER: 0.10}
+LATER_ACTIVITY = {WORK: 0.10, SHOP: 0.35, LEISURE: 0.35, OTHER: 0.20}
+DURATION_H     = {WORK: (8.0, 1.5), EDUCATION: (6.5, 1.0), SHOP: (0.75, 0.4),
+                  LEISURE: (2.0, 1.0), OTHER: (1.0, 0.5)}
+_DURATION_MEAN = np.array([DURATION_H.get(a, (1.0, 0.5))[0] * 3600 for a in range(len(ACT_TYPES))])
+_DURATION_SD   = np.array([DURATION_H.get(a, (1.0, 0.5))[1] * 3600 for a in range(len(ACT_TYPES))])
+
+# Typical days of TypicalDays.xlsx: sunrise, sunset [h], clear-sky peak
+# [W/m²] and mean price [€/MWh] per season
+DAY_KINDS = ["Weekday", "Saturday", "Sunday"]
+SEASONS   = {"Winter": (8.0, 17.0, 350.0, 115.0), "Spring": (6.5, 20.0, 700.0, 80.0),
+             "Summer": (6.0, 21.5, 850.0, 65.0),  "Autumn": (7.5, 18.5, 500.0, 95.0)}
+DAY_NAMES = [f"{season}_{kind}" for season in SEASONS for kind in DAY_KINDS]
+
+
+# ── Scenario definition ───────────────────────────────────────────────────────
+@dataclass
+class ScenarioSpec:
+    agents:              int   = 1_000
+    links:               int   = 10_000
+    car_share:           float = 0.8     # persons with a car (all their trips by car)
+    trips_per_agent:     float = 3.2
+    links_per_trip:      float = 20.0
+    bus_links_per_agent: float = 10.0
+    rejected_plans:      int   = 1       # unselected plans kept per person, as MATSim does
+    typical_days:        int   = 12      # rows of TypicalDays.xlsx: 24 per day, of DAY_NAMES
+    seed:                int   = 0
+
+
+# ── Event records ─────────────────────────────────────────────────────────────
+# Events are generated as fixed-size records and only formatted into XML
+# once sorted. who is a person (or a bus, for the bus kinds), aux an
+# activity type, a mode, a bus or a distance [m], depending on the kind.
+EVENT_DTYPE = np.dtype([("time", "<i4"), ("kind", "u1"), ("who", "<i4"), ("link", "<i4"), ("aux", "<i4")])
+
+(ACTEND, ACTSTART, DEPARTURE, ARRIVAL, TRAVELLED, ENTERS_VEHICLE, LEAVES_VEHICLE,
+ ENTERS_TRAFFIC, LEAVES_TRAFFIC, LEFT_LINK, ENTERED_LINK,
+ BOARDS_BUS, LEAVES_BUS, BUS_LEFT_LINK, BUS_ENTERED_LINK) = range(15)
+
+# kind -> (attributes: {0} time, {1} who, {2} link, {3} aux; who table; aux table)
+EVENT_TEMPLATES = {
+    ACTEND:           ('type="actend" person="{1}" link="{2}" actType="{3}"', "person", ACT_TYPES),
+    ACTSTART:         ('type="actstart" person="{1}" link="{2}" actType="{3}"', "person", ACT_TYPES),
+    DEPARTURE:        ('type="departure" person="{1}" link="{2}" legMode="{3}"', "person", MODES),
+    ARRIVAL:          ('type="arrival" person="{1}" link="{2}" legMode="{3}"', "person", MODES),
+    TRAVELLED:        ('type="travelled" person="{1}" distance="{3}.0" mode="walk"', "person", None),
+    ENTERS_VEHICLE:   ('type="PersonEntersVehicle" person="{1}" vehicle="{1}:car"', "person", None),
+    LEAVES_VEHICLE:   ('type="PersonLeavesVehicle" person="{1}" vehicle="{1}:car"', "person", None),
+    ENTERS_TRAFFIC:   ('type="vehicle enters traffic" person="{1}" link="{2}" vehicle="{1}:car" '
+                       'networkMode="car" relativePosition="1.0"', "person", None),
+    LEAVES_TRAFFIC:   ('type="vehicle leaves traffic" person="{1}" link="{2}" vehicle="{1}:car" '
+                       'networkMode="car" relativePosition="1.0"', "person", None),
+    LEFT_LINK:        ('type="left link" link="{2}" vehicle="{1}:car"', "person", None),
+    ENTERED_LINK:     ('type="entered link" link="{2}" vehicle="{1}:car"', "person", None),
+    BOARDS_BUS:       ('type="PersonEntersVehicle" person="{1}" vehicle="{3}"', "person", "bus"),
+    LEAVES_BUS:       ('type="PersonLeavesVehicle" person="{1}" vehicle="{3}"', "person", "bus"),
+    BUS_LEFT_LINK:    ('type="left link" link="{2}" vehicle="{1}"', "bus", None),
+    BUS_ENTERED_LINK: ('type="entered link" link="{2}" vehicle="{1}"', "bus", None),
+}
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+def generate_scenario(folder: str, spec: ScenarioSpec = None) -> dict:
+    """
+    Write the network, events, plans and typical days of spec into folder
+    (see module docstring) and return the counts also saved in
+    folder/scenario.json: persons, vehicles (persons driving a car that
+    day), trips, car_trips, links, events and the generation time.
+    """
+    spec  = spec or ScenarioSpec()
+    start = time.perf_counter()
+    os.makedirs(folder, exist_ok=True)
+    grid  = _build_grid(spec.links, np.random.default_rng((spec.seed, 0)))
+    write_network(grid, os.path.join(folder, "output_network.xml.gz"))
+    print(f"  → Network: {grid.n_links:,} links ({grid.n_road:,} road), {len(grid.x):,} nodes")
+
+    person_ids = [str(p) for p in range(spec.agents)]
+    n_buses    = [max(1, round(n * BUSES_PER_AGENT)) for n in _batch_sizes(spec.agents)]
+    bus_ids    = [f"bus_{b}" for b in range(sum(n_buses))]
+    counts     = {"persons": spec.agents, "vehicles": 0, "trips": 0, "car_trips": 0,
+                  "links": grid.n_links, "events": 0}
+
+    spool = tempfile.mkdtemp(prefix=".events_", dir=folder)   # one record file per simulated hour
+    try:
+        with _gzip_text(os.path.join(folder, "output_plans.xml.gz")) as plans:
+            plans.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                        '<!DOCTYPE population SYSTEM "http://www.matsim.org/files/dtd/population_v6.dtd">\n\n'
+                        '<population>\n\n'
+                        '\t<attributes>\n\t\t<attribute name="coordinateReferenceSystem" '
+                        'class="java.lang.String">EPSG:2154</attribute>\n\t</attributes>\n\n')
+            first_agent, first_bus = 0, 0
+            for b, n in enumerate(_batch_sizes(spec.agents)):
+                rng   = np.random.default_rng((spec.seed, 1, b))
+                batch = _simulate_batch(grid, spec, rng, first_agent, n)
+                buses = _drive_buses(grid, spec, rng, first_bus, n_buses[b], n)
+                batch.events.append(buses)
+                # pt riders board the buses of their own batch
+                for events in batch.events:
+                    board = np.isin(events["kind"], (BOARDS_BUS, LEAVES_BUS))
+                    events["aux"][board] = first_bus + events["aux"][board] % n_buses[b]
+                _spool_events(batch.events, spool)
+                _write_plans(plans, batch, grid, spec, rng, person_ids)
+
+                counts["vehicles"]  += int(batch.is_car.sum())
+                counts["trips"]     += int(batch.n_trips.sum())
+                counts["car_trips"] += int(batch.n_trips[batch.is_car].sum())
+                counts["events"]    += sum(len(e) for e in batch.events)
+                first_agent += n
+                first_bus   += n_buses[b]
+            plans.write('</population>\n')
+        print(f"  → Plans: {spec.agents:,} persons, {counts['vehicles']:,} with a car, "
+              f"{counts['trips']:,} trips")
+
+        _write_events(spool, os.path.join(folder, "output_events.xml.gz"),
+                      {"person": person_ids, "bus": bus_ids}, grid.link_ids)
+        print(f"  → Events: {counts['events']:,}")
+    finally:
+        shutil.rmtree(spool, ignore_errors=True)
+
+    write_typical_days(os.path.join(folder, "TypicalDays.xlsx"), spec.typical_days,
+                       np.random.default_rng((spec.seed, 2)))
+    counts["seconds"] = round(time.perf_counter() - start, 1)
+    with open(os.path.join(folder, "scenario.json"), "w") as f:
+        json.dump({"spec": asdict(spec), **counts}, f, indent=2)
+    print(f"  → Scenario written to {folder} ({counts['seconds']:.1f} s)")
+    return counts
+
+
+def read_scenario(folder: str):
+    """Content of folder/scenario.json, or None if no scenario was generated there."""
+    path = os.path.join(folder, "scenario.json")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+# ── Network ───────────────────────────────────────────────────────────────────
+@dataclass
+class _Grid:
+    nx:        int                 # nodes per row (and rows)
+    x:         np.ndarray          # (N,) node coordinates [m]
+    y:         np.ndarray
+    link_ids:  list                # (L,) str, road links first (ids "0" .. "n_road - 1"), then rail links
+    from_node: np.ndarray          # (L,) int
+    to_node:   np.ndarray
+    length:    np.ndarray          # (L,) [m]
+    freespeed: np.ndarray          # (L,) [m/s]
+    capacity:  np.ndarray          # (L,) [veh/h]
+    lanes:     np.ndarray          # (L,)
+    n_road:    int                 # road links come first: the ones cars and buses drive on
+    link_out:  np.ndarray          # (N, 4) road link leaving each node towards +x, −x, +y, −y (−1: none)
+    link_in:   np.ndarray          # (N, 4) road link entering each node from −x, +x, −y, +y (−1: none)
+
+    @property
+    def n_links(self):
+        return len(self.link_ids)
+
+
+def _build_grid(n_links, rng) -> _Grid:
+    # Square grid with a pair of opposite links between neighbouring nodes:
+    # 4·side·(side − 1) road links, plus one rail link per 50 road links
+    side = max(2, int(np.ceil(np.sqrt(n_links / 4))))
+    ix, iy = np.meshgrid(np.arange(side), np.arange(side))
+    ix, iy = ix.ravel(), iy.ravel()
+    x = ORIGIN[0] + (ix + rng.uniform(-0.2, 0.2, len(ix))) * SPACING
+    y = ORIGIN[1] + (iy + rng.uniform(-0.2, 0.2, len(iy))) * SPACING
+    node = np.arange(side * side)
+
+    # Direction d of a link: 0 +x, 1 −x, 2 +y, 3 −y; opposite links are adjacent ids
+    east   = node[ix < side - 1]
+    north  = node[iy < side - 1]
+    a      = np.concatenate([np.column_stack([east, east + 1]), np.column_stack([north, north + side])])
+    d      = np.concatenate([np.zeros(len(east), int), np.full(len(north), 2)])
+    from_n = np.column_stack([a[:, 0], a[:, 1]]).ravel()
+    to_n   = np.column_stack([a[:, 1], a[:, 0]]).ravel()
+    dirs   = np.column_stack([d, d + 1]).ravel()
+    n_road = len(from_n)
+
+    link_out = np.full((side * side, 4), -1)
+    link_out[from_n, dirs] = np.arange(n_road)
+    link_in  = np.full((side * side, 4), -1)
+    link_in[to_n, dirs] = np.arange(n_road)
+
+    arterial  = np.where(dirs < 2, iy[from_n], ix[from_n]) % ARTERIAL == 0
+    straight  = np.hypot(x[to_n] - x[from_n], y[to_n] - y[from_n])
+    length    = straight * rng.uniform(1.0, 1.25, n_road)
+    freespeed = np.where(arterial, 13.8888889, 8.3333333)
+    capacity  = np.where(arterial, 1800.0, 600.0)
+    lanes     = np.where(arterial, 2.0, 1.0)
+
+    # Rail links between random nodes: network rows the car parsers must skip
+    n_rail = n_links // 50
+    rail_from, rail_to = rng.integers(0, side * side, (2, n_rail))
+    rail_len = np.hypot(x[rail_to] - x[rail_from], y[rail_to] - y[rail_from]) + 50.0
+
+    return _Grid(nx=side, x=x, y=y,
+                 link_ids=[str(i) for i in range(n_road)] + [f"pt_{i}" for i in range(n_rail)],
+                 from_node=np.concatenate([from_n, rail_from]), to_node=np.concatenate([to_n, rail_to]),
+                 length=np.concatenate([length, rail_len]),
+                 freespeed=np.concatenate([freespeed, np.full(n_rail, 22.2222222)]),
+                 capacity=np.concatenate([capacity, np.full(n_rail, 10_000.0)]),
+                 lanes=np.concatenate([lanes, np.ones(n_rail)]),
+                 n_road=n_road, link_out=link_out, link_in=link_in)
+
+
+def write_network(grid: _Grid, path: str) -> None:
+    with _gzip_text(path) as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<!DOCTYPE network SYSTEM "http://www.matsim.org/files/dtd/network_v2.dtd">\n'
+                '<network>\n\n'
+                '\t<attributes>\n\t\t<attribute name="coordinateReferenceSystem" '
+                'class="java.lang.String">EPSG:2154</attribute>\n\t</attributes>\n\n'
+                '<!-- ====================================================================== -->\n\n'
+                '\t<nodes>\n')
+        f.writelines(f'\t\t<node id="{n}" x="{x}" y="{y}" >\n\t\t</node>\n'
+                     for n, (x, y) in enumerate(zip(grid.x.round(4).tolist(), grid.y.round(4).tolist())))
+        f.write('\t</nodes>\n\n'
+                '<!-- ====================================================================== -->\n\n'
+                '\t<links capperiod="01:00:00" effectivecellsize="7.5" effectivelanewidth="3.75">\n')
+        modes = ["car,car_passenger"] * grid.n_road + ["rail"] * (grid.n_links - grid.n_road)
+        f.writelines(
+            f'\t\t<link id="{link}" from="{a}" to="{b}" length="{length:.2f}" freespeed="{speed}" '
+            f'capacity="{capacity}" permlanes="{lanes}" oneway="1" modes="{mode}" >\n\t\t</link>\n'
+            for link, a, b, length, speed, capacity, lanes, mode in zip(
+                grid.link_ids, grid.from_node.tolist(), grid.to_node.tolist(), grid.length.tolist(),
+                grid.freespeed.tolist(), grid.capacity.tolist(), grid.lanes.tolist(), modes))
+        f.write('\t</links>\n\n'
+                '<!-- ====================================================================== -->\n\n'
+                '</network>\n')
+
+
+# ── Persons ───────────────────────────────────────────────────────────────────
+@dataclass
+class _Batch:
+    first:    int                  # index of the first person of the batch
+    is_car:   np.ndarray           # (B,) bool
+    n_trips:  np.ndarray           # (B,) int
+    age:      np.ndarray           # (B,) int
+    home:     np.ndarray           # (B,) home link
+    home_end: np.ndarray           # (B,) end of the first home activity [s]
+    trips:    list                 # one dict of (B,) arrays per trip index, see _simulate_batch
+    events:   list                 # record arrays (EVENT_DTYPE)
+
+
+def _batch_sizes(agents):
+    return [min(BATCH_AGENTS, agents - a) for a in range(0, agents, BATCH_AGENTS)]
+
+
+def _simulate_batch(grid, spec, rng, first, n) -> _Batch:
+    # Activity chains of n persons, trip k of all of them at once: the
+    # person leaves the activity on link `link` at `clock`, travels, and
+    # starts activity k + 1 (the last one at home, without an end)
+    is_car   = rng.random(n) < spec.car_share
+    n_trips  = 2 + rng.poisson(max(spec.trips_per_agent - 2.0, 0.0), n)
+    home     = _random_link_into(grid, rng.integers(0, len(grid.x), n), rng)
+    home_end = rng.normal(7.75, 1.5, n)
+    home_end = np.where((home_end < 4.5) | (home_end > 12.0), rng.uniform(4.5, 12.0, n), home_end)
+    home_end = (home_end * 3600).astype(np.int64)
+    who      = first + np.arange(n)
+
+    link, kind, clock = home.copy(), np.full(n, HOME), home_end.copy()
+    trips, events = [], []
+    for k in range(int(n_trips.max())):
+        active = np.flatnonzero(n_trips > k)
+        n_trips[active[clock[active] > 20 * 3600]] = k + 1    # out after 20:00: straight home
+        last   = n_trips[active] == k + 1
+
+        # Next activity: home for the last trip, else a random place
+        # links_per_trip (on average) road links away
+        act = _choose(rng, FIRST_ACTIVITY if k == 0 else LATER_ACTIVITY, len(active))
+        act[last] = HOME
+        origin = grid.to_node[link[active]]
+        target = _random_link_into(grid, _node_near(grid, origin, spec.links_per_trip, rng), rng)
+        target[last] = home[active[last]]
+
+        trip = {"active": active, "from": link[active], "link": target, "act": act,
+                "dep": clock[active], "mode": np.where(is_car[active], CAR, WALK)}
+        arrive = np.zeros(len(active), np.int64)
+
+        car = np.flatnonzero(is_car[active])
+        if len(car):
+            drive = _drive(grid, rng, who[active[car]], trip["from"][car], target[car],
+                           kind[active[car]], act[car], trip["dep"][car], events)
+            arrive[car] = drive.pop("arrive")
+            trip.update(car=car, **drive)
+
+        other = np.flatnonzero(~is_car[active])
+        if len(other):
+            end      = grid.to_node[target[other]]
+            distance = 1.3 * np.hypot(grid.x[end] - grid.x[origin[other]],
+                                      grid.y[end] - grid.y[origin[other]]) + 50.0
+            pt = distance > WALK_MAX
+            trip["mode"][other[pt]] = PT
+            arrive[other] = _teleport(rng, who[active[other]], trip["from"][other], target[other],
+                                      kind[active[other]], act[other], trip["dep"][other], distance, pt, events)
+
+        # The activity lasts its type's duration; the last one till the end of the day
+        duration = np.maximum(rng.normal(_DURATION_MEAN[act], _DURATION_SD[act]), 300).astype(np.int64)
+        trip.update(arrive=arrive, end=np.where(last, -1, arrive + duration))
+        trips.append(trip)
+
+        link[active], kind[active], clock[active] = target, act, trip["end"]
+
+    return _Batch(first=first, is_car=is_car, n_trips=n_trips, age=rng.integers(18, 85, n),
+                  home=home, home_end=home_end, trips=trips, events=events)
+
+
+def _drive(grid, rng, who, start, target, prev_act, next_act, dep, events) -> dict:
+    # Car trips: walk to the car, drive the route, walk to the activity.
+    # Returns the arrival times and what the plans need of the legs
+    n      = len(who)
+    walk   = rng.uniform(10, 120, (2, n)).round().astype(np.int64)   # [m] access, egress
+    walk_s = np.ceil(walk / WALK_SPEED).astype(np.int64)
+    depart = dep + walk_s[0]                                # the car leaves after the access walk
+
+    route, counts = _route(grid, grid.to_node[start], target, rng)
+    trip_of = np.repeat(np.arange(n), counts)
+    first   = np.cumsum(counts) - counts                    # position of each trip's first route link
+    tt      = np.ceil(grid.length[route] / grid.freespeed[route]
+                      * _congestion(depart)[trip_of]).astype(np.int64) + 1
+    elapsed = np.cumsum(tt) - tt                            # exclusive, over all trips ...
+    entered = depart[trip_of] + 1 + elapsed - elapsed[first][trip_of]   # ... restarted per trip
+    done    = entered[first + counts - 1] + tt[first + counts - 1]      # end of the activity link
+    arrive  = done + walk_s[1]
+    previous = np.where(np.arange(len(route)) == first[trip_of], start[trip_of], np.roll(route, 1))
+
+    events.append(_records(
+        [ACTEND, DEPARTURE, TRAVELLED, ARRIVAL, ACTSTART, ACTEND, DEPARTURE, ENTERS_VEHICLE, ENTERS_TRAFFIC],
+        [dep, dep, depart, depart, depart, depart, depart, depart, depart], who, start,
+        [prev_act, WALK, walk[0], WALK, CAR_INTERACTION, CAR_INTERACTION, CAR, 0, 0]))
+    events.append(_records([LEFT_LINK, ENTERED_LINK], [entered, entered], who[trip_of],
+                           [previous, route], [0, 0]))
+    events.append(_records(
+        [LEAVES_TRAFFIC, LEAVES_VEHICLE, ARRIVAL, ACTSTART, ACTEND, DEPARTURE, TRAVELLED, ARRIVAL, ACTSTART],
+        [done, done, done, done, done, done, arrive, arrive, arrive], who, target,
+        [0, 0, CAR, CAR_INTERACTION, CAR_INTERACTION, WALK, walk[1], WALK, next_act]))
+
+    return {"arrive": arrive, "walk": walk, "depart": depart, "done": done,
+            "route": route, "route_counts": counts}
+
+
+def _teleport(rng, who, start, target, prev_act, next_act, dep, distance, pt, events):
+    # Walk and pt legs of persons without a car; pt riders board a bus
+    # (which one is fixed by generate_scenario)
+    wait   = rng.integers(60, 600, len(who))
+    arrive = dep + np.ceil(np.where(pt, wait + distance / BUS_SPEED, distance / WALK_SPEED)).astype(np.int64)
+    walk, ride = np.flatnonzero(~pt), np.flatnonzero(pt)
+    bus = rng.integers(0, 1 << 30, len(ride))
+    events.append(_records([ACTEND, DEPARTURE, TRAVELLED, ARRIVAL, ACTSTART],
+                           [dep[walk], dep[walk], arrive[walk], arrive[walk], arrive[walk]], who[walk],
+                           [start[walk], start[walk], start[walk], target[walk], target[walk]],
+                           [prev_act[walk], WALK, distance[walk].astype(np.int64), WALK, next_act[walk]]))
+    events.append(_records([ACTEND, DEPARTURE, BOARDS_BUS, LEAVES_BUS, ARRIVAL, ACTSTART],
+                           [dep[ride], dep[ride], dep[ride] + wait[ride], arrive[ride], arrive[ride], arrive[ride]],
+                           who[ride], [start[ride], start[ride], 0, 0, target[ride], target[ride]],
+                           [prev_act[ride], PT, bus, bus, PT, next_act[ride]]))
+    return arrive
+
+
+def _drive_buses(grid, spec, rng, first_bus, n_buses, n_agents):
+    # Buses drive random walks (no U-turns) over the road grid from 05:00,
+    # bus_links_per_agent · n_agents links in total
+    steps = int(round(spec.bus_links_per_agent * n_agents / n_buses))
+    if steps == 0:
+        return np.zeros(0, EVENT_DTYPE)
+    link  = _random_link_into(grid, rng.integers(0, len(grid.x), n_buses), rng)
+    clock = 5 * 3600 + rng.integers(0, 3600, n_buses)
+    links = np.empty((steps + 1, n_buses), np.int64)
+    times = np.empty((steps, n_buses), np.int64)
+    links[0] = link
+    for s in range(steps):
+        out   = grid.link_out[grid.to_node[link]]
+        ok    = (out >= 0) & (out != (link ^ 1)[:, None])    # opposite links have adjacent ids
+        clock = clock + np.ceil(grid.length[link] / grid.freespeed[link]).astype(np.int64) + 1
+        link  = out[np.arange(n_buses), np.argmax(rng.random(out.shape) * ok, axis=1)]
+        links[s + 1], times[s] = link, clock
+    # Bus after bus, in driving order
+    times = times.T.ravel()
+    bus   = np.repeat(first_bus + np.arange(n_buses), steps)
+    return _records([BUS_LEFT_LINK, BUS_ENTERED_LINK], [times, times], bus,
+                    [links[:-1].T.ravel(), links[1:].T.ravel()], [0, 0])
+
+
+def _route(grid, origin, target_link, rng):
+    # Shortest route from node origin over the grid to the from-node of
+    # target_link (the x and y steps in random order), then target_link
+    # itself. Returns (links of all routes, concatenated; links per route)
+    nx     = grid.nx
+    end    = grid.from_node[target_link]
+    dx     = end % nx - origin % nx
+    dy     = end // nx - origin // nx
+    steps  = np.abs(dx) + np.abs(dy)
+    counts = steps + 1
+    first_step = np.cumsum(steps) - steps
+
+    trip_of = np.repeat(np.arange(len(origin)), steps)
+    rank    = np.arange(len(trip_of)) - first_step[trip_of]
+    along_x = (rank < np.abs(dx)[trip_of])[np.lexsort((rng.random(len(trip_of)), trip_of))]
+    forward = np.where(along_x, dx[trip_of] > 0, dy[trip_of] > 0)
+    direction = np.where(along_x, 0, 2) + ~forward          # 0 +x, 1 −x, 2 +y, 3 −y
+    move    = np.array([1, -1, nx, -nx])[direction]
+    offset  = np.cumsum(move) - move                        # exclusive, over all trips ...
+    node    = origin[trip_of] + offset - offset[first_step[trip_of]]     # ... restarted per trip
+
+    route = np.empty(counts.sum(), np.int64)
+    first = np.cumsum(counts) - counts
+    route[first[trip_of] + rank] = grid.link_out[node, direction]
+    route[first + steps] = target_link
+    return route, counts
+
+
+def _node_near(grid, origin, mean_links, rng):
+    # A node about mean_links grid steps (geometric distribution) away from origin
+    nx   = grid.nx
+    d    = rng.geometric(1.0 / max(mean_links, 1.0), len(origin))
+    dx   = np.rint(d * rng.random(len(origin))).astype(np.int64)
+    sx   = rng.choice([-1, 1], len(origin))
+    sy   = rng.choice([-1, 1], len(origin))
+    x    = np.clip(origin % nx + sx * dx, 0, nx - 1)
+    y    = np.clip(origin // nx + sy * (d - dx), 0, nx - 1)
+    same = (x == origin % nx) & (y == origin // nx)
+    x[same] = np.where(x[same] + 1 < nx, x[same] + 1, x[same] - 1)
+    return y * nx + x
+
+
+def _random_link_into(grid, node, rng):
+    into = grid.link_in[node]
+    return into[np.arange(len(node)), np.argmax(rng.random(into.shape) * (into >= 0), axis=1)]
+
+
+def _congestion(t):
+    # Travel time factor of the morning and evening peaks
+    hour = (t % 86400) / 3600.0
+    return 1.0 + 0.6 * np.exp(-((hour - 8.0) / 1.0) ** 2) + 0.5 * np.exp(-((hour - 17.75) / 1.25) ** 2)
+
+
+def _choose(rng, probabilities, n):
+    values = np.array(list(probabilities))
+    return values[rng.choice(len(values), n, p=list(probabilities.values()))]
+
+
+def _records(kinds, times, who, links, aux):
+    # Events of n trips with len(kinds) events each, trip after trip: the
+    # events of one trip stay together and in order (a stable sort by time
+    # later keeps the order of simultaneous events of a person)
+    n   = len(who)
+    out = np.empty((n, len(kinds)), EVENT_DTYPE)
+    out["kind"] = kinds
+    for field, columns in (("time", times), ("link", links), ("aux", aux)):
+        if not isinstance(columns, list):
+            columns = [columns] * len(kinds)
+        out[field] = np.column_stack([np.broadcast_to(c, n) for c in columns]) if n else 0
+    out["who"] = np.asarray(who)[:, None]
+    return out.ravel()
+
+
+# ── Writers ───────────────────────────────────────────────────────────────────
+def _spool_events(events, spool):
+    # Append the records to one file per simulated hour
+    records = np.concatenate(events)
+    hour    = np.minimum(records["time"] // 3600, 47)
+    for h in np.unique(hour):
+        with open(os.path.join(spool, f"{h:02d}.bin"), "ab") as f:
+            records[hour == h].tofile(f)
+
+
+def _write_events(spool, path, who_tables, link_ids):
+    with _gzip_text(path) as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<events version="1.0">\n')
+        for name in sorted(os.listdir(spool)):
+            records = np.fromfile(os.path.join(spool, name), EVENT_DTYPE)
+            records = records[np.argsort(records["time"], kind="stable")]
+            for i in range(0, len(records), FORMAT_ROWS):
+                f.write(_format_events(records[i:i + FORMAT_ROWS], who_tables, link_ids))
+        f.write('</events>\n')
+
+
+def _format_events(records, who_tables, link_ids) -> str:
+    lines = np.empty(len(records), dtype=object)
+    for kind, (template, who_table, aux_table) in EVENT_TEMPLATES.items():
+        rows = np.flatnonzero(records["kind"] == kind)
+        if not len(rows):
+            continue
+        sub = records[rows]
+        who = who_tables[who_table]
+        aux = who_tables[aux_table] if isinstance(aux_table, str) else aux_table
+        fmt = ('\t<event time="{0}.0" ' + template + '  />\n').format
+        lines[rows] = list(map(fmt, sub["time"].tolist(),
+                               [who[i] for i in sub["who"].tolist()],
+                               [link_ids[i] for i in sub["link"].tolist()],
+                               [aux[i] for i in sub["aux"].tolist()] if aux is not None
+                               else sub["aux"].tolist()))
+    return "".join(lines.tolist())
+
+
+def _write_plans(f, batch, grid, spec, rng, person_ids):
+    # One <person> per row of the batch: attributes, the selected plan as
+    # executed in the events, and its rejected copies (lower score)
+    ids = grid.link_ids
+    x   = (0.9 * grid.x[grid.to_node] + 0.1 * grid.x[grid.from_node]).round(2).tolist()   # activity on the link
+    y   = (0.9 * grid.y[grid.to_node] + 0.1 * grid.y[grid.from_node]).round(2).tolist()
+    n   = len(batch.is_car)
+    score          = rng.normal(120.0, 15.0, n).tolist()
+    rejected_first = (rng.random(n) < 0.5).tolist()
+
+    # Per trip index: {person row: trip row} and the legs as Python values
+    trips = []
+    for trip in batch.trips:
+        legs = {key: trip[key].tolist() for key in ("from", "link", "act", "dep", "arrive", "end", "mode")}
+        legs["row"] = dict(zip(trip["active"].tolist(), range(len(trip["active"]))))
+        if "car" in trip:
+            counts = trip["route_counts"]
+            first  = np.cumsum(counts) - counts
+            legs.update(car=dict(zip(trip["car"].tolist(), range(len(trip["car"])))),
+                        walk=trip["walk"].T.tolist(), depart=trip["depart"].tolist(),
+                        done=trip["done"].tolist(), route=[ids[l] for l in trip["route"].tolist()],
+                        route_first=first.tolist(), route_end=(first + counts).tolist(),
+                        distance=np.add.reduceat(grid.length[trip["route"]], first).tolist())
+        trips.append(legs)
+
+    for p in range(n):
+        person = person_ids[batch.first + p]
+        car    = bool(batch.is_car[p])
+        home   = int(batch.home[p])
+        lines  = [f'\t\t<activity type="home" link="{ids[home]}" x="{x[home]}" y="{y[home]}" '
+                  f'end_time="{_hms(batch.home_end[p])}" >\n\t\t</activity>\n']
+        for legs in trips[:batch.n_trips[p]]:
+            r = legs["row"][p]
+            start, link, dep, arrive, end = (legs[key][r] for key in ("from", "link", "dep", "arrive", "end"))
+            if car:
+                c = legs["car"][r]
+                depart, done = legs["depart"][c], legs["done"][c]
+                route = " ".join(legs["route"][legs["route_first"][c]:legs["route_end"][c]])
+                lines += [_leg("walk", dep, depart - dep, ids[start], ids[start], "car", legs["walk"][c][0]),
+                          _interaction(ids[start], x[start], y[start]),
+                          _leg("car", depart, done - depart, ids[start], ids[link], "car", legs["distance"][c],
+                               route=f"{ids[start]} {route}", vehicle=f"{person}:car"),
+                          _interaction(ids[link], x[link], y[link]),
+                          _leg("walk", done, arrive - done, ids[link], ids[link], "car", legs["walk"][c][1])]
+            else:
+                mode = MODES[legs["mode"][r]]
+                lines.append(_leg(mode, dep, arrive - dep, ids[start], ids[link], mode))
+            end_time = f' end_time="{_hms(end)}"' if end >= 0 else ""
+            lines.append(f'\t\t<activity type="{ACT_TYPES[legs["act"][r]]}" link="{ids[link]}" '
+                         f'x="{x[link]}" y="{y[link]}" start_time="{_hms(arrive)}"{end_time} >\n'
+                         f'\t\t</activity>\n')
+        body = "".join(lines).replace("\t\t<", "\t\t\t<")   # one level deeper than the person attributes
+
+        plans    = [f'\t\t<plan score="{score[p]:.6f}" selected="yes">\n{body}\t\t</plan>\n']
+        rejected = [f'\t\t<plan score="{score[p] - 5.0 * (i + 1):.6f}" selected="no">\n{body}\t\t</plan>\n'
+                    for i in range(spec.rejected_plans)]
+        plans    = rejected + plans if rejected_first[p] else plans + rejected
+        f.write(f'\t<person id="{person}">\n'
+                f'\t\t<attributes>\n'
+                f'\t\t\t<attribute name="age" class="java.lang.Integer">{batch.age[p]}</attribute>\n'
+                f'\t\t\t<attribute name="carAvailability" class="java.lang.String">'
+                f'{"all" if car else "none"}</attribute>\n'
+                f'\t\t\t<attribute name="hasLicense" class="java.lang.String">{"yes" if car else "no"}'
+                f'</attribute>\n'
+                f'\t\t\t<attribute name="householdId" class="java.lang.Integer">{(batch.first + p) // 3}'
+                f'</attribute>\n'
+                f'\t\t</attributes>\n'
+                f'{"".join(plans)}\t</person>\n\n')
+
+
+def _leg(mode, dep, duration, start_link, end_link, routing_mode, distance=None, route=None, vehicle=None):
+    route_type = "links" if route is not None else "generic"
+    extra = "" if distance is None else f' distance="{distance:.2f}"'
+    extra += "" if vehicle is None else f' vehicleRefId="{vehicle}"'
+    return (f'\t\t<leg mode="{mode}" dep_time="{_hms(dep)}" trav_time="{_hms(duration)}">\n'
+            f'\t\t\t<attributes>\n\t\t\t\t<attribute name="routingMode" '
+            f'class="java.lang.String">{routing_mode}</attribute>\n\t\t\t</attributes>\n'
+            f'\t\t\t<route type="{route_type}" start_link="{start_link}" end_link="{end_link}" '
+            f'trav_time="{_hms(duration)}"{extra}>{route or ""}</route>\n\t\t</leg>\n')
+
+
+def _interaction(link, x, y):
+    return f'\t\t<activity type="car interaction" link="{link}" x="{x}" y="{y}" max_dur="00:00:00" >\n\t\t</activity>\n'
+
+
+def _gzip_text(path):
+    # Text file, gzipped without a timestamp: the same spec gives byte-identical files
+    return io.TextIOWrapper(gzip.GzipFile(path, "wb", compresslevel=GZIP_LEVEL, mtime=0), encoding="utf-8")
+
+
+def _hms(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+# ── Typical days ──────────────────────────────────────────────────────────────
+def write_typical_days(path: str, n_days: int = 12, rng=None) -> pd.DataFrame:
+    """
+    TypicalDays.xlsx with n_days of DAY_NAMES (Winter_Weekday, Winter_Saturday,
+    ...): sheet "TimeSeries", 24 hourly rows per day, the day named on its
+    first row only, as prepare_profiles.read_time_series reads it.
+    """
+    rng   = rng if rng is not None else np.random.default_rng()
+    hours = np.arange(24)
+    days  = []
+    for name in DAY_NAMES[:n_days]:
+        season, kind = name.split("_")
+        sunrise, sunset, peak, price = SEASONS[season]
+        daylight = np.clip((hours - sunrise) / (sunset - sunrise), 0.0, 1.0)
+        solar    = peak * np.sin(np.pi * daylight) * rng.uniform(0.4, 1.0, 24)     # passing clouds
+        demand   = (25.0 * np.exp(-((hours - 8.0) / 1.5) ** 2) + 30.0 * np.exp(-((hours - 19.0) / 1.5) ** 2)
+                    - 0.02 * solar)                          # midday PV lowers the price
+        weekend  = {"Weekday": 0.0, "Saturday": -10.0, "Sunday": -20.0}[kind]
+        days.append(pd.DataFrame({
+            "Day":                     [name] + [None] * 23,
+            "Hour":                    hours,
+            "SolarRad_glob[W/m2]":     solar.round(3),
+            "ElectricityPrice[€/MWh]": (price + weekend + demand + rng.normal(0.0, 8.0, 24)).round(3),
+        }))
+    table = pd.concat(days, ignore_index=True)
+    table.to_excel(path, sheet_name="TimeSeries", index=False)
+    return table
+
+
+# ── Command line ──────────────────────────────────────────────────────────────
+def main(argv=None):
+    defaults = ScenarioSpec()
+    parser   = argparse.ArgumentParser(description="Write a synthetic EQASim output folder "
+                                                  "(network, events, plans, TypicalDays.xlsx).")
+    parser.add_argument("folder")
+    for name, value in asdict(defaults).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args(argv)
+    spec = ScenarioSpec(**{name: getattr(args, name) for name in asdict(defaults)})
+    generate_scenario(args.folder, spec)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -108,8 +108,12 @@ Created on Mon Feb 23 11:44:19 2026
 """
 
 import gzip
-import xml.etree.ElementTree as ET
+from array import array
+from xml.parsers import expat
+import numpy as np
 import pandas as pd
+import metrics
+from network_parser import arrays_from_dicts, link_rows
 
 # ── Configuration ─────────────────────────────────────────────────────────────
 DAY_START = 0
@@ -119,59 +123,116 @@ IGNORED_ACTIVITY_TYPES = {"car interaction","car_passenger interaction", "bike i
 
 
 # ── Plans parser ──────────────────────────────────────────────────────────────
-def parse_plans(plans_path: str) -> pd.DataFrame:
+def parse_plans(plans_path: str, persons=None, output_path=None, modes=None) -> pd.DataFrame:
     """
     Parse output_plans.xml.gz and return a DataFrame of real activities
     (home / work / leisure / ...) for each person.
 
+    The file is streamed with expat one <person> at a time: only the
+    activities of the selected plan are kept, straight into typed columns,
+    so neither the XML tree nor the unselected plans are ever in memory.
+
+    Parameters
+    ----------
+    plans_path  : str               — path to output_plans.xml(.gz)
+    persons     : set[str] or None  — if given, only these person ids are
+                                      kept (e.g. the drivers of the Step 2 cars)
+    output_path : str or None       — if given, the table is also written there as parquet
+    modes       : set[str] or None  — if given, only persons whose selected plan
+                                      has a leg in one of these modes are kept
+                                      ({"car"}: every possible driver, without
+                                      needing the events first)
+
     Returns
     -------
     pd.DataFrame with columns:
         person_id, activity_type, link_id, x, y, start_time_s
     """
-    records = []
-
-    with gzip.open(plans_path, "rb") as f:
-        tree = ET.parse(f)
-    root = tree.getroot()                       # is the population element
-
-    for person in root.iter("person"):
-        person_id = person.get("id")
-
-        selected_plan = None
-        for plan in person.findall("plan"):                 # Each person can have multiple plans (MATSim keeps rejected plans from previous iterations)
-            if plan.get("selected") == "yes":
-                selected_plan = plan
-                break
-        if selected_plan is None:                           # If somehow no selected plan exists, we skip that person entirely.
-            continue
-
-        for element in selected_plan:                       # Iterates over all direct children of the plan — these alternate between <activity> and <leg> elements
-            if element.tag != "activity":                   # We skip everything that is not and <activity>
-                continue
-            activity_type = element.get("type", "")
+    # Typed column buffers: one list per string column, array('d') per float column
+    person_col:   list[str] = []
+    type_col:     list[str] = []
+    link_col:     list      = []
+    x_col         = array("d")
+    y_col         = array("d")
+    start_col     = array("d")
+
+    # Parser state for the <person> currently being read
+    state = {
+        "person_id": None,      # None while outside a kept person
+        "in_plan":   False,     # inside the selected plan of that person
+        "done":      False,     # selected plan already read (MATSim keeps rejected plans from previous iterations)
+        "first_row": 0,         # first row of the selected plan in the column buffers
+        "has_mode":  False,     # the selected plan has a leg in one of modes
+    }
+    nan = float("nan")
+
+    def _start(tag, attrib):
+        if tag == "person":
+            person_id = attrib.get("id")
+            state["person_id"] = person_id if persons is None or person_id in persons else None
+            state["done"] = False
+
+        elif tag == "plan":
+            # Only the first plan with selected="yes" is read. If a person has
+            # no selected plan, nothing is recorded for them.
+            state["in_plan"] = (state["person_id"] is not None and not state["done"]
+                                and attrib.get("selected") == "yes")
+            state["first_row"] = len(person_col)
+            state["has_mode"]  = modes is None
+
+        elif tag == "leg" and state["in_plan"] and modes is not None:
+            if attrib.get("mode") in modes:
+                state["has_mode"] = True
+
+        elif tag == "activity" and state["in_plan"]:
+            activity_type = attrib.get("type", "")
             if activity_type in IGNORED_ACTIVITY_TYPES:     # If it is a MATSim internal interaction activity, skip it
-                continue
-
-            link_id    = element.get("link")                # Any of these can be None if the attribute is absent in the XML 
-            x          = element.get("x")                   # .get() returns None by default rather than raising an error
-            y          = element.get("y")
-            start_time = element.get("start_time")          # missing for first activity
-
-            records.append({
-                "person_id":     person_id,
-                "activity_type": activity_type,
-                "link_id":       link_id,
-                "x":             float(x) if x is not None else None,
-                "y":             float(y) if y is not None else None,
-                "start_time_s":  _to_seconds(start_time),   # NaN if missing
-            })
-
-    df = pd.DataFrame(records)
+                return
+            x = attrib.get("x")                             # Any of these can be None if the attribute is absent in the XML
+            y = attrib.get("y")
+            person_col.append(state["person_id"])
+            type_col.append(activity_type)
+            link_col.append(attrib.get("link"))
+            x_col.append(float(x) if x is not None else nan)
+            y_col.append(float(y) if y is not None else nan)
+            start_col.append(_to_seconds(attrib.get("start_time")))   # missing for first activity → NaN
+
+    def _end(tag):
+        if tag == "plan" and state["in_plan"]:
+            state["in_plan"] = False
+            state["done"]    = True
+            if not state["has_mode"]:
+                # No leg in modes: drop the activities recorded for this plan
+                first = state["first_row"]
+                for col in (person_col, type_col, link_col, x_col, y_col, start_col):
+                    del col[first:]
+        elif tag == "person":
+            state["person_id"] = None
+
+    parser = expat.ParserCreate()
+    parser.buffer_size = 1 << 20            # feed expat 1 MiB at a time instead of the 8 KiB default
+    parser.StartElementHandler = _start
+    parser.EndElementHandler   = _end
+
+    opener = gzip.open if plans_path.endswith(".gz") else open
+    with opener(plans_path, "rb") as f:
+        parser.ParseFile(f)
+
+    df = pd.DataFrame({
+        "person_id":     person_col,
+        "activity_type": type_col,
+        "link_id":       link_col,
+        "x":             np.frombuffer(x_col,     dtype=np.float64),
+        "y":             np.frombuffer(y_col,     dtype=np.float64),
+        "start_time_s":  np.frombuffer(start_col, dtype=np.float64),
+    })
 
     # First activity of day has no start_time → _to_seconds() returned NaN for it and now we assign 0
     df["start_time_s"] = df["start_time_s"].fillna(0.0)
 
+    if output_path is not None:
+        df.to_parquet(output_path, index=False)
+
     print(f"  → {df['person_id'].nunique():,} persons parsed from plans")
     print(f"  → Activity types found: {sorted(df['activity_type'].unique())}")
 
@@ -194,13 +255,14 @@ def _to_seconds(time_str: str) -> float:
 
 
 # ── Timetable builder ─────────────────────────────────────────────────────────
-def build_timetable(trips_df, plans_path=None, nodes=None, links=None):
+def build_timetable(trips_df, plans_path=None, nodes=None, links=None, network=None, ids=None,
+                    plans_df=None):
     """
     Build per-vehicle timetable of driving and parked episodes.
 
-    If plans_path, nodes and links are provided, each parked episode is
-    enriched with activity_type and (x, y) coordinates by matching against
-    the plans file.
+    If plans_path (or plans_df) and the network (either nodes and links, or
+    network) are provided, each parked episode is enriched with activity_type
+    and (x, y) coordinates by matching against the plans file.
 
     Parameters
     ----------
@@ -208,91 +270,119 @@ def build_timetable(trips_df, plans_path=None, nodes=None, links=None):
     plans_path : str or None  — path to output_plans.xml.gz
     nodes      : dict or None — node_id -> Node (from network_parser)
     links      : dict or None — link_id -> Link (from network_parser)
+    network    : NetworkArrays or None — columnar network (from
+                 network_parser.parse_network_arrays), used instead of nodes/links
+    ids        : IdTables or None — dictionaries of the integer person /
+                 vehicle / link ids in trips_df (interning.py), needed to
+                 match integer ids against the plans file
+    plans_df   : pd.DataFrame or None — plans already read with parse_plans(),
+                 used instead of plans_path (persons without a vehicle in
+                 trips_df simply do not match)
 
     Returns
     -------
     pd.DataFrame with episodes. Parked episodes include activity_type, x, y
     if plans data was provided.
     """
-    records = []
-
-    for vehicle_id, group in trips_df.groupby("vehicle_id"):
-        group = group.reset_index(drop=True)
-
-        # Parked episode before the first trip
-        first_trip = group.iloc[0]
-        if first_trip["t_start"] > DAY_START:
-            records.append({
-                "vehicle_id":   vehicle_id,
-                "episode_type": "parked",
-                "t_start":      DAY_START,
-                "t_end":        first_trip["t_start"],
-                "duration_s":   first_trip["t_start"] - DAY_START,
-                "link_id":      first_trip["from_link"],
-                "distance_m":   None
-            })
-
-        for i, row in group.iterrows():
-
-            # Driving episode
-            records.append({
-                "vehicle_id":   vehicle_id,
-                "episode_type": "driving",
-                "t_start":      row["t_start"],
-                "t_end":        row["t_end"],
-                "duration_s":   row["t_end"] - row["t_start"],
-                "link_id":      None,
-                "distance_m":   row["distance_m"]
-            })
-
-            # Parked episode between consecutive trips
-            if i + 1 < len(group):
-                next_trip = group.iloc[i + 1]
-                records.append({
-                    "vehicle_id":   vehicle_id,
-                    "episode_type": "parked",
-                    "t_start":      row["t_end"],
-                    "t_end":        next_trip["t_start"],
-                    "duration_s":   next_trip["t_start"] - row["t_end"],
-                    "link_id":      row["to_link"],
-                    "distance_m":   None
-                })
-
-        # Parked episode after the last trip
-        last_trip = group.iloc[-1]
-        if last_trip["t_end"] < DAY_END:
-            records.append({
-                "vehicle_id":   vehicle_id,
-                "episode_type": "parked",
-                "t_start":      last_trip["t_end"],
-                "t_end":        DAY_END,
-                "duration_s":   DAY_END - last_trip["t_end"],
-                "link_id":      last_trip["to_link"],
-                "distance_m":   None
-            })
-
-    timetable = pd.DataFrame(records)
+    lap = metrics.laps("timetable")          # phase timings, when metrics are enabled
+
+    # ── Episodes, built on whole columns ─────────────────────────────────────
+    # Trips grouped by vehicle (stable: within a vehicle the trips keep their
+    # order in trips_df, as groupby() would), then every trip k gives
+    #   - a parked episode before it, if it is the vehicle's first trip and starts after DAY_START
+    #   - its driving episode
+    #   - a parked episode until trip k+1 of the same vehicle, or, for the
+    #     last trip, a parked episode until DAY_END if it ends before it
+    trips     = trips_df.sort_values("vehicle_id", kind="stable")
+    vehicle   = trips["vehicle_id"].to_numpy()
+    t_start   = trips["t_start"].to_numpy(dtype=np.float64)
+    t_end     = trips["t_end"].to_numpy(dtype=np.float64)
+    from_link = trips["from_link"].to_numpy()
+    to_link   = trips["to_link"].to_numpy()
+    distance  = trips["distance_m"].to_numpy(dtype=np.float64)
+
+    n     = len(trips)
+    first = np.ones(n, dtype=bool)              # first trip of its vehicle
+    first[1:] = vehicle[1:] != vehicle[:-1]
+    last  = np.ones(n, dtype=bool)              # last trip of its vehicle
+    last[:-1] = first[1:]
+
+    lead  = np.flatnonzero(first & (t_start > DAY_START))
+    drive = np.arange(n)
+    gap   = np.flatnonzero(~last)
+    trail = np.flatnonzero(last & (t_end < DAY_END))
+    nxt   = gap + 1                             # the trip that ends each gap
+
+    parts = [
+        # (trip position, order within the trip, t_start, t_end, link, distance)
+        (lead,  0, np.full(len(lead), float(DAY_START)), t_start[lead], from_link[lead], np.nan),
+        (drive, 1, t_start,                              t_end,         None,            distance),
+        (gap,   2, t_end[gap],                           t_start[nxt],  to_link[gap],    np.nan),
+        (trail, 2, t_end[trail], np.full(len(trail), float(DAY_END)),   to_link[trail],  np.nan),
+    ]
+    pos  = np.concatenate([p[0] * 3 + p[1] for p in parts])
+    take = np.argsort(pos, kind="stable")       # back into per-vehicle record order
+
+    ep_start = np.concatenate([p[2] for p in parts])[take]
+    ep_end   = np.concatenate([p[3] for p in parts])[take]
+    ep_link  = np.concatenate([
+        np.full(len(p[0]), None, dtype=object) if p[4] is None else p[4].astype(object)
+        for p in parts])[take]
+    dist     = np.concatenate([
+        np.broadcast_to(np.asarray(p[5], dtype=np.float64), len(p[0])) for p in parts])[take]
+    is_drive = np.concatenate([np.full(len(p[0]), p[1] == 1) for p in parts])[take]
+
+    timetable = pd.DataFrame({
+        "vehicle_id":   np.concatenate([vehicle[p[0]] for p in parts])[take],
+        "episode_type": np.where(is_drive, "driving", "parked").astype(object),
+        "t_start":      ep_start,
+        "t_end":        ep_end,
+        "duration_s":   ep_end - ep_start,
+        "link_id":      ep_link,
+        "distance_m":   dist,
+    })
     timetable = timetable.sort_values(["vehicle_id", "t_start"]).reset_index(drop=True)
 
+    # Integer link ids: keep them integer, with <NA> for driving episodes
+    if pd.api.types.is_integer_dtype(trips_df["to_link"]):
+        timetable["link_id"] = timetable["link_id"].astype("Int32")
+    lap("episodes", rows=len(trips_df))
+
     # ── Enrich with activity types if plans data is provided ─────────────────
-    if plans_path is not None and nodes is not None and links is not None:
+    has_plans = plans_df is not None or plans_path is not None
+    if has_plans and (network is not None or (nodes is not None and links is not None)):
         print("  → Enriching parked episodes with activity types...")
-        plans_df = parse_plans(plans_path)
+        if plans_df is None:
+            # Only the drivers of the timetable's vehicles can match (person = vehicle id without ":car")
+            vehicles = ids.vehicles.values if ids is not None else trips_df["vehicle_id"].unique()
+            persons  = {v.replace(":car", "") for v in vehicles}
+            plans_df = parse_plans(plans_path, persons=persons)
+            lap("parse_plans", rows=len(plans_df))
         # plans_df.to_parquet("output/plans_debug.parquet")     # If you want to save the plans in outputs
-        timetable = _match_activities(timetable, plans_df, nodes, links)
+        timetable = _match_activities(timetable, plans_df, nodes, links, network, ids)
+        lap("match_activities", rows=len(timetable))
 
     return timetable
 
 
 # ── Activity matching ─────────────────────────────────────────────────────────
-def _match_activities(timetable_df, plans_df, nodes, links):
+def _match_activities(timetable_df, plans_df, nodes, links, network=None, ids=None):
     """
     Enrich each parked episode with activity_type and (x, y) from plans.
-
-    Matching key: person_id + link_id + activity start_time_s within (t_start, t_end)
-    Fallback for unmatched: activity_type = "unknown", (x,y) from network node.
+    With ids, the timetable holds integer ids: the plans' person / link
+    strings are converted to the same ids and matched as integers.
+
+    All parked episodes are matched at once with joins, in this order:
+      1. person_id + link_id + activity start_time_s within [t_start, t_end]
+         (merge_asof: the first such activity)
+      2. person_id + link_id only: the first activity on that link in the plan
+      3. fallback: activity_type = "unknown", (x,y) from network node
+         (the link's to_node, gathered from the network arrays; links/nodes
+         dicts are converted to them with arrays_from_dicts).
     """
     
+    lap = metrics.laps("timetable.match")
+
     # Initialises the three new columns for all episodes
     timetable_df = timetable_df.copy()
     timetable_df["activity_type"] = None
@@ -304,54 +394,98 @@ def _match_activities(timetable_df, plans_df, nodes, links):
     parked_mask = timetable_df["episode_type"] == "parked"
 
     # Derive person_id from vehicle_id for parked episodes only
-    timetable_df.loc[parked_mask, "person_id"] = (
-        timetable_df.loc[parked_mask, "vehicle_id"].str.replace(":car", "", regex=False))
-
-
-    # Build lookup: (person_id, link_id) -> rows in plans_df so that future lookups are faster
-    plans_lookup = plans_df.groupby(["person_id", "link_id"])
-
-    matched   = 0
-    unmatched = 0
-
-    # Iterates only over parked episodes. 
-    # idx is the original DataFrame index. 
-    # row is the full row as a Series.
-    
-    for idx, row in timetable_df[parked_mask].iterrows():
-        person_id = row["person_id"]
-        link_id   = str(row["link_id"])
-
-        key = (person_id, link_id)
-
-        if key in plans_lookup.groups:      # Checks if this (person_id, link_id) combination exists in the plans
-            candidates = plans_df.loc[plans_lookup.groups[key]]
-            # plans_lookup.groups[key] returns the integer indices of the matching rows in plans_df 
-            # .loc[...] retrieves them (the matching rows)
-
-            match = candidates
-            
-
-            if len(match) >= 1:
-                timetable_df.at[idx, "activity_type"] = match.iloc[0]["activity_type"]
-                timetable_df.at[idx, "x"]             = match.iloc[0]["x"]
-                timetable_df.at[idx, "y"]             = match.iloc[0]["y"]
-                # timetable_df.at[idx, "match_status"]  = "matched"
-                matched += 1
-                continue
-
-        # No match — fallback to network node coordinates
-        unmatched += 1
-        timetable_df.at[idx, "activity_type"] = "unknown"
-        # timetable_df.at[idx, "match_status"]  = "unmatched"
-        
-        if link_id in links:
-            to_node_id = links[link_id].to_node
-            if to_node_id in nodes:
-                timetable_df.at[idx, "x"] = nodes[to_node_id].x
-                timetable_df.at[idx, "y"] = nodes[to_node_id].y
-
+    if ids is None:
+        timetable_df.loc[parked_mask, "person_id"] = (
+            timetable_df.loc[parked_mask, "vehicle_id"].str.replace(":car", "", regex=False))
+    else:
+        # Same rule applied once per entry of the vehicle dictionary, then gathered by vehicle id
+        vehicle_person = ids.persons.lookup([v.replace(":car", "") for v in ids.vehicles.values])
+        timetable_df["person_id"] = pd.array([pd.NA] * len(timetable_df), dtype="Int32")
+        timetable_df.loc[parked_mask, "person_id"] = vehicle_person[
+            timetable_df.loc[parked_mask, "vehicle_id"].to_numpy()]
+
+        # Plans in the same integer ids; persons / links unknown to the events cannot match
+        plans_df = plans_df.assign(
+            person_id = ids.persons.lookup(plans_df["person_id"]),
+            link_id   = ids.links.lookup(plans_df["link_id"]),
+        )
+        plans_df = plans_df[(plans_df["person_id"] >= 0) & (plans_df["link_id"] >= 0)]
+
+
+    # ── Candidates ───────────────────────────────────────────────────────────
+    # One row per parked episode, with its timetable row number in "row"
+    rows   = np.flatnonzero(parked_mask.to_numpy())
+    parked = pd.DataFrame({
+        "row":       rows,
+        "person_id": timetable_df["person_id"].to_numpy()[rows],
+        "link_id":   timetable_df["link_id"].to_numpy()[rows],
+        "t_start":   timetable_df["t_start"].to_numpy()[rows],
+        "t_end":     timetable_df["t_end"].to_numpy()[rows],
+    })
+    columns  = ["person_id", "link_id", "start_time_s", "activity_type", "x", "y"]
+    plans_df = plans_df[columns].dropna(subset=["person_id", "link_id"])
+    if ids is None:
+        parked["link_id"] = parked["link_id"].astype(str)          # plans hold link ids as strings
+    else:
+        # merge keys must share a dtype: plain int64 on both sides
+        parked   = parked.astype({"person_id": np.int64, "link_id": np.int64})
+        plans_df = plans_df.astype({"person_id": np.int64, "link_id": np.int64})
+    key = ["person_id", "link_id"]
+    lap("prepare", rows=len(plans_df))
+
+    # 1) Activity of the same person on the same link starting within the
+    #    parked window: the first activity with t_start <= start_time_s <= t_end
+    in_window = pd.merge_asof(
+        parked.sort_values("t_start", kind="stable"),
+        plans_df.sort_values("start_time_s", kind="stable"),
+        left_on="t_start", right_on="start_time_s", by=key, direction="forward",
+    ).set_index("row").reindex(rows)
+    hit_window = (in_window["start_time_s"] <= in_window["t_end"]).to_numpy()
+    lap("window", rows=len(parked))
+
+    # 2) Otherwise, the first activity of that person on that link in the plan,
+    #    whatever its time (e.g. start times shifted by a walk leg)
+    on_key = parked.merge(plans_df.drop_duplicates(key), on=key, how="left")
+    hit_key = ~hit_window & on_key["activity_type"].notna().to_numpy()
+    lap("link", rows=len(parked))
+
+    # 3) Otherwise "unknown", placed at the to_node of the parking link
+    miss = ~hit_window & ~hit_key
+
+    activity_type = np.where(hit_window, in_window["activity_type"].to_numpy(dtype=object),
+                             on_key["activity_type"].to_numpy(dtype=object))
+    activity_type[miss] = "unknown"
+    x = np.where(hit_window, in_window["x"].to_numpy(dtype=np.float64), on_key["x"].to_numpy(dtype=np.float64))
+    y = np.where(hit_window, in_window["y"].to_numpy(dtype=np.float64), on_key["y"].to_numpy(dtype=np.float64))
+
+    # ── Fallback coordinates ─────────────────────────────────────────────────
+    miss_links = parked["link_id"].to_numpy()[miss]
+    x[miss] = np.nan
+    y[miss] = np.nan
+    if len(miss_links):
+        # Gathered from the network arrays by link row; the Link / Node dicts
+        # are converted to the same arrays first (as in build_nodes)
+        if network is None:
+            network = arrays_from_dicts(links, nodes)
+            if ids is not None:
+                miss_links = ids.links.decode(miss_links)
+        link_row = link_rows(network, miss_links)
+        known    = link_row >= 0
+        xy       = network.node_xy[network.to_node[link_row[known]]]
+        x[np.flatnonzero(miss)[known]] = xy[:, 0]
+        y[np.flatnonzero(miss)[known]] = xy[:, 1]
+    lap("fallback", rows=len(miss_links))
+
+    timetable_df.loc[parked_mask, "activity_type"] = activity_type
+    timetable_df.loc[parked_mask, "x"]             = x
+    timetable_df.loc[parked_mask, "y"]             = y
+    lap("assign", rows=len(parked))
+
+    matched   = int(hit_window.sum() + hit_key.sum())
+    unmatched = int(miss.sum())
     print(f"  → Matched: {matched:,} | Unmatched (fallback): {unmatched:,}")
+    print(f"    ({int(hit_window.sum()):,} within the parked window, "
+          f"{int(hit_key.sum()):,} on person + link only)")
     return timetable_df
 
 